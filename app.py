@@ -1,14 +1,35 @@
 # app.py - Calmic Corrosion Detection AI
-from flask import Flask, request, redirect, url_for, send_file, render_template, jsonify, make_response
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, request, redirect, url_for, send_file, render_template, jsonify, make_response, Response, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from ultralytics import YOLO
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import check_password_hash
 from PIL import Image
+from inference import scheduler_from_env, severity_from_detections, summary_text
+from result_cache import cache_from_env, link_or_copy
+import bulk_ingest
+from camera_stream import FrameGate
+import stats as detection_stats
+import reports_query
+import database
+import instances as instance_store
+import rendering
+import derivatives
+import tiling
+import preprocess
+import postprocess
+import telemetry
+import storage
+from model_loader import loader_from_env
+from jobs import queue_from_env
 import os
 import uuid
-import sqlite3
+import json
 import base64
-from io import BytesIO
+import zipfile
+from urllib.parse import urlencode
 import pytz
 from datetime import datetime
 
@@ -24,7 +45,7 @@ for folder in [app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'], 'static
 # ===========================
 # Timezone
 # ===========================
-tz = pytz.timezone('Asia/Kuala_Lumpur')
+tz = database.TIMEZONE  # shared with the review stamps (database.local_timestamp)
 
 # ===========================
 # User Authentication
@@ -40,9 +61,11 @@ class User(UserMixin):
     def check_password(pw_hash, password):
         return check_password_hash(pw_hash, password)
 
+# Stored pre-hashed (generate_password_hash output for the same demo passwords):
+# hashing them on every boot cost two scrypt rounds, ~0.4 s of import time
 users = [
-    User(1, "admin", generate_password_hash("admin123"), "admin"),
-    User(2, "user", generate_password_hash("user123"), "user")
+    User(1, "admin", "scrypt:32768:8:1$Hepsy0ZlwtUCZ39e$46ed5c40a4b94af6768db1a96d92f07275e045bbfa1ef42e5fd629a364dd56dac7b70db5c191d16ed10726bf1c97404e2e0c16cacf50ca56054178e186263402", "admin"),
+    User(2, "user", "scrypt:32768:8:1$k7YnIsLQMhjGdgT5$bff883f4efc84695d0ddffbebed99f88d759cb3998774a43541385bd8a459e93975c7385739ea80f15f23bb3241a90a4967405cd2dd6ad4456ceda5a1fdc5f39", "user")
 ]
 
 login_manager = LoginManager()
@@ -56,73 +79,183 @@ def load_user(user_id):
 # ===========================
 # Initialize Database
 # ===========================
-def init_db():
-    conn = sqlite3.connect('corrosion.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS detections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            original_image TEXT NOT NULL,
-            result_image TEXT NOT NULL,
-            result_text TEXT,
-            high_severity INTEGER DEFAULT 0,
-            medium_severity INTEGER DEFAULT 0,
-            low_severity INTEGER DEFAULT 0,
-            confirmed BOOLEAN DEFAULT FALSE,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            comments TEXT DEFAULT '',
-            custom_name TEXT DEFAULT ''
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-init_db()
+database.init_db()
 
 # ===========================
 # Load YOLO Model
 # ===========================
-try:
-    model = YOLO('best.pt')  # Your trained model
-except Exception as e:
-    print("❌ Model not loaded:", str(e))
-    model = None
+MODEL_PATH = 'best.pt'
+PREDICT_SETTINGS = {'conf': 0.3, 'iou': 0.2, 'max_det': 10}
+
+if int(os.environ.get('MODEL_WORKERS', 0)):
+    # Production serving: N model processes fed through shared memory; this process never imports ultralytics
+    import model_workers
+    scheduler = model_loader = model_workers.pool_from_env(MODEL_PATH, dict(PREDICT_SETTINGS, retina_masks=True),
+                                                           IMPORT_STARTED)
+else:
+    # All forward passes go through the micro-batching scheduler; images queue there until the model is attached
+    scheduler = scheduler_from_env()
+
+    # MODEL_LOADING=background: the port binds immediately and /readyz turns 200 once the model is warm
+    model_loader = loader_from_env(MODEL_PATH, scheduler, dict(PREDICT_SETTINGS, retina_masks=True), IMPORT_STARTED)
+
+# Results keyed by image content, weights checksum and thresholds
+result_cache = cache_from_env(app.config['RESULT_FOLDER'], MODEL_PATH)
+
+# One in-flight frame per live camera client; stale frames are dropped
+frame_gate = FrameGate()
+
+# Encoded result-image variants served by /results/<id>/image
+render_cache = rendering.cache_from_env()
+
+# Optional tiled inference for large photos: (enabled, min_side, tile, overlap)
+TILING = tiling.settings_from_env()
+tile_stats_recorder = tiling.TileStats()
+
+# Thumbnails/previews built in the background as detections are stored
+derivative_store = derivatives.store_from_env(app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'])
+
+# Background pool for opt-in asynchronous uploads (?async=1 or ASYNC_UPLOADS=1)
+job_queue = queue_from_env()
+
+# Uploads named by content hash in sharded folders; identical photos are stored once
+upload_store = storage.UploadStore(app.config['UPLOAD_FOLDER'])
+
+# Files of deleted detections are unlinked in batches off the request path (FILE_DELETE_BATCH, FILE_DELETE_RETRIES)
+file_deleter = storage.deleter_from_env()
+
+# Orphaned uploads/results/markup/PDFs/temp files reclaimed every GC_INTERVAL_HOURS (off by default)
+garbage_collector = storage.gc_from_env(app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'])
+
+# Build each report's PDF right after upload so the first download is instant
+PDF_PREGENERATE = os.environ.get('PDF_PREGENERATE', '0').lower() in ('1', 'true', 'yes')
+
+# ===========================
+# Metrics
+# ===========================
+# Per-request stage timings (TIMING_HEADERS, SLOW_REQUEST_MS, SLOW_REQUEST_LOG); scraped from /metrics
+request_tracer = telemetry.tracer_from_env()
+telemetry.registry.collect('corrosion_scheduler', lambda: scheduler.stats() if model_loader.available else None)
+telemetry.registry.collect('corrosion_model', lambda: model_loader.status()['startup'])
+telemetry.registry.collect('corrosion_result_cache', lambda: result_cache.stats() if result_cache else None)
+telemetry.registry.collect('corrosion_camera_frames', lambda: frame_gate.counters)
+telemetry.registry.collect('corrosion_render_cache', lambda: render_cache.stats())
+telemetry.registry.collect('corrosion_derivatives', lambda: derivative_store.stats())
+telemetry.registry.collect('corrosion_tiling', lambda: tile_stats_recorder.stats())
+telemetry.registry.collect('corrosion_uploads', lambda: upload_store.stats())
+telemetry.registry.collect('corrosion_storage_gc', lambda: garbage_collector.stats())
+telemetry.registry.collect('corrosion_file_deleter', lambda: file_deleter.stats())
+
+@app.before_request
+def start_trace():
+    request_tracer.before(request.endpoint)
+
+@app.after_request
+def finish_trace(response):
+    return request_tracer.after(response, request.method, request.path)
 
 # ===========================
 # Prediction Function
 # ===========================
-def predict_image(filepath):
-    if not model or not os.path.exists(filepath):
-        return "no_detection.jpg", "Model not available", 0, 0, 0
+def prediction(result_filename, result_text, high=0, med=0, low=0, instances=None, tiling=None):
+    # Share of the photo flagged as corroded: instance areas are fractions of the original image
+    coverage = round(min(sum(instance[7] for instance in instances or ()), 1.0), 4)
+    return {'result_filename': result_filename, 'result_text': result_text, 'high': high, 'med': med, 'low': low,
+            'instances': instances, 'tiling': tiling, 'coverage': coverage}
+
+def use_tiling(size, tiled=None):
+    """Tile when asked to, or (TILED_INFERENCE=1) when the photo's long side exceeds TILE_MIN_SIDE."""
+    enabled, min_side, _, _ = TILING
+    if tiled is None:
+        tiled = enabled and max(size) > min_side
+    return tiled and max(size) > TILING[2]
+
+def predict_image(filepath, tiled=None):
+    if not model_loader.available or not os.path.exists(filepath):
+        return prediction("no_detection.jpg", "Model not available")
     try:
-        image = Image.open(filepath).convert("RGB").resize((640, 640))
-        results = model(
-            source=image,
-            conf=0.3,
-            iou=0.2,
-            max_det=10,
-            retina_masks=True
-        )
-        # Count severity
-        high = med = low = 0
-        if results[0].boxes:
-            for box in results[0].boxes:
-                conf = box.conf.item()
-                if conf > 0.7:
-                    high += 1
-                elif conf > 0.5:
-                    med += 1
-                else:
-                    low += 1
-
-        result_text = f"Corrosion Detected: PASS ({high+med+low} spot(s))<br>Severity: High={high}, Medium={med}, Low={low}"
+        tile_settings = None
+        with telemetry.stage('decode'), Image.open(filepath) as source:
+            size = source.size
+            if use_tiling(source.size, tiled):
+                # Full-resolution overlapping tiles; coordinates stay in source pixels
+                image = source.convert("RGB")
+                tile_settings = {'tile': TILING[2], 'overlap': TILING[3]}
+            else:
+                frame = preprocess.letterbox(source)
+                image = frame.array
         result_filename = f"result_{uuid.uuid4().hex[:8]}.jpg"
         result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-        Image.fromarray(results[0].plot()).save(result_path)
-        return result_filename, result_text, high, med, low
+
+        def to_source(detections):
+            return detections if tile_settings else preprocess.to_original(detections, frame)
+
+        # Identical pixels + weights + backend + thresholds: reuse the earlier result. Keyed on what is
+        # actually loaded (a missing export falls back to PyTorch), so only once the model is ready
+        cached = cache_key = None
+        if result_cache and model_loader.ready:
+            with telemetry.stage('cache_lookup'):
+                cache_key = result_cache.key_for(image, artifact=model_loader.artifact, **PREDICT_SETTINGS,
+                                                 **(tile_settings or {}), backend=model_loader.active_backend,
+                                                 precision=model_loader.active_precision)
+                cached = result_cache.get(cache_key)
+            telemetry.CACHE_LOOKUPS.inc(outcome='hit' if cached else 'miss')
+        if cached:
+            telemetry.count_severity('predict_image', cached['high'], cached['med'], cached['low'])
+            instances = instance_store.from_detections(to_source(cached['detections']), size)
+            if rendering.EAGER_RESULTS and cached['image_path']:
+                link_or_copy(cached['image_path'], result_path)
+            elif rendering.EAGER_RESULTS:
+                rendering.save_overlay(image if tile_settings else filepath, instances, result_path)
+            return prediction(result_filename, cached['result_text'], cached['high'], cached['med'], cached['low'],
+                              instances)
+
+        tile_stats = None
+        if tile_settings:
+            with telemetry.stage('inference'):
+                detections, tile_stats = tiling.predict_tiled(image, scheduler, tile_settings['tile'],
+                                                              tile_settings['overlap'], retina_masks=True,
+                                                              **PREDICT_SETTINGS)
+            tile_stats_recorder.record(tile_stats)
+            print(f"🧩 {filepath}: {tile_stats['tiles']} tiles, {tile_stats['detections']} spot(s) "
+                  f"in {tile_stats['latency_ms']} ms")
+            high, med, low = severity_from_detections(detections, size[0] * size[1])
+        else:
+            with telemetry.stage('inference'):
+                result = scheduler.predict(
+                    image,
+                    retina_masks=True,
+                    **PREDICT_SETTINGS
+                )
+            with telemetry.stage('postprocess'):
+                found = postprocess.from_result(result)
+                # Severity from confidence and the share of the photo (padding excluded) each mask covers
+                high, med, low = postprocess.severity_counts(found, preprocess.content_area(frame))
+                # Cached in model-input pixels: the key covers the letterboxed pixels, not the source size
+                detections = postprocess.to_dicts(found)
+        result_text = summary_text(high, med, low)
+        telemetry.count_severity('predict_image', high, med, low)
+        with telemetry.stage('postprocess'):
+            instances = instance_store.from_detections(to_source(detections), size)
+
+        # Lazy mode: /results/<id>/image draws the overlay when someone opens it
+        if rendering.EAGER_RESULTS:
+            rendering.save_overlay(image if tile_settings else filepath, instances, result_path)
+
+        if cache_key:
+            with telemetry.stage('cache_store'):
+                result_cache.put(cache_key, {
+                    'result_text': result_text,
+                    'high': high,
+                    'med': med,
+                    'low': low,
+                    'detections': detections,
+                }, result_path if rendering.EAGER_RESULTS else None)
+        return prediction(result_filename, result_text, high, med, low, instances, tile_stats)
     except Exception as e:
         print("❌ Predict error:", str(e))
-        return "no_detection.jpg", f"Error: {str(e)}", 0, 0, 0
+        telemetry.ERRORS.inc(stage='predict')
+        return prediction("no_detection.jpg", f"Error: {str(e)}")
 
 # ===========================
 # Routes
@@ -131,24 +264,24 @@ def predict_image(filepath):
 def home():
     stats = {'total': 0, 'confirmed': 0, 'high': 0, 'med': 0, 'low': 0}
     try:
-        conn = sqlite3.connect('corrosion.db')
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT * FROM detections")
-        rows = c.fetchall()
-        conn.close()
-        stats = {
-            'total': len(rows),
-            'confirmed': sum(1 for r in rows if r['confirmed']),
-            'high': sum(r['high_severity'] for r in rows),
-            'med': sum(r['medium_severity'] for r in rows),
-            'low': sum(r['low_severity'] for r in rows)
-        }
+        with database.connection() as conn:
+            stats = detection_stats.get_totals(conn)
     except Exception as e:
         print("📊 Stats error:", str(e))
     dark_mode = request.cookies.get('dark_mode') == '1'
     return render_template('home.html', stats=stats, dark_mode=dark_mode)
 
+@app.route('/api/stats')
+def api_stats():
+    bucket = request.args.get('bucket', 'day')
+    try:
+        with database.connection() as conn:
+            totals = detection_stats.get_totals(conn)
+            series = detection_stats.time_buckets(conn, bucket, request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, totals=totals, bucket=bucket, series=series)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -168,6 +301,59 @@ def logout():
     logout_user()
     return redirect('/login')
 
+def process_upload(filepath, filename, progress=None, tiled=None, original_name=None):
+    """Run inference on a saved upload, store the detection and return its summary."""
+    if progress:
+        progress('inference', 10)
+    try:
+        predicted = predict_image(filepath, tiled)
+        result_filename, result_text = predicted['result_filename'], predicted['result_text']
+        high, med, low = predicted['high'], predicted['med'], predicted['low']
+        if progress:
+            progress('saving', 80)
+
+        # Save to DB
+        detection_id = None
+        timestamp = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            detection_id = database.save_detection(filename, result_filename, result_text, high, med, low, timestamp,
+                                                   instances=predicted['instances'], original_name=original_name)
+        except Exception as e:
+            print("❌ DB Save failed:", str(e))
+    finally:
+        # Saved (or failed): a deletion queued for this upload may go ahead once nothing references it
+        upload_store.release(filename)
+
+    if detection_id:
+        derivative_store.submit(detection_id)
+    if detection_id and PDF_PREGENERATE:
+        from generate_pdf import pregenerate_report
+        pregenerate_report(detection_id, database.get_detection(detection_id),
+                           app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'])
+
+    return {
+        'id': detection_id,
+        'filename': filename,
+        'result_filename': result_filename,
+        'result_text': result_text,
+        'high': high,
+        'med': med,
+        'low': low,
+        'original_url': f"/static/uploads/{filename}",
+        'result_url': f"/results/{detection_id}/image" if detection_id else f"/static/results/{result_filename}",
+        'tiling': predicted['tiling'],
+        'coverage': predicted['coverage'],
+    }
+
+def wants_async():
+    flag = request.values.get('async', os.environ.get('ASYNC_UPLOADS', '0'))
+    return flag.lower() in ('1', 'true', 'yes')
+
+def requested_tiling():
+    """?tiled=1 / ?tiled=0 overrides TILED_INFERENCE for one upload."""
+    flag = request.values.get('tiled')
+    return None if flag is None else flag.lower() in ('1', 'true', 'yes')
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -176,95 +362,258 @@ def upload_file():
     if file.filename == '':
         return redirect('/')
     if file:
-        filename = file.filename
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        result_filename, result_text, high, med, low = predict_image(filepath)
-
-        # Save to DB
-        timestamp = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
-        try:
-            conn = sqlite3.connect('corrosion.db')
-            c = conn.cursor()
-            c.execute('''
-                INSERT INTO detections 
-                (original_image, result_image, result_text, high_severity, medium_severity, low_severity, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (filename, result_filename, result_text, high, med, low, timestamp))
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print("❌ DB Save failed:", str(e))
+        original_name = os.path.basename(file.filename)
+        with telemetry.stage('save'):
+            filename = upload_store.put_stream(file.stream, original_name)
+        filepath = upload_store.path(filename)
+
+        if wants_async():
+            job_id = job_queue.submit(process_upload, filepath, filename, tiled=requested_tiling(),
+                                      original_name=original_name)
+            return jsonify(
+                success=True,
+                job_id=job_id,
+                status_url=f"/jobs/{job_id}",
+                events_url=f"/jobs/{job_id}/events"
+            ), 202
+
+        detection = process_upload(filepath, filename, tiled=requested_tiling(), original_name=original_name)
 
         dark_mode = request.cookies.get('dark_mode') == '1'
         return render_template('result.html',
             filename=filename,
-            result_filename=result_filename,
-            result_text=result_text,
+            detection_id=detection['id'],
+            result_filename=detection['result_filename'],
+            result_url=detection['result_url'],
+            result_text=detection['result_text'],
             custom_name='',
             comments='',
             dark_mode=dark_mode
         )
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify(success=False, error="Job not found"), 404
+    return jsonify(success=True, **job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    if not job_queue.get(job_id):
+        return jsonify(success=False, error="Job not found"), 404
+
+    def stream():
+        version = -1
+        while True:
+            job = job_queue.wait(job_id, version)
+            if job is None:
+                return
+            if job['version'] != version:
+                version = job['version']
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            if job['status'] in ('done', 'failed'):
+                return
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def run_bulk_ingest(source, is_zip, progress=None):
+    timestamp = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
+    if progress:
+        progress('ingesting', 5)
+    if is_zip and isinstance(source, str):
+        # Archive spooled to static/temp for an async job; remove it once read
+        try:
+            with open(source, 'rb') as f:
+                return run_bulk_ingest(f, True)
+        finally:
+            os.remove(source)
+    entries = bulk_ingest.iter_zip(source) if is_zip else bulk_ingest.iter_directory(source)
+    summary = bulk_ingest.ingest(entries, scheduler, app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'], timestamp,
+                                 store=upload_store)
+    for detection_id in summary['ids']:
+        derivative_store.submit(detection_id)
+    return summary
+
+@app.route('/bulk_upload', methods=['POST'])
+@login_required
+def bulk_upload():
+    if not model_loader.available:
+        return jsonify(success=False, error="Model not available"), 503
+
+    directory = request.form.get('directory', '').strip()
+    if directory:
+        # Server-side folders are an admin-only intake
+        if current_user.role != 'admin':
+            return jsonify(success=False, error="Admin only"), 403
+        if not os.path.isdir(directory):
+            return jsonify(success=False, error="Directory not found"), 400
+        source, is_zip = directory, False
+    elif 'file' in request.files and request.files['file'].filename:
+        file = request.files['file']
+        if not zipfile.is_zipfile(file.stream):
+            return jsonify(success=False, error="Upload must be a ZIP archive"), 400
+        file.stream.seek(0)
+        source, is_zip = file.stream, True
+    else:
+        return jsonify(success=False, error="No ZIP file or directory provided"), 400
+
+    if wants_async():
+        if is_zip:
+            os.makedirs('static/temp', exist_ok=True)
+            archive_path = os.path.join('static/temp', f"bulk_{uuid.uuid4().hex[:8]}.zip")
+            request.files['file'].save(archive_path)
+            source = archive_path
+        job_id = job_queue.submit(run_bulk_ingest, source, is_zip)
+        return jsonify(success=True, job_id=job_id, status_url=f"/jobs/{job_id}",
+                       events_url=f"/jobs/{job_id}/events"), 202
+
+    try:
+        summary = run_bulk_ingest(source, is_zip)
+        return jsonify(success=True, **summary)
+    except Exception as e:
+        print("❌ Bulk upload failed:", str(e))
+        return jsonify(success=False, error=str(e)), 500
+
 @app.route('/save_comment', methods=['POST'])
 def save_comment():
     data = request.get_json()
     try:
-        conn = sqlite3.connect('corrosion.db')
-        c = conn.cursor()
-        c.execute("UPDATE detections SET comments = ? WHERE result_image = ?", 
-                  (data['comment'], data['result_image']))
-        conn.commit()
-        conn.close()
+        database.update_by_result_image('comments', data['comment'], data['result_image'])
+        invalidate_pdf_reports(data['result_image'])
         return jsonify(success=True)
     except Exception as e:
         return jsonify(success=False, error=str(e)), 500
 
+def invalidate_pdf_reports(result_image):
+    from generate_pdf import invalidate_reports
+    rows = database.query_all("SELECT id FROM detections WHERE result_image = ?", (result_image,))
+    invalidate_reports([row['id'] for row in rows])
+
 @app.route('/rename_report', methods=['POST'])
 def rename_report():
     data = request.get_json()
     try:
-        conn = sqlite3.connect('corrosion.db')
-        c = conn.cursor()
-        c.execute("UPDATE detections SET custom_name = ? WHERE result_image = ?", 
-                  (data['custom_name'], data['result_image']))
-        conn.commit()
-        conn.close()
+        database.update_by_result_image('custom_name', data['custom_name'], data['result_image'])
+        invalidate_pdf_reports(data['result_image'])
         return jsonify(success=True)
     except Exception as e:
         return jsonify(success=False, error=str(e)), 500
 
+def report_page_args():
+    filters = {key: request.args.get(key, '').strip() for key in reports_query.FILTER_KEYS}
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    return filters, request.args.get('cursor') or None, limit
+
 @app.route('/reports')
 @login_required
 def view_reports():
     try:
-        if not os.path.exists('corrosion.db'):
+        if not os.path.exists(database.DB_PATH):
             return "<h3>❌ Database not found! Run init_db.py</h3><br><a href='/'>Back</a>"
 
-        conn = sqlite3.connect('corrosion.db')
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT * FROM detections ORDER BY timestamp DESC")
-        rows = c.fetchall()
-        conn.close()
+        filters, cursor, limit = report_page_args()
+        try:
+            with database.connection() as conn:
+                rows, next_cursor = reports_query.query_reports(conn, filters, cursor, limit)
+        except ValueError as e:
+            abort(400, str(e))  # bad cursor or filter value, as /api/reports answers
 
         dark_mode = request.cookies.get('dark_mode') == '1'
-        return render_template('reports.html', reports=rows, dark_mode=dark_mode)
+        filter_query = urlencode({key: value for key, value in filters.items() if value})
+        return render_template('reports.html', reports=rows, filters=filters, filter_query=filter_query,
+                               next_cursor=next_cursor, is_first_page=cursor is None, limit=limit,
+                               dark_mode=dark_mode)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print("❌ Reports Error:", str(e))
         return f"<h3>❌ Error loading reports: {str(e)}</h3><br><a href='/'>Back</a>"
 
+@app.route('/api/reports')
+@login_required
+def api_reports():
+    filters, cursor, limit = report_page_args()
+    try:
+        with database.connection() as conn:
+            rows, next_cursor = reports_query.query_reports(conn, filters, cursor, limit)
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, reports=[dict(r) for r in rows], next_cursor=next_cursor)
+
+@app.route('/api/reports/<int:detection_id>/instances')
+@login_required
+def api_report_instances(detection_id):
+    """Stored boxes/masks for one detection, normalised to the original image (0..1)."""
+    with database.connection() as conn:
+        row = conn.execute("SELECT instance_count FROM detections WHERE id = ?", (detection_id,)).fetchone()
+        if not row:
+            return jsonify(success=False, error="Report not found"), 404
+        stored = instance_store.load_instances(conn, detection_id)
+    return jsonify(success=True, stored=row['instance_count'] is not None, instances=stored)
+
+@app.route('/results/<int:detection_id>/image')
+def result_image(detection_id):
+    """Annotated result rendered on demand: ?w=<px>&q=<30-95>&fmt=jpeg|webp."""
+    width = request.args.get('w', type=int)
+    quality = min(max(request.args.get('q', 85, type=int), 30), 95)
+    fmt = request.args.get('fmt', 'jpeg')
+    if fmt not in rendering.FORMATS:
+        return jsonify(error=f"fmt must be one of {', '.join(rendering.FORMATS)}"), 400
+    if width is not None:
+        width = min(max(width, 16), rendering.MAX_WIDTH)
+
+    row = database.get_detection(detection_id)
+    if not row:
+        return "Report not found", 404
+    etag, last_modified = rendering.version_tag(row, app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'],
+                                                width, quality, fmt)
+    if etag is None:
+        return "Result image not available", 404
+
+    if etag not in request.if_none_match:
+        data = render_cache.get(etag)
+        if data is None:
+            names = getattr(model_loader.model, 'names', None)
+            with telemetry.stage('render'):
+                image = rendering.render(row, app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'], width, names)
+            if image is None:
+                return "Result image not available", 404  # source removed after version_tag
+            with telemetry.stage('encode'):
+                data = rendering.encode(image, fmt, quality)
+            render_cache.put(etag, data)
+    else:
+        data = b''
+    response = Response(data, mimetype=rendering.FORMATS[fmt][1])
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(last_modified, pytz.utc)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
+
+@app.route('/thumbs/<int:detection_id>/<kind>/<size>.<fmt>')
+def derivative_image(detection_id, kind, size, fmt):
+    """Thumbnail/preview of the original or result: /thumbs/<id>/original|result/thumb|medium.webp|jpeg."""
+    if kind not in derivatives.KINDS or size not in derivatives.SIZES or fmt not in derivatives.FORMATS:
+        return "Not found", 404
+    path = derivative_store.get(detection_id, kind, size, fmt)
+    if not path:
+        return "Not found", 404
+    derivative_store.record_served(detection_id, kind, path)
+    response = send_file(path, mimetype=derivatives.FORMATS[fmt][1], max_age=derivatives.CACHE_SECONDS)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/confirm/<result_filename>')
 def confirm(result_filename):
     correct = request.args.get('correct') == 'true'
     try:
-        conn = sqlite3.connect('corrosion.db')
-        c = conn.cursor()
-        c.execute("UPDATE detections SET confirmed = ? WHERE result_image = ?", (correct, result_filename))
-        conn.commit()
-        conn.close()
+        database.review_by_result_image(correct, result_filename)
     except Exception as e:
         print("❌ DB Update failed:", str(e))
 
@@ -301,45 +650,93 @@ def save_markup():
         print("❌ Save markup failed:", str(e))
         return {"success": False, "error": str(e)}, 500
 
+@app.route('/export_reports')
+@login_required
+def export_reports():
+    """One combined PDF (format=pdf) or a streamed ZIP of PDFs (format=zip) for
+    the selected ids (?ids=1,2,3) or everything matching the /reports filters."""
+    import report_export
+
+    filters, _, _ = report_page_args()
+    export_format = request.args.get('format', 'pdf')
+    if export_format not in ('pdf', 'zip'):
+        return jsonify(error="format must be pdf or zip"), 400
+    try:
+        filters['ids'] = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+        count = report_export.count_selected(filters)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if count == 0:
+        return jsonify(error="No reports match the selection"), 404
+
+    stamp = datetime.now(tz).strftime('%Y%m%d_%H%M%S')
+    if export_format == 'zip':
+        return Response(report_export.stream_zip(filters, app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER']),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename=reports_{stamp}.zip'})
+
+    if count > report_export.EXPORT_PDF_MAX:
+        return jsonify(error=f"{count} reports selected; combined PDFs are limited to "
+                             f"{report_export.EXPORT_PDF_MAX}, use format=zip"), 400
+    pdf_path = report_export.export_pdf(filters, app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'])
+    return Response(report_export.stream_file(pdf_path, remove=True), mimetype='application/pdf',
+                    headers={'Content-Disposition': f'attachment; filename=reports_{stamp}.pdf',
+                             'Content-Length': str(os.path.getsize(pdf_path))})
+
 @app.route('/download_pdf/<int:detection_id>')
 @login_required
 def download_pdf(detection_id):
     try:
-        conn = sqlite3.connect('corrosion.db')
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT * FROM detections WHERE id = ?", (detection_id,))
-        row = c.fetchone()
-        conn.close()
+        row = database.get_detection(detection_id)
 
         if not row:
             return "Report not found", 404
 
-        from generate_pdf import create_pdf_report
+        from generate_pdf import get_report_pdf
 
-        orig_path = os.path.join('static/uploads', row['original_image'])
-        result_path = os.path.join('static/results', row['result_image'])
+        # Reuses the cached PDF unless the text, comments, name or images changed
         pdf_filename = f"report_{detection_id}.pdf"
-        pdf_path = os.path.join('static/reports', pdf_filename)
-
-        os.makedirs('static/reports', exist_ok=True)
-
-        create_pdf_report(
-            orig_path,
-            result_path,
-            row['result_text'],
-            pdf_path,
-            row['original_image'],
-            row['comments'],
-            row['custom_name']
-        )
+        pdf_path = get_report_pdf(detection_id, row, app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER'])
 
         return send_file(pdf_path, as_attachment=True, download_name=pdf_filename)
 
     except Exception as e:
         print("❌ PDF Error:", str(e))
+        telemetry.ERRORS.inc(stage='pdf')
         return f"<h3>Error: {str(e)}</h3><br><a href='/reports'>Back</a>"
 
+def report_ids(values):
+    """Detection ids from a JSON body as ints, or None if any is not an integer."""
+    if not isinstance(values, list) or any(isinstance(value, (bool, float)) for value in values):
+        return None
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        return None
+
+
+def delete_detections(ids):
+    """Delete detections in one transaction and queue their files for background removal.
+
+    Rows go with two set-based statements (storage.delete_detections); the
+    uploads no other row references, result/markup images, cached PDFs and
+    derivative folders are handed to file_deleter, so the response does not
+    wait on the disk.
+    """
+    from generate_pdf import cached_reports
+    started = time.perf_counter()
+    with database.transaction() as conn:
+        deleted, uploads, paths = storage.delete_detections(conn, ids, app.config['UPLOAD_FOLDER'],
+                                                            app.config['RESULT_FOLDER'])
+    db_seconds = time.perf_counter() - started
+    if deleted:
+        paths += cached_reports(deleted) + derivative_store.folders(deleted)
+    # Uploads go through the store: one a concurrent identical upload took up again is kept
+    files = file_deleter.submit(uploads, remove=upload_store.remove) + file_deleter.submit(paths)
+    return {'rows': len(deleted), 'files': files, 'db_ms': round(db_seconds * 1000, 1),
+            'seconds': round(time.perf_counter() - started, 4)}
+
+
 @app.route('/delete_report', methods=['POST'])
 @login_required
 def delete_report():
@@ -348,31 +745,15 @@ def delete_report():
 
     if not report_id:
         return jsonify(success=False, error="No ID provided"), 400
+    ids = report_ids([report_id])
+    if ids is None:
+        return jsonify(success=False, error="ID must be an integer"), 400
 
     try:
-        conn = sqlite3.connect('corrosion.db')
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT original_image, result_image FROM detections WHERE id = ?", (report_id,))
-        row = c.fetchone()
-        if not row:
+        summary = delete_detections(ids)
+        if not summary['rows']:
             return jsonify(success=False, error="Report not found"), 404
-
-        # Delete image files
-        uploads_path = os.path.join(app.config['UPLOAD_FOLDER'], row['original_image'])
-        results_path = os.path.join(app.config['RESULT_FOLDER'], row['result_image'])
-        markup_path = os.path.join(app.config['RESULT_FOLDER'], 'markup', f"markup_{row['result_image']}")
-
-        for path in [uploads_path, results_path, markup_path]:
-            if os.path.exists(path):
-                os.remove(path)
-
-        # Delete from database
-        c.execute("DELETE FROM detections WHERE id = ?", (report_id,))
-        conn.commit()
-        conn.close()
-
-        return jsonify(success=True)
+        return jsonify(success=True, **summary)
     except Exception as e:
         print("❌ Delete failed:", str(e))
         return jsonify(success=False, error=str(e)), 500
@@ -383,56 +764,139 @@ def camera():
     dark_mode = request.cookies.get('dark_mode') == '1'
     return render_template('camera.html', dark_mode=dark_mode)
 
-import base64
-from io import BytesIO
-
 @app.route('/detect_camera', methods=['POST'])
 def detect_camera():
     data = request.get_json()
-    image_data = data['image'].split(',')[1]
-    image_bytes = base64.b64decode(image_data)
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    header, image_data = data['image'].split(',', 1)
+    with telemetry.stage('decode'):
+        image_bytes = base64.b64decode(image_data)
+        # Letterboxed straight from the decoded bytes; the frame itself is stored as sent
+        frame = preprocess.load(image_bytes)
 
-    # Resize for model
-    input_image = image.resize((640, 640))
-    
     try:
-        results = model(input_image, conf=0.3)
+        with telemetry.stage('inference'):
+            result = scheduler.predict(frame.array, conf=0.3)
         # Extract result
-        high = med = low = 0
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                conf = box.conf.item()
-                if conf > 0.7: high += 1
-                elif conf > 0.5: med += 1
-                else: low += 1
+        found = postprocess.from_result(result)
+        high, med, low = postprocess.severity_counts(found, preprocess.content_area(frame))
+        telemetry.count_severity('camera', high, med, low)
 
         result_text = f"Corrosion: High={high}, Med={med}, Low={low}"
-        
-        # Save result image
-        result_img = results[0].plot()
-        result_pil = Image.fromarray(result_img)
-        filename = f"camera_{uuid.uuid4().hex[:8]}.jpg"
-        result_path = os.path.join(app.config['RESULT_FOLDER'], filename)
-        result_pil.save(result_path)
+
+        # Keep the frame itself; the annotated copy is only written in eager mode
+        extension = 'png' if header.startswith('data:image/png') else 'jpg'
+        camera_name = f"camera_{uuid.uuid4().hex[:8]}.{extension}"
+        with telemetry.stage('save'):
+            filename = upload_store.put_bytes(image_bytes, camera_name)
+        upload_path = upload_store.path(filename)
+        with telemetry.stage('postprocess'):
+            instances = instance_store.from_detections(preprocess.to_original(postprocess.to_dicts(found), frame),
+                                                       frame.size)
+        if rendering.EAGER_RESULTS:
+            rendering.save_overlay(upload_path, instances, os.path.join(app.config['RESULT_FOLDER'], camera_name))
 
         # Save to DB
         timestamp = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
-        conn = sqlite3.connect('corrosion.db')
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO detections (original_image, result_image, result_text, high_severity, medium_severity, low_severity, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (filename, filename, result_text, high, med, low, timestamp))
-        conn.commit()
-        conn.close()
-
-        return jsonify(success=True, result=result_text, image_url=f"/static/results/{filename}")
+        try:
+            detection_id = database.save_detection(filename, camera_name, result_text, high, med, low, timestamp,
+                                                   instances=instances, original_name=camera_name)
+        finally:
+            upload_store.release(filename)
+        derivative_store.submit(detection_id)
+
+        return jsonify(success=True, result=result_text, image_url=f"/results/{detection_id}/image",
+                       coverage=postprocess.coverage(found, preprocess.content_area(frame)))
     except Exception as e:
         print("❌ Detect error:", str(e))
+        telemetry.ERRORS.inc(stage='detect_camera')
         return jsonify(success=False, error=str(e))
 
+@app.route('/camera/frame', methods=['POST'])
+def camera_frame():
+    """Live mode: raw JPEG in, box/mask coordinates out. Nothing is written to disk or DB."""
+    if not model_loader.available:
+        return jsonify(success=False, error="Model not available"), 503
+    if not request.content_length:
+        return jsonify(success=False, error="Empty frame"), 400
+    client_id = request.headers.get('X-Camera-Session') or request.remote_addr
+
+    def detect():
+        started = datetime.now()
+        with telemetry.stage('decode'):
+            frame = preprocess.load(request.stream)
+        with telemetry.stage('inference'):
+            result = scheduler.predict(frame.array, conf=0.3, retina_masks=True)
+        found = postprocess.from_result(result)
+        # Per-instance levels under the same SEVERITY_RULES as stored reports, so the overlay agrees with them
+        levels = postprocess.severity_levels(found, preprocess.content_area(frame))
+        high, med, low = (levels.count(level) for level in postprocess.LEVELS)
+        telemetry.count_severity('live', high, med, low)
+        detections = preprocess.to_original(postprocess.to_dicts(found), frame)
+        for detection, level in zip(detections, levels):
+            detection['severity'] = level
+        return {
+            'width': frame.size[0],
+            'height': frame.size[1],
+            'detections': detections,
+            'high': high,
+            'med': med,
+            'low': low,
+            'coverage': postprocess.coverage(found, preprocess.content_area(frame)),
+            'latency_ms': round((datetime.now() - started).total_seconds() * 1000, 1),
+        }
+
+    try:
+        detected = frame_gate.run(client_id, detect)
+    except Exception as e:
+        print("❌ Frame detect error:", str(e))
+        telemetry.ERRORS.inc(stage='camera_frame')
+        return jsonify(success=False, error=str(e)), 500
+    if detected is None:
+        request.get_data(cache=False)  # discard the unread body so a keep-alive connection stays in sync
+        return jsonify(success=True, dropped=True)
+    return jsonify(success=True, dropped=False, **detected)
+
+@app.route('/camera/capture', methods=['POST'])
+def camera_capture():
+    """Persist one explicitly captured frame as a normal inspection."""
+    data = request.get_data(cache=False)
+    if not data:
+        return jsonify(success=False, error="Empty frame"), 400
+    camera_name = f"camera_{uuid.uuid4().hex[:8]}.jpg"
+    filename = upload_store.put_bytes(data, camera_name)
+    detection = process_upload(upload_store.path(filename), filename, original_name=camera_name)
+    return jsonify(success=True, result=detection['result_text'].replace('<br>', ' | '),
+                   image_url=detection['result_url'], id=detection['id'])
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving, whether or not the model is loaded yet."""
+    return jsonify(status='ok')
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once the model is loaded and warmed up, 503 while loading or after a failed load."""
+    status = model_loader.status()
+    return jsonify(**status), 200 if status['ready'] else 503
+
+@app.route('/inference_stats')
+def inference_stats():
+    if not model_loader.available:
+        return jsonify(success=False, error="Model not available"), 503
+    stats = scheduler.stats()
+    stats['model'] = model_loader.status()
+    stats['cache'] = result_cache.stats() if result_cache else None
+    stats['camera_frames'] = dict(frame_gate.counters)
+    stats['render_cache'] = render_cache.stats()
+    stats['derivatives'] = derivative_store.stats()
+    stats['tiling'] = tile_stats_recorder.stats()
+    return jsonify(success=True, **stats)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition: request/stage histograms, counters and component gauges."""
+    return Response(telemetry.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/result_camera')
 def result_camera():
     image_url = request.args.get('image')
@@ -456,39 +920,21 @@ def bulk_delete_reports():
 
     if not ids:
         return jsonify(success=False, error="No IDs provided"), 400
+    ids = report_ids(ids)
+    if ids is None:
+        return jsonify(success=False, error="IDs must be a list of integers"), 400
 
-    deleted_count = 0
     try:
-        conn = sqlite3.connect('corrosion.db')
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-
-        for report_id in ids:
-            c.execute("SELECT original_image, result_image FROM detections WHERE id = ?", (report_id,))
-            row = c.fetchone()
-            if not row:
-                continue
-
-            # Delete files
-            uploads_path = os.path.join(app.config['UPLOAD_FOLDER'], row['original_image'])
-            results_path = os.path.join(app.config['RESULT_FOLDER'], row['result_image'])
-            markup_path = os.path.join(app.config['RESULT_FOLDER'], 'markup', f"markup_{row['result_image']}")
-
-            for path in [uploads_path, results_path, markup_path]:
-                if os.path.exists(path):
-                    os.remove(path)
-
-            # Delete from DB
-            c.execute("DELETE FROM detections WHERE id = ?", (report_id,))
-            deleted_count += 1
-
-        conn.commit()
-        conn.close()
-        return jsonify(success=True, deleted_count=deleted_count)
+        summary = delete_detections(ids)
+        return jsonify(success=True, deleted_count=summary['rows'], **summary)
     except Exception as e:
         print("❌ Bulk delete failed:", str(e))
         return jsonify(success=False, error=str(e)), 500
 
+# Everything above runs on import (gunicorn workers included); with MODEL_LOADING=background it excludes the model
+model_loader.metrics['import_seconds'] = round(time.perf_counter() - IMPORT_STARTED, 3)
+print(f"🚀 App imported in {model_loader.metrics['import_seconds']}s, model {model_loader.state}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -1,42 +1,288 @@
-# auto_retrain.py - Auto-retrain using confirmed data
-import sqlite3
-import shutil
+# auto_retrain.py - Incremental retraining dataset export from reviewed detections
+import argparse
+import hashlib
+import json
 import os
-from roboflow import Roboflow
-
-def collect_confirmed_images():
-    # Connect to DB
-    conn = sqlite3.connect('corrosion.db')
-    c = conn.cursor()
-    c.execute("SELECT original_image, result_image FROM detections WHERE confirmed = 1")
-    rows = c.fetchall()
-    conn.close()
-
-    # Copy to retraining folder
-    retrain_dir = "retrain_dataset"
-    os.makedirs(f"{retrain_dir}/images", exist_ok=True)
-    for orig, result in rows:
-        src = os.path.join('static/uploads', orig)
-        dst = os.path.join(retrain_dir, 'images', orig)
-        if os.path.exists(src):
-            shutil.copy(src, dst)
-    print(f"✅ Collected {len(rows)} confirmed images for retraining")
-    return len(rows)
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import database
+import instances as instance_store
+from result_cache import link_or_copy
+
+DATASET_DIR = 'retrain_dataset'
+UPLOAD_FOLDER = 'static/uploads'
+SOURCE_DATA_YAML = 'corrosion-detection-1/data.yaml'
+MANIFEST_NAME = 'manifest.json'
+# 2: reviews are stamped in local time like `timestamp` (they were UTC), so older watermarks are not comparable
+MANIFEST_VERSION = 2
+VALID_FRACTION = 0.2
+MIN_IMAGES = 10
+REJECTED_MODES = ('review', 'background', 'skip')
+
+
+# ===========================
+# Labels
+# ===========================
+def label_lines(rows):
+    """YOLO segmentation lines (`cls x1 y1 x2 y2 ...`, normalised) from stored instance rows.
+
+    Instances without an outline are written as their box, so the file never
+    mixes box and polygon lines (Ultralytics drops the segments if it does).
+    """
+    lines = []
+    for cls, x1, y1, x2, y2, polygon in rows:
+        points = instance_store.decode_polygon(polygon)
+        if len(points) < 3:
+            points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+        lines.append(f"{cls} " + ' '.join(f"{value:.6f}" for value in np.clip(points, 0, 1).ravel()))
+    return lines
+
+
+def load_instance_rows(conn, detection_ids, chunk=500):
+    rows = {detection_id: [] for detection_id in detection_ids}
+    for start in range(0, len(detection_ids), chunk):
+        ids = detection_ids[start:start + chunk]
+        for row in conn.execute(f'''
+            SELECT detection_id, cls, x1, y1, x2, y2, polygon FROM detection_instances
+            WHERE detection_id IN ({', '.join('?' * len(ids))}) ORDER BY detection_id, idx
+        ''', ids):
+            rows[row[0]].append(tuple(row[1:]))
+    return rows
+
+
+def split_for(detection_id, valid_fraction):
+    """Stable train/valid assignment: a detection never moves between runs."""
+    return 'valid' if zlib.crc32(str(detection_id).encode()) % 1000 < valid_fraction * 1000 else 'train'
+
+
+def read_class_names(path=SOURCE_DATA_YAML):
+    """`names:` list of the Roboflow data.yaml, without a YAML dependency."""
+    names, in_names = [], False
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('names:'):
+                    in_names = True
+                elif in_names and line.startswith('- '):
+                    names.append(line[2:].strip())
+                elif in_names:
+                    break
+    except OSError:
+        pass
+    return names or ['corrosion']
+
+
+def write_data_yaml(out_dir, names):
+    """Same layout as corrosion-detection-1/data.yaml (paths relative to the split folders)."""
+    lines = ['names:'] + [f"- {name}" for name in names] + [
+        f"nc: {len(names)}", 'train: ../train/images', 'val: ../valid/images']
+    with open(os.path.join(out_dir, 'data.yaml'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+# ===========================
+# Manifest
+# ===========================
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': MANIFEST_VERSION, 'watermark': None, 'entries': {}}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(f"{path}.tmp", path)
+
+
+def fingerprint(row, instance_rows, rejected):
+    parts = [row['original_image'], row['confirmed'], row['instance_count'], instance_rows,
+             None if row['confirmed'] else rejected]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+
+
+def _remove(out_dir, entry):
+    for key in ('image', 'label'):
+        if entry.get(key):
+            try:
+                os.remove(os.path.join(out_dir, entry[key]))
+            except FileNotFoundError:
+                pass
+
+
+# ===========================
+# Export
+# ===========================
+def plan(row, instance_rows, valid_fraction, rejected):
+    """Where a reviewed detection goes: (folder, label lines) or None to leave it out."""
+    if row['confirmed']:
+        if row['instance_count'] is None:
+            return None  # saved before instances were stored: nothing to label with
+        return split_for(row['id'], valid_fraction), label_lines(instance_rows)
+    if rejected == 'review':
+        return 'review', label_lines(instance_rows)  # the model's wrong guess, as a start for relabelling
+    if rejected == 'background':
+        return split_for(row['id'], valid_fraction), []  # hard negative: image with an empty label file
+    return None
+
+
+def write_entry(out_dir, upload_folder, row, folder, lines):
+    """Link the image and write its label file; returns (manifest entry, link method) or (None, 'missing')."""
+    source = os.path.join(upload_folder, row['original_image'])
+    if not os.path.exists(source):
+        return None, 'missing'
+    stem, extension = os.path.splitext(os.path.basename(row['original_image']))
+    name = f"det{row['id']}_{stem}"
+    image = os.path.join(folder, 'images', name + extension)
+    label = os.path.join(folder, 'labels', name + '.txt')
+
+    target = os.path.join(out_dir, image)
+    method = 'kept'
+    if not os.path.exists(target):
+        method = link_or_copy(source, target)
+    with open(os.path.join(out_dir, label + '.tmp'), 'w') as f:
+        f.write('\n'.join(lines) + ('\n' if lines else ''))
+    os.replace(os.path.join(out_dir, label + '.tmp'), os.path.join(out_dir, label))
+    return {'split': folder, 'image': image, 'label': label}, method
+
+
+def export(out_dir=DATASET_DIR, upload_folder=UPLOAD_FOLDER, valid_fraction=VALID_FRACTION, rejected='review',
+           workers=8, prune=False, names=None):
+    """Bring `out_dir` up to date with detections reviewed since the last run.
+
+    Only rows whose `reviewed_at` is at or after the manifest's watermark are
+    read, so a run costs time proportional to new reviews, not history. An
+    entry whose fingerprint (verdict, image, instances) is unchanged is
+    skipped; a changed one is rewritten in place or moved. Changing `rejected`
+    triggers one full pass. `prune` also drops entries for detections that
+    were deleted or un-reviewed since (a full pass over the manifest).
+    """
+    started = time.perf_counter()
+    for folder in ('train', 'valid', 'review'):
+        for kind in ('images', 'labels'):
+            os.makedirs(os.path.join(out_dir, folder, kind), exist_ok=True)
+    write_data_yaml(out_dir, names or read_class_names())
+    manifest = load_manifest(out_dir)
+    entries = manifest['entries']
+    if manifest.get('rejected', rejected) != rejected:
+        manifest['watermark'] = None  # rejected rows are placed differently now: one full pass
+    if manifest.get('version', 1) < MANIFEST_VERSION:
+        manifest['watermark'] = None  # watermark from the old review clock: one full pass
+    manifest['version'] = MANIFEST_VERSION
+    manifest['rejected'] = rejected
+    summary = {'reviewed': 0, 'unchanged': 0, 'exported': 0, 'removed': 0, 'missing': 0, 'unlabelled': 0,
+               'link': 0, 'reflink': 0, 'copy': 0, 'kept': 0}
+
+    with database.connection() as conn:
+        rows = conn.execute('''
+            SELECT id, original_image, confirmed, instance_count, reviewed_at FROM detections
+            WHERE reviewed_at IS NOT NULL AND reviewed_at >= ? ORDER BY reviewed_at
+        ''', (manifest['watermark'] or '',)).fetchall()
+        instance_rows = load_instance_rows(conn, [row['id'] for row in rows])
+        gone = []
+        if prune and entries:
+            known = [int(key) for key in entries]
+            alive = set()
+            for start in range(0, len(known), 500):
+                ids = known[start:start + 500]
+                alive.update(row[0] for row in conn.execute(
+                    f"SELECT id FROM detections WHERE reviewed_at IS NOT NULL AND id IN ({', '.join('?' * len(ids))})",
+                    ids))
+            gone = [key for key in entries if int(key) not in alive]
+
+    summary['reviewed'] = len(rows)
+    for key in gone:
+        _remove(out_dir, entries.pop(key))
+        summary['removed'] += 1
+
+    work = []
+    for row in rows:
+        key = str(row['id'])
+        stamp = fingerprint(row, instance_rows[row['id']], rejected)
+        previous = entries.get(key)
+        if previous and previous['fingerprint'] == stamp:
+            summary['unchanged'] += 1
+            continue
+        target = plan(row, instance_rows[row['id']], valid_fraction, rejected)
+        if previous and previous.get('image') and (target is None or previous['split'] != target[0]):
+            _remove(out_dir, previous)
+            summary['removed'] += 1
+        if target is None:
+            entries[key] = {'fingerprint': stamp, 'split': None}
+            if row['confirmed']:
+                summary['unlabelled'] += 1
+            continue
+        work.append((key, stamp, row, target))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda item: write_entry(out_dir, upload_folder, item[2], *item[3]), work)
+        for (key, stamp, row, _), (entry, method) in zip(work, results):
+            summary[method] += 1
+            if entry is None:
+                entries[key] = {'fingerprint': stamp, 'split': None}
+                continue
+            entries[key] = dict(entry, fingerprint=stamp, confirmed=bool(row['confirmed']))
+            summary['exported'] += 1
+
+    if rows:
+        manifest['watermark'] = rows[-1]['reviewed_at']
+    save_manifest(out_dir, manifest)
+    for folder in ('train', 'valid', 'review'):
+        summary[folder] = sum(1 for entry in entries.values() if entry.get('split') == folder)
+    summary['confirmed'] = sum(1 for entry in entries.values()
+                               if entry.get('confirmed') and entry.get('split') in ('train', 'valid'))
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def collect_confirmed_images(out_dir=DATASET_DIR, **options):
+    """Incremental export; returns the number of confirmed images in the training splits."""
+    summary = export(out_dir, **options)
+    print(f"✅ {summary['reviewed']} reviewed row(s) since last run: {summary['exported']} exported, "
+          f"{summary['unchanged']} unchanged, {summary['removed']} removed, {summary['missing']} missing image(s), "
+          f"{summary['unlabelled']} without stored instances in {summary['seconds']}s")
+    print(f"   files: {summary['link']} hard-linked, {summary['reflink']} reflinked, {summary['copy']} copied")
+    print(f"📊 Dataset: train={summary['train']} valid={summary['valid']} review={summary['review']} "
+          f"({summary['confirmed']} confirmed)")
+    return summary['confirmed']
+
 
 # Run if enough data
 if __name__ == '__main__':
-    count = collect_confirmed_images()
-    if count >= 10:
+    parser = argparse.ArgumentParser(description="Export reviewed detections as a YOLO segmentation dataset")
+    parser.add_argument('--out', default=DATASET_DIR)
+    parser.add_argument('--uploads', default=UPLOAD_FOLDER)
+    parser.add_argument('--valid-fraction', type=float, default=VALID_FRACTION,
+                        help="share of new detections assigned to valid/ (existing ones never move)")
+    parser.add_argument('--rejected', choices=REJECTED_MODES, default='review',
+                        help="review: predicted labels under review/ for relabelling; background: empty-label "
+                             "hard negatives in the splits; skip: leave them out")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--prune', action='store_true', help="also drop deleted or un-reviewed detections")
+    args = parser.parse_args()
+
+    database.init_db()
+    count = collect_confirmed_images(args.out, upload_folder=args.uploads, valid_fraction=args.valid_fraction,
+                                      rejected=args.rejected, workers=args.workers, prune=args.prune)
+    if count >= MIN_IMAGES:
         print("🚀 Ready to retrain! Upload to Roboflow...")
         # Optional: Use Roboflow API to upload and retrain
+        # from roboflow import Roboflow
         # rf = Roboflow(api_key="YOUR_KEY")
         # project = rf.workspace("hamka-corrosion").project("corrosion-detection-xjdlv")
         # version = project.version(2)
         # version.upload_dataset(
-        #     dataset_path="retrain_dataset",
+        #     dataset_path=args.out,
         #     annotation_format="yolov8",
         #     model_format="yolov8-segmentation"
         # )
         # version.train()
     else:
-        print("⏳ Not enough confirmed images yet (need 10+)")
\ No newline at end of file
+        print(f"⏳ Not enough confirmed images yet (need {MIN_IMAGES}+)")
@@ -0,0 +1,284 @@
+# backends.py - PyTorch / ONNX Runtime / OpenVINO inference backends for the same weights
+import argparse
+import glob
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+import postprocess
+import preprocess
+from inference import _percentile, extract_detections, severity_from_detections
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+PRECISIONS = ('fp32', 'int8')
+DATA_YAML = 'corrosion-detection-1/data.yaml'
+VALID_IMAGES = 'corrosion-detection-1/valid/images'
+CALIBRATION_IMAGES = 'corrosion-detection-1/train/images'
+PARITY_SETTINGS = {'conf': 0.3, 'iou': 0.2, 'max_det': 10, 'retina_masks': True}
+
+
+def artifact_path(weights, backend, precision='fp32'):
+    """Where the exported variant of `weights` lives: best.onnx, best_int8.onnx, best_openvino_model/, ..."""
+    stem = os.path.splitext(weights)[0]
+    suffix = '_int8' if precision == 'int8' else ''
+    if backend == 'onnx':
+        return f"{stem}{suffix}.onnx"
+    if backend == 'openvino':
+        return f"{stem}{suffix}_openvino_model"
+    return weights
+
+
+def settings_from_env():
+    """(backend, threads, precision) from INFER_BACKEND, INFER_THREADS (0 = runtime default), INFER_PRECISION."""
+    backend = os.environ.get('INFER_BACKEND', 'pytorch').lower()
+    precision = os.environ.get('INFER_PRECISION', 'fp32').lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"INFER_BACKEND must be one of {', '.join(BACKENDS)}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"INFER_PRECISION must be one of {', '.join(PRECISIONS)}")
+    if backend == 'pytorch' and precision == 'int8':
+        raise ValueError("INT8 needs INFER_BACKEND=onnx or openvino")
+    return backend, int(os.environ.get('INFER_THREADS', 0)), precision
+
+
+# ===========================
+# Loading
+# ===========================
+def _set_threads(model, backend, path, threads):
+    """Pin the runtime's intra-op thread count.
+
+    Ultralytics builds the ONNX Runtime session / OpenVINO compiled model with
+    default options, so they are rebuilt here on the predictor's AutoBackend
+    (attributes as of the pinned ultralytics 8.3.x).
+    """
+    if backend == 'pytorch':
+        import torch
+        torch.set_num_threads(threads)
+        return
+    autobackend = model.predictor.model
+    if backend == 'onnx':
+        import onnxruntime
+        if not autobackend.dynamic:
+            print(f"⚠️ {path} has a static batch; keeping ONNX Runtime's default threads")
+            return
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        autobackend.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+    elif backend == 'openvino':
+        import openvino as ov
+        core = ov.Core()
+        xml = next(Path(path).glob('*.xml'))
+        ov_model = core.read_model(model=str(xml), weights=xml.with_suffix('.bin'))
+        if ov_model.get_parameters()[0].get_layout().empty:
+            ov_model.get_parameters()[0].set_layout(ov.Layout('NCHW'))
+        autobackend.ov_compiled_model = core.compile_model(
+            ov_model, device_name='CPU',
+            config={'PERFORMANCE_HINT': autobackend.inference_mode, 'INFERENCE_NUM_THREADS': threads})
+
+
+def _task(path, backend):
+    """Task recorded in an export's metadata; Ultralytics would otherwise guess from the file name."""
+    if backend == 'openvino':
+        import yaml
+        with open(os.path.join(path, 'metadata.yaml')) as f:
+            return yaml.safe_load(f).get('task')
+    import onnx
+    return {prop.key: prop.value for prop in onnx.load(path).metadata_props}.get('task')
+
+
+def load(weights, backend='pytorch', threads=0, precision='fp32'):
+    """A YOLO model running on `backend`; returns (model, artifact path).
+
+    Exported models go through the same Ultralytics predictor (pre/post-processing,
+    Results objects), so callers cannot tell the backends apart.
+    """
+    from ultralytics import YOLO
+
+    path = artifact_path(weights, backend, precision)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run `python backends.py export --backend {backend} "
+                                f"--precision {precision}`")
+    model = YOLO(path) if backend == 'pytorch' else YOLO(path, task=_task(path, backend))
+    if threads:
+        if backend != 'pytorch':
+            # The predictor (and its AutoBackend) is only created on the first call
+            blank = np.full((preprocess.MODEL_SIZE, preprocess.MODEL_SIZE, 3), preprocess.PAD_COLOR[0], np.uint8)
+            model(blank, verbose=False)
+        _set_threads(model, backend, path, threads)
+    return model, path
+
+
+# ===========================
+# Export
+# ===========================
+def _calibration_frames(folder, limit):
+    paths = sorted(glob.glob(os.path.join(folder, '*.jpg')))[:limit]
+    for path in paths:
+        # Ultralytics feeds the network RGB, NCHW, 0..1
+        rgb = preprocess.load(path).array[..., ::-1]
+        yield np.ascontiguousarray(rgb.transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+
+
+def _quantize_onnx(fp32_path, int8_path, calibration_dir, limit):
+    """Static (QDQ) INT8 quantisation calibrated on real inspection photos; keeps Ultralytics' metadata."""
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.frames = _calibration_frames(calibration_dir, limit)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            return None if frame is None else {'images': frame}
+
+    quantize_static(fp32_path, int8_path, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    source, quantized = onnx.load(fp32_path), onnx.load(int8_path)
+    if not quantized.metadata_props:
+        quantized.metadata_props.extend(source.metadata_props)
+        onnx.save(quantized, int8_path)
+    return int8_path
+
+
+def export(weights, backend, precision='fp32', data=DATA_YAML, calibration_dir=CALIBRATION_IMAGES,
+           calibration_limit=100):
+    """Export `weights` for `backend`/`precision`; returns the artifact path.
+
+    Exports use a dynamic batch axis so the scheduler's batched calls work.
+    """
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    if backend == 'openvino':
+        exported = model.export(format='openvino', imgsz=preprocess.MODEL_SIZE, dynamic=True,
+                                int8=precision == 'int8', data=data if precision == 'int8' else None)
+    elif backend == 'onnx':
+        exported = model.export(format='onnx', imgsz=preprocess.MODEL_SIZE, dynamic=True, simplify=True)
+        if precision == 'int8':
+            exported = _quantize_onnx(exported, artifact_path(weights, 'onnx', 'int8'), calibration_dir,
+                                      calibration_limit)
+    else:
+        raise ValueError(f"Nothing to export for {backend}")
+    expected = artifact_path(weights, backend, precision)
+    if os.path.abspath(str(exported).rstrip(os.sep)) != os.path.abspath(expected):
+        os.replace(exported, expected)
+    return expected
+
+
+# ===========================
+# Verify
+# ===========================
+def compare(reference, candidate):
+    """Per-image parity of candidate detections against the reference backend's."""
+    ref_boxes = np.array([d['xyxy'] for d in reference], dtype=np.float64).reshape(-1, 4)
+    cand_boxes = np.array([d['xyxy'] for d in candidate], dtype=np.float64).reshape(-1, 4)
+    iou = postprocess.box_iou(ref_boxes, cand_boxes)
+    best = iou.argmax(axis=1) if iou.size else np.zeros(len(reference), dtype=int)
+    best_iou = iou.max(axis=1) if iou.size else np.zeros(len(reference))
+    conf_diff = [abs(reference[i]['conf'] - candidate[j]['conf'])
+                 for i, j in enumerate(best.tolist()) if best_iou[i] >= 0.5]
+    return {
+        'count_match': len(reference) == len(candidate),
+        'severity_match': severity_from_detections(reference) == severity_from_detections(candidate),
+        'box_ious': best_iou.tolist(),
+        'max_conf_diff': max(conf_diff, default=0.0),
+    }
+
+
+def run_backend(model, frames, repeat):
+    """(detections per frame, per-image latencies in ms) for single-image calls."""
+    detections, latency = [], []
+    for frame in frames:
+        for i in range(repeat):
+            started = time.perf_counter()
+            result = model(frame.array, verbose=False, **PARITY_SETTINGS)[0]
+            latency.append((time.perf_counter() - started) * 1000)
+        detections.append(extract_detections(result))
+    return detections, latency
+
+
+def verify(weights, variants, images=VALID_IMAGES, threads=0, repeat=5, min_iou=0.85, min_severity=0.85):
+    """Parity and latency of each (backend, precision) variant against PyTorch on `images`."""
+    frames = [preprocess.load(path) for path in sorted(glob.glob(os.path.join(images, '*.jpg')))]
+    if not frames:
+        raise FileNotFoundError(f"No .jpg images in {images}")
+
+    report = {'images': len(frames), 'threads': threads, 'backends': []}
+    reference = None
+    for backend, precision in [('pytorch', 'fp32')] + [v for v in variants if v != ('pytorch', 'fp32')]:
+        model, path = load(weights, backend, threads, precision)
+        model(frames[0].array, verbose=False, **PARITY_SETTINGS)  # warm-up
+        detections, latency = run_backend(model, frames, repeat)
+        latency.sort()
+        entry = {
+            'backend': backend,
+            'precision': precision,
+            'path': path,
+            'p50_ms': round(_percentile(latency, 50), 1),
+            'p95_ms': round(_percentile(latency, 95), 1),
+            'images_per_sec': round(1000 * len(latency) / sum(latency), 2),
+            'detections': sum(len(d) for d in detections),
+        }
+        if reference is None:
+            reference = detections
+        else:
+            parity = [compare(ref, cand) for ref, cand in zip(reference, detections)]
+            ious = [iou for p in parity for iou in p['box_ious']]
+            entry.update({
+                'count_match': round(float(np.mean([p['count_match'] for p in parity])), 3),
+                'severity_match': round(float(np.mean([p['severity_match'] for p in parity])), 3),
+                'mean_box_iou': round(float(np.mean(ious)), 4) if ious else 1.0,
+                'max_conf_diff': round(max(p['max_conf_diff'] for p in parity), 4),
+            })
+            entry['passed'] = entry['mean_box_iou'] >= min_iou and entry['severity_match'] >= min_severity
+        report['backends'].append(entry)
+    return report
+
+
+# ===========================
+# CLI
+# ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Export best.pt to ONNX/OpenVINO and verify parity and latency")
+    parser.add_argument('command', choices=['export', 'verify'])
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--backend', nargs='+', choices=BACKENDS[1:], default=['onnx', 'openvino'])
+    parser.add_argument('--precision', nargs='+', choices=PRECISIONS, default=['fp32'])
+    parser.add_argument('--images', default=VALID_IMAGES, help="verification images")
+    parser.add_argument('--data', default=DATA_YAML, help="dataset YAML for OpenVINO INT8 calibration")
+    parser.add_argument('--calibration', default=CALIBRATION_IMAGES, help="images for ONNX INT8 calibration")
+    parser.add_argument('--threads', type=int, default=0, help="intra-op threads (0 = runtime default)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-iou', type=float, default=0.85, help="mean matched box IoU required to pass")
+    parser.add_argument('--min-severity', type=float, default=0.85,
+                        help="share of images whose severity counts must match")
+    parser.add_argument('--output', default='runs/backends/verify.json')
+    args = parser.parse_args()
+
+    variants = [(backend, precision) for backend in args.backend for precision in args.precision]
+    if args.command == 'export':
+        for backend, precision in variants:
+            print(f"📦 {backend} {precision} -> {export(args.weights, backend, precision, args.data, args.calibration)}")
+        return 0
+
+    report = verify(args.weights, variants, args.images, args.threads, args.repeat, args.min_iou, args.min_severity)
+    print(f"{'backend':<18}{'p50 ms':>9}{'p95 ms':>9}{'img/s':>8}{'boxes':>7}{'sev':>7}{'IoU':>8}{'Δconf':>8}")
+    for entry in report['backends']:
+        label = f"{entry['backend']} {entry['precision']}"
+        parity = (f"{entry['severity_match']:>7.2f}{entry['mean_box_iou']:>8.3f}{entry['max_conf_diff']:>8.3f}"
+                  f"  {'✅' if entry['passed'] else '❌'}") if 'passed' in entry else '  (reference)'
+        print(f"{label:<18}{entry['p50_ms']:>9.1f}{entry['p95_ms']:>9.1f}{entry['images_per_sec']:>8.1f}"
+              f"{entry['detections']:>7}{parity}")
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 {args.output}")
+    return 0 if all(entry.get('passed', True) for entry in report['backends']) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+# bench_postprocess.py - Post-processing time per image: legacy per-box loop vs. vectorised arrays
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+import postprocess
+import preprocess
+from inference import _percentile
+
+VALID_IMAGES = 'corrosion-detection-1/valid/images'
+MAX_DETS = (10, 100, 300)
+
+
+def legacy(result):
+    """What severity_counts + extract_detections did before: a Python loop with one .item() sync per box."""
+    high = med = low = 0
+    if result.boxes:
+        for box in result.boxes:
+            conf = box.conf.item()
+            if conf > 0.7:
+                high += 1
+            elif conf > 0.5:
+                med += 1
+            else:
+                low += 1
+    detections = []
+    if result.boxes:
+        polygons = result.masks.xy if getattr(result, 'masks', None) is not None else []
+        for i, (xyxy, conf, cls) in enumerate(zip(result.boxes.xyxy.tolist(),
+                                                  result.boxes.conf.tolist(),
+                                                  result.boxes.cls.tolist())):
+            detection = {'xyxy': [round(v, 1) for v in xyxy], 'conf': round(conf, 4), 'cls': int(cls)}
+            if i < len(polygons):
+                detection['polygon'] = [[round(x, 1), round(y, 1)] for x, y in polygons[i].tolist()]
+            detections.append(detection)
+    return (high, med, low), detections
+
+
+def vectorised(result):
+    """Same outputs as `legacy`: the default path while severity rules are confidence-only."""
+    found = postprocess.from_result(result, mask_area=False)
+    return postprocess.severity_counts(found), postprocess.to_dicts(found)
+
+
+def with_mask_area(result):
+    """Area-based severity rules: adds per-instance mask pixel counts."""
+    found = postprocess.from_result(result, mask_area=True)
+    return postprocess.severity_counts(found), postprocess.to_dicts(found)
+
+
+def same(old, new):
+    """Equal counts and classes; boxes and polygons equal up to rounding (the new dicts also carry `area`)."""
+    if old[0] != new[0] or len(old[1]) != len(new[1]):
+        return False
+    for a, b in zip(old[1], new[1]):
+        if a['cls'] != b['cls'] or abs(a['conf'] - b['conf']) > 1e-4:
+            return False
+        if not np.allclose(a['xyxy'], b['xyxy'], atol=0.1):
+            return False
+        if 'polygon' in a and not np.allclose(a['polygon'], b.get('polygon', []), atol=0.1):
+            return False
+    return True
+
+
+def timed(fn, results, repeat):
+    samples = []
+    for _ in range(repeat):
+        for result in results:
+            started = time.perf_counter()
+            fn(result)
+            samples.append((time.perf_counter() - started) * 1000)
+    return sorted(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark result post-processing at increasing max_det")
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--images', default=VALID_IMAGES)
+    parser.add_argument('--max-det', type=int, nargs='+', default=list(MAX_DETS))
+    parser.add_argument('--conf', type=float, default=0.01, help="low, so high max_det values actually fill up")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+    model = YOLO(args.weights)
+    frames = [preprocess.load(path).array for path in sorted(glob.glob(os.path.join(args.images, '*.jpg')))]
+    if not frames:
+        print(f"❌ No .jpg images in {args.images}")
+        return 1
+
+    print(f"{len(frames)} image(s) x {args.repeat}, default severity rules")
+    print(f"{'max_det':>8}{'boxes/img':>11}{'legacy p50':>12}{'vector p50':>12}{'speedup':>9}"
+          f"{'legacy p95':>12}{'vector p95':>12}{'+area p50':>11}{'match':>7}")
+    for max_det in args.max_det:
+        results = [model(frame, conf=args.conf, iou=0.2, max_det=max_det, retina_masks=True, verbose=False)[0]
+                   for frame in frames]
+        boxes = sum(len(result.boxes) for result in results) / len(results)
+        match = all(same(legacy(result), vectorised(result)) for result in results)
+        old = timed(legacy, results, args.repeat)
+        new = timed(vectorised, results, args.repeat)
+        area = timed(with_mask_area, results, args.repeat)
+        print(f"{max_det:>8}{boxes:>11.1f}{_percentile(old, 50):>12.3f}{_percentile(new, 50):>12.3f}"
+              f"{_percentile(old, 50) / max(_percentile(new, 50), 1e-9):>8.1f}x"
+              f"{_percentile(old, 95):>12.3f}{_percentile(new, 95):>12.3f}{_percentile(area, 50):>11.3f}"
+              f"{'yes' if match else 'NO':>7}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+# bench_preprocess.py - Per-image preprocess time and peak memory: legacy resize vs. letterbox
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import preprocess
+
+SIZES = [(1280, 720), (1920, 1080), (4000, 3000), (8000, 6000)]
+
+
+def legacy(path):
+    """What predict_image did before: full decode, RGB convert, squash to 640, then Ultralytics' PIL->BGR copy."""
+    image = Image.open(path).convert("RGB").resize((640, 640))
+    return np.ascontiguousarray(np.asarray(image)[..., ::-1])
+
+
+def letterbox(path):
+    return preprocess.load(path).array
+
+
+MODES = {'legacy': legacy, 'letterbox': letterbox}
+
+
+def synthesize(folder, sizes):
+    """Photo-like JPEGs (smooth gradient + noise) so draft decoding and entropy are realistic."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for width, height in sizes:
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        pixels = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                           np.full((height, width), 90, np.float32)], axis=-1)
+        pixels += rng.normal(0, 12, pixels.shape).astype(np.float32)
+        path = os.path.join(folder, f"{width}x{height}.jpg")
+        Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def peak_rss_mb():
+    """High-water RSS of this process. ru_maxrss survives fork+exec on Linux, so prefer VmHWM."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(mode, path, repeat):
+    """Runs in a fresh interpreter so peak RSS belongs to one mode and one image."""
+    fn = MODES[mode]
+    before = peak_rss_mb()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(path)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    print(json.dumps({'p50_ms': samples[len(samples) // 2], 'peak_mb': peak_rss_mb() - before}))
+
+
+def measure(mode, path, repeat):
+    output = subprocess.run([sys.executable, __file__, '--child', mode, '--repeat', str(repeat), path],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing for the model input")
+    parser.add_argument('images', nargs='*', help="JPEGs to use (default: synthetic photos of several sizes)")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.images[0], args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = args.images or synthesize(tmp, SIZES)
+        print(f"{'image':<24}{'mode':<12}{'p50 ms':>10}{'peak +MB':>10}")
+        for path in paths:
+            with Image.open(path) as img:
+                label = f"{os.path.basename(path)[:14]} {img.width}x{img.height}"
+            for mode in MODES:
+                result = measure(mode, path, args.repeat)
+                print(f"{label:<24}{mode:<12}{result['p50_ms']:>10.1f}{result['peak_mb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# bench_reports.py - Reports listing latency on a seeded 100k-row database
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import reports_query
+import stats
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    original_image TEXT NOT NULL,
+    result_image TEXT NOT NULL,
+    result_text TEXT,
+    high_severity INTEGER DEFAULT 0,
+    medium_severity INTEGER DEFAULT 0,
+    low_severity INTEGER DEFAULT 0,
+    confirmed BOOLEAN DEFAULT FALSE,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    comments TEXT DEFAULT '',
+    custom_name TEXT DEFAULT '',
+    original_name TEXT
+)
+'''
+
+WORDS = ['pipe', 'flange', 'valve', 'tank', 'weld', 'bracket', 'deck', 'hull', 'beam', 'pitting', 'blister', 'coating']
+
+
+def seed(conn, rows):
+    rng = random.Random(42)
+    start = datetime(2023, 1, 1)
+    batch = []
+    for i in range(rows):
+        high, med, low = rng.randint(0, 3), rng.randint(0, 3), rng.randint(0, 4)
+        ts = (start + timedelta(seconds=i * 300 + rng.randint(0, 299))).strftime('%Y-%m-%d %H:%M:%S')
+        text = f"Corrosion Detected: PASS ({high+med+low} spot(s))<br>Severity: High={high}, Medium={med}, Low={low}"
+        comment = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 12)))
+        name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} #{i}"
+        batch.append((f"img_{i}.jpg", f"result_{i}.jpg", text, high, med, low, rng.random() < 0.3, ts, comment, name))
+        if len(batch) == 10000:
+            conn.executemany('''INSERT INTO detections (original_image, result_image, result_text, high_severity,
+                medium_severity, low_severity, confirmed, timestamp, comments, custom_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+            batch = []
+    if batch:
+        conn.executemany('''INSERT INTO detections (original_image, result_image, result_text, high_severity,
+            medium_severity, low_severity, confirmed, timestamp, comments, custom_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+    conn.commit()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the paginated reports query")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=200, help="pages to walk for the deep-page case")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.db'))
+        conn.execute(SCHEMA)
+        stats.init_stats(conn)
+        reports_query.init_reports_search(conn)
+
+        started = time.perf_counter()
+        seed(conn, args.rows)
+        print(f"🌱 Seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+        # Cursor for a page deep in the history; every page must continue where the previous one stopped
+        cursor, seen = None, set()
+        for page in range(args.pages):
+            rows, cursor = reports_query.query_reports(conn, {}, cursor)
+            ids = {row[0] for row in rows}
+            if not rows or ids & seen:
+                raise SystemExit(f"❌ Pagination broken: page {page + 1} returned {len(rows)} row(s), "
+                                 f"{len(ids & seen)} already listed")
+            seen |= ids
+            if cursor is None:
+                break
+
+        cases = [
+            ('legacy full SELECT *', lambda: conn.execute("SELECT * FROM detections ORDER BY timestamp DESC").fetchall()),
+            ('first page', lambda: reports_query.query_reports(conn, {})),
+            (f'page {args.pages + 1}', lambda: reports_query.query_reports(conn, {}, cursor)),
+            ('severity=high, confirmed=1', lambda: reports_query.query_reports(conn, {'severity': 'high', 'confirmed': '1'})),
+            ('date range (1 month)', lambda: reports_query.query_reports(conn, {'date_from': '2023-06-01', 'date_to': '2023-06-30'})),
+            ('full-text "flange pitting"', lambda: reports_query.query_reports(conn, {'q': 'flange pitting'})),
+            ('dashboard totals', lambda: stats.get_totals(conn)),
+        ]
+        print(f"{'case':<32}{'p50 ms':>10}{'max ms':>10}")
+        for label, fn in cases:
+            p50, worst = timed(fn, args.repeat)
+            print(f"{label:<32}{p50:>10.2f}{worst:>10.2f}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
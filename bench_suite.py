@@ -0,0 +1,264 @@
+# bench_suite.py - End-to-end benchmark of the inference and request path with a regression gate
+import argparse
+import base64
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import bench_reports
+from inference import _percentile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_GLOBS = ['corrosion-detection-1/valid/images/*.jpg', 'corrosion-detection-1/test/images/*.jpg']
+RESULTS_PATH = 'runs/bench/latest.json'
+BASELINE_PATH = 'bench_baseline.json'
+# Files the app opens relative to its working directory (weights and their exports)
+LINKED = ['best.pt', 'best*.onnx', 'best*_openvino_model']
+
+# metric -> which direction is better; anything else in a case is informational
+GATED = {'p50_ms': 'lower', 'p95_ms': 'lower', 'per_sec': 'higher', 'peak_rss_mb': 'lower'}
+MIN_DELTA_MS = 1.0  # sub-millisecond latency swings are timer noise, not regressions
+
+
+# ===========================
+# Measurement
+# ===========================
+def reset_peak_rss():
+    """Start a fresh VmHWM window (Linux clear_refs); False where the kernel does not allow it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(fn, items, repeat, unit):
+    """Call fn(item) for every item, `repeat` times, after one untimed warm-up call."""
+    fn(items[0])
+    reset_peak_rss()
+    latency = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            call_started = time.perf_counter()
+            fn(item)
+            latency.append((time.perf_counter() - call_started) * 1000)
+    seconds = time.perf_counter() - started
+    latency.sort()
+    return {
+        'unit': unit,
+        'count': len(latency),
+        'p50_ms': round(_percentile(latency, 50), 2),
+        'p95_ms': round(_percentile(latency, 95), 2),
+        'p99_ms': round(_percentile(latency, 99), 2),
+        'per_sec': round(len(latency) / seconds, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ===========================
+# Cases
+# ===========================
+def prepare_workdir(workdir):
+    """Weights are symlinked in; uploads, results, reports and the database stay in the temp dir."""
+    for pattern in LINKED:
+        for path in glob.glob(os.path.join(REPO_DIR, pattern)):
+            os.symlink(path, os.path.join(workdir, os.path.basename(path)))
+    # Set explicitly as well as for the environment: something imported earlier may have loaded `database`
+    # already, and its pool must not stay on the tracked corrosion.db
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+    import database
+    database.configure(os.environ['DATABASE_PATH'])
+    os.environ.setdefault('RESULT_CACHE', '0')  # repeated images must run the model, not hit the cache
+    os.chdir(workdir)
+
+
+def run_cases(images, rows, repeat):
+    import app
+    import database
+    import reports_query
+    import stats
+    from generate_pdf import get_report_pdf, invalidate_reports
+
+    if not app.model_loader.wait():
+        raise RuntimeError(f"Model not available: {app.model_loader.status()['error']}")
+
+    started = time.perf_counter()
+    with database.connection() as conn:
+        bench_reports.seed(conn, rows)
+    print(f"🌱 Seeded {rows} rows in {time.perf_counter() - started:.1f}s")
+    print(f"  {'case':<22}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rate':>9}{'':<10}{'peak MB':>9}")
+
+    payloads = []
+    for path in images:
+        with open(path, 'rb') as f:
+            payloads.append((os.path.basename(path), f.read()))
+    client = app.app.test_client()
+    detection_ids = []
+
+    def upload(item):
+        name, data = item
+        response = client.post('/upload', data={'file': (io.BytesIO(data), name)},
+                               content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"/upload returned {response.status_code}")
+
+    def detect_camera(item):
+        _, data = item
+        response = client.post('/detect_camera',
+                               json={'image': 'data:image/jpeg;base64,' + base64.b64encode(data).decode()})
+        body = response.get_json()
+        if not body.get('success'):
+            raise RuntimeError(f"/detect_camera failed: {body.get('error')}")
+        detection_ids.append(int(body['image_url'].split('/')[2]))
+
+    def report_pdf(detection_id):
+        invalidate_reports([detection_id])
+        get_report_pdf(detection_id, database.get_detection(detection_id),
+                       app.app.config['UPLOAD_FOLDER'], app.app.config['RESULT_FOLDER'])
+
+    def reports(filters):
+        with database.connection() as conn:
+            reports_query.query_reports(conn, filters)
+
+    def dashboard(_):
+        with database.connection() as conn:
+            stats.get_totals(conn)
+
+    queries = [{}, {'severity': 'high', 'confirmed': '1'}, {'date_from': '2023-06-01', 'date_to': '2023-06-30'},
+               {'q': 'flange pitting'}]
+    cases = [
+        ('predict_image', lambda path: app.predict_image(path), images, 'images'),
+        ('upload_route', upload, payloads, 'images'),
+        ('detect_camera_route', detect_camera, payloads, 'images'),
+        ('report_pdf', report_pdf, lambda: sorted(set(detection_ids)), 'reports'),
+        ('reports_query', reports, queries, 'queries'),
+        ('dashboard_totals', dashboard, [None], 'queries'),
+    ]
+    results = {}
+    for name, fn, items, unit in cases:
+        items = items() if callable(items) else items
+        results[name] = measure(fn, items, repeat, unit)
+        print(f"  {name:<22}{results[name]['p50_ms']:>9.1f}{results[name]['p95_ms']:>9.1f}"
+              f"{results[name]['p99_ms']:>9.1f}{results[name]['per_sec']:>9.1f} {unit}/s"
+              f"{results[name]['peak_rss_mb']:>9.0f}")
+    app.derivative_store.close()  # background thumbnails write into the temp dir
+    return results, app.model_loader.backend
+
+
+# ===========================
+# Baseline comparison
+# ===========================
+def compare(current, baseline, threshold):
+    """Regressions of gated metrics beyond `threshold` (a fraction) relative to the baseline."""
+    regressions = []
+    for name, metrics in current['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if not base:
+            continue
+        for metric, better in GATED.items():
+            now, before = metrics.get(metric), base.get(metric)
+            if not now or not before:
+                continue
+            change = (now - before) / before
+            worse = change > threshold if better == 'lower' else -change > threshold
+            if metric.endswith('_ms') and abs(now - before) < MIN_DELTA_MS:
+                worse = False
+            if worse:
+                regressions.append(f"{name}.{metric}: {before} -> {now} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark predict_image, /upload, /detect_camera, PDF reports "
+                                                 "and the reports query; fail on regressions against a baseline")
+    parser.add_argument('--rows', type=int, default=100000, help="synthetic detections seeded into the database")
+    parser.add_argument('--repeat', type=int, default=3, help="passes over the inputs per case")
+    parser.add_argument('--images', nargs='+', default=IMAGE_GLOBS, help="image glob(s)")
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed relative regression per metric (0.25 = 25%%)")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    images = sorted(os.path.abspath(path) for pattern in args.images for path in glob.glob(pattern))
+    if not images:
+        print(f"❌ No images match {args.images}")
+        return 1
+    output, baseline_path = os.path.abspath(args.output), os.path.abspath(args.baseline)
+
+    print(f"📊 {len(images)} image(s) x {args.repeat}, {args.rows} seeded rows")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as workdir:
+        prepare_workdir(workdir)
+        try:
+            cases, backend = run_cases(images, args.rows, args.repeat)
+        finally:
+            os.chdir(cwd)
+
+    current = {
+        'meta': {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                 'backend': list(backend), 'images': len(images), 'repeat': args.repeat, 'rows': args.rows,
+                 'rss_window': 'per case' if reset_peak_rss() else 'process'},
+        'cases': cases,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"💾 Results written to {output}")
+
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"✅ Baseline saved to {baseline_path}")
+        return 0
+    if not os.path.exists(baseline_path):
+        print(f"⚠️ No baseline at {baseline_path}; run with --save-baseline to create one")
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    for key in ('cpus', 'backend', 'rows'):
+        if baseline['meta'].get(key) != current['meta'][key]:
+            print(f"⚠️ Baseline {key} differs ({baseline['meta'].get(key)} vs {current['meta'][key]})")
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) beyond {args.threshold:.0%} "
+              f"(baseline {baseline['meta'].get('commit')}):")
+        for line in regressions:
+            print(f"   {line}")
+        return 1
+    print(f"✅ No regressions beyond {args.threshold:.0%} against baseline {baseline['meta'].get('commit')}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,88 @@
+# bench_workers.py - Inference throughput with 1..N model worker processes on the validation images
+import argparse
+import glob
+import os
+import threading
+import time
+
+import model_workers
+import preprocess
+from inference import _percentile
+
+VALID_IMAGES = 'corrosion-detection-1/valid/images'
+PREDICT_KWARGS = {'conf': 0.3, 'iou': 0.2, 'max_det': 10, 'retina_masks': True}
+
+
+def run_clients(scheduler, frames, requests, clients):
+    """Fire `requests` predictions from `clients` threads; returns (seconds, sorted latencies in ms)."""
+    latency = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            started = time.perf_counter()
+            scheduler.predict(frames[index % len(frames)].array, **PREDICT_KWARGS)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latency.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test model worker processes (throughput scaling 1..N)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="largest worker count to try")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=0, help="concurrent clients (default: 4 per worker)")
+    parser.add_argument('--images', default=VALID_IMAGES)
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--no-split-threads', action='store_true',
+                        help="let every worker use all cores instead of cpu_count / workers threads")
+    args = parser.parse_args()
+
+    frames = [preprocess.load(path) for path in sorted(glob.glob(os.path.join(args.images, '*.jpg')))]
+    if not frames:
+        print(f"❌ No .jpg images in {args.images}")
+        return 1
+
+    print(f"{len(frames)} image(s), {args.requests} request(s) per run")
+    print(f"{'workers':>8}{'clients':>9}{'img/s':>9}{'speedup':>9}{'p50 ms':>9}{'p95 ms':>9}{'startup s':>11}")
+    baseline = None
+    for workers in range(1, args.workers + 1):
+        env = dict(os.environ)
+        if not args.no_split_threads:
+            env['INFER_THREADS'] = str(max(1, (os.cpu_count() or 1) // workers))
+        clients = args.clients or 4 * workers
+        started = time.perf_counter()
+        pool = model_workers.WorkerPool(args.weights, workers=workers, warmup_kwargs=PREDICT_KWARGS, env=env)
+        try:
+            while len([w for w in pool.worker_stats() if w['state'] == 'ready']) < workers:
+                if not pool.available:
+                    print(f"❌ Workers failed to start: {pool.error}")
+                    return 1
+                time.sleep(0.1)
+            startup = time.perf_counter() - started
+            run_clients(pool, frames, min(len(frames), args.requests), clients)  # warm every worker's caches
+            seconds, latency = run_clients(pool, frames, args.requests, clients)
+        finally:
+            pool.close()
+        throughput = args.requests / seconds
+        baseline = baseline or throughput
+        print(f"{workers:>8}{clients:>9}{throughput:>9.1f}{throughput / baseline:>8.2f}x"
+              f"{_percentile(latency, 50):>9.1f}{_percentile(latency, 95):>9.1f}{startup:>11.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
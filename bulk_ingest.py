@@ -0,0 +1,208 @@
+# bulk_ingest.py - Bulk inspection of a ZIP archive or folder of photos
+import argparse
+import os
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import database
+from inference import summary_text
+import instances as instance_store
+import postprocess
+import preprocess
+import rendering
+import storage
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+PREDICT_KWARGS = {'conf': 0.3, 'iou': 0.2, 'max_det': 10, 'retina_masks': True}
+
+
+# ===========================
+# Sources
+# ===========================
+def iter_zip(fileobj):
+    """Yield (name, bytes) for each image entry, reading one member at a time."""
+    with zipfile.ZipFile(fileobj) as zf:
+        for info in zf.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or name.startswith('.') or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            with zf.open(info) as member:
+                yield name, member.read()
+
+
+def iter_directory(path):
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(root, name), 'rb') as f:
+                    yield name, f.read()
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ===========================
+# Pipeline stages
+# ===========================
+def _decode(name, data, store):
+    """Store the original by content (duplicates are kept once) and return the letterboxed model input.
+
+    Decoded first, so an unreadable file is never stored.
+    """
+    frame = preprocess.load(data)
+    return store.put_bytes(data, name), frame
+
+
+def _discard(store, stored_name):
+    """Drop the claim on an upload whose image failed, and the file itself unless a row or request uses it."""
+    store.release(stored_name)
+    try:
+        store.remove(store.path(stored_name))
+    except FileNotFoundError:
+        pass
+
+
+def _render(stored_name, instances, upload_folder, result_folder):
+    result_filename = f"result_{uuid.uuid4().hex[:8]}.jpg"
+    # In lazy mode the overlay is drawn from stored instances when someone opens it
+    if rendering.EAGER_RESULTS:
+        rendering.save_overlay(os.path.join(upload_folder, stored_name), instances,
+                               os.path.join(result_folder, result_filename))
+    return result_filename
+
+
+def ingest(entries, scheduler, upload_folder, result_folder, timestamp, batch_size=8, workers=4, store=None):
+    """Decode, infer and store every image from `entries`; return a throughput summary."""
+    started = time.perf_counter()
+    store = store or storage.UploadStore(upload_folder)
+    batches = []
+    rows = []
+    row_instances = []
+    names = []
+    failed = []
+    claimed = []  # stored names put in the store and not yet released
+
+    def fail(name, stage, error):
+        print(f"❌ Bulk {stage} failed:", name, str(error))
+        failed.append({'name': name, 'error': str(error)})
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk') as pool:
+            for number, chunk in enumerate(chunked(entries, batch_size), 1):
+                batch_started = time.perf_counter()
+                futures = [pool.submit(_decode, name, data, store) for name, data in chunk]
+                decoded = []
+                for (name, _), future in zip(chunk, futures):
+                    try:
+                        stored_name, frame = future.result()
+                    except Exception as e:
+                        fail(name, 'decode', e)
+                        continue
+                    claimed.append(stored_name)
+                    decoded.append((name, stored_name, frame))
+
+                # The scheduler coalesces these into batched forward passes; a failed image does not stop the rest
+                futures = [scheduler.submit(frame.array, **PREDICT_KWARGS) for _, _, frame in decoded]
+                inferred = []
+                for (name, stored_name, frame), future in zip(decoded, futures):
+                    try:
+                        inferred.append((name, stored_name, frame, postprocess.from_result(future.result())))
+                    except Exception as e:
+                        fail(name, 'inference', e)
+                        claimed.remove(stored_name)
+                        _discard(store, stored_name)
+                found = [instance_store.from_detections(preprocess.to_original(postprocess.to_dicts(result), frame),
+                                                        frame.size)
+                         for _, _, frame, result in inferred]
+                rendered = list(pool.map(
+                    lambda stored_name, instances: _render(stored_name, instances, upload_folder, result_folder),
+                    [stored_name for _, stored_name, _, _ in inferred], found))
+
+                totals = [0, 0, 0]
+                for (name, stored_name, frame, result), instances, result_filename in zip(inferred, found, rendered):
+                    high, med, low = postprocess.severity_counts(result, preprocess.content_area(frame))
+                    row_instances.append(instances)
+                    names.append(os.path.basename(name))
+                    totals[0] += high
+                    totals[1] += med
+                    totals[2] += low
+                    rows.append((stored_name, result_filename, summary_text(high, med, low), high, med, low,
+                                 timestamp))
+
+                batches.append({
+                    'batch': number,
+                    'images': len(inferred),
+                    'high': totals[0],
+                    'med': totals[1],
+                    'low': totals[2],
+                    'seconds': round(time.perf_counter() - batch_started, 3),
+                })
+
+        # One transaction for every row of the ingest
+        ids = database.save_detections(rows, row_instances, names)
+    finally:
+        # Saved, or the ingest aborted: either way nothing holds these uploads any more (the gc takes orphans)
+        for stored_name in claimed:
+            store.release(stored_name)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'images': len(rows),
+        'ids': ids,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(len(rows) / elapsed, 2) if elapsed else 0.0,
+        'high': sum(b['high'] for b in batches),
+        'med': sum(b['med'] for b in batches),
+        'low': sum(b['low'] for b in batches),
+        'batches': batches,
+    }
+
+
+# ===========================
+# CLI
+# ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-inspect a ZIP archive or a folder of photos")
+    parser.add_argument('source', help="path to a .zip archive or a directory")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    from datetime import datetime
+    import app
+
+    if not app.model_loader.wait():
+        print("❌ Model not available")
+        return 1
+
+    timestamp = datetime.now(app.tz).strftime('%Y-%m-%d %H:%M:%S')
+    if os.path.isdir(args.source):
+        entries = iter_directory(args.source)
+        summary = ingest(entries, app.scheduler, app.app.config['UPLOAD_FOLDER'], app.app.config['RESULT_FOLDER'],
+                         timestamp, batch_size=args.batch_size, workers=args.workers)
+    else:
+        with open(args.source, 'rb') as f:
+            summary = ingest(iter_zip(f), app.scheduler, app.app.config['UPLOAD_FOLDER'],
+                             app.app.config['RESULT_FOLDER'], timestamp,
+                             batch_size=args.batch_size, workers=args.workers)
+
+    for batch in summary['batches']:
+        print(f"  batch {batch['batch']}: {batch['images']} image(s) in {batch['seconds']}s "
+              f"(High={batch['high']}, Medium={batch['med']}, Low={batch['low']})")
+    print(f"✅ Ingested {summary['images']} image(s) in {summary['seconds']}s "
+          f"({summary['images_per_sec']} images/sec), {len(summary['failed'])} failed")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,60 @@
+# camera_stream.py - Latest-frame-wins gate for live camera detection
+import threading
+import time
+
+
+class _ClientState:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.busy = False
+        self.seen = time.time()
+
+
+class FrameGate:
+    """Lets each camera client have at most one frame in inference.
+
+    A frame that arrives while the previous one is still being processed waits
+    in a one-deep slot; if an even newer frame arrives first, the waiting frame
+    is dropped instead of queueing behind it, so a slow model never makes the
+    overlay lag further and further behind the live video.
+    """
+
+    def __init__(self, idle_seconds=300):
+        self.idle_seconds = idle_seconds
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.counters = {'processed': 0, 'dropped': 0}
+
+    def _client(self, client_id):
+        now = time.time()
+        with self._lock:
+            for stale in [cid for cid, st in self._clients.items()
+                          if not st.busy and now - st.seen > self.idle_seconds]:
+                del self._clients[stale]
+            state = self._clients.setdefault(client_id, _ClientState())
+            state.seen = now
+            return state
+
+    def run(self, client_id, fn):
+        """Return fn() for the newest frame, or None if this frame was superseded."""
+        state = self._client(client_id)
+        with state.cond:
+            state.seq += 1
+            mine = state.seq
+            state.cond.notify_all()
+            while state.busy and state.seq == mine:
+                state.cond.wait()
+            if state.seq != mine:
+                with self._lock:
+                    self.counters['dropped'] += 1
+                return None
+            state.busy = True
+        try:
+            return fn()
+        finally:
+            with state.cond:
+                state.busy = False
+                state.cond.notify_all()
+            with self._lock:
+                self.counters['processed'] += 1
@@ -1,13 +1,154 @@
-# database.py
-import sqlite3
+# database.py - Shared SQLite access layer for the web app and scripts
 import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
 
-DB_PATH = 'corrosion.db'
+import pytz
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH, timeout=10)
-    c = conn.cursor()
-    c.execute('''
+import instances as instance_store
+import reports_query
+import stats
+import telemetry
+
+DB_PATH = os.environ.get('DATABASE_PATH', 'corrosion.db')
+
+# `timestamp` holds the site's local time; `reviewed_at` uses the same clock so the two (and the retrain
+# watermark taken from them) compare correctly
+TIMEZONE = pytz.timezone('Asia/Kuala_Lumpur')
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA foreign_keys = ON",
+)
+
+
+# ===========================
+# Connection pool
+# ===========================
+class ConnectionPool:
+    """Hands out long-lived connections, at most one per thread at a time.
+
+    Connections are reused across requests, so sqlite3's per-connection
+    statement cache (`cached_statements`) keeps hot queries prepared. A thread
+    that asks again while it already holds a connection gets the same one back,
+    so helpers can be nested inside a transaction.
+    """
+
+    def __init__(self, path, size=8):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=10, cached_statements=256, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+pool = ConnectionPool(DB_PATH, size=int(os.environ.get('DB_POOL_SIZE', 8)))
+
+
+def configure(path):
+    """Point the shared pool at another database file (benchmarks, tests); call before anything queries it."""
+    global DB_PATH, pool
+    pool.close_all()
+    DB_PATH = path
+    pool = ConnectionPool(path, size=pool.size)
+
+
+def connection():
+    return pool.connection()
+
+
+@contextmanager
+def transaction():
+    """Write transaction that takes the write lock up front (BEGIN IMMEDIATE)."""
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def query_all(sql, params=()):
+    with connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    with connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def execute(sql, params=()):
+    """Run one write statement in its own transaction; returns the cursor."""
+    with transaction() as conn:
+        return conn.execute(sql, params)
+
+
+def execute_many(sql, rows):
+    """Batched write: every row in a single transaction."""
+    with transaction() as conn:
+        return conn.executemany(sql, rows)
+
+
+# ===========================
+# Schema migrations
+# ===========================
+DETECTIONS_COLUMNS = {
+    'comments': "TEXT DEFAULT ''",
+    'custom_name': "TEXT DEFAULT ''",
+    'timestamp': "DATETIME DEFAULT CURRENT_TIMESTAMP",
+}
+
+
+def _migrate_base(conn):
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS detections (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             original_image TEXT NOT NULL,
@@ -17,20 +158,129 @@ def init_db():
             medium_severity INTEGER DEFAULT 0,
             low_severity INTEGER DEFAULT 0,
             confirmed BOOLEAN DEFAULT FALSE,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            comments TEXT DEFAULT '',
+            custom_name TEXT DEFAULT ''
         )
     ''')
+    # Databases created by older copies of the schema may lack these columns
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(detections)")}
+    for column, definition in DETECTIONS_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE detections ADD COLUMN {column} {definition}")
+    conn.commit()
+
+
+def _migrate_reviews(conn):
+    """`reviewed_at` tells a rejected detection (confirmed = 0) apart from one nobody looked at yet."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(detections)")}
+    if 'reviewed_at' not in columns:
+        conn.execute("ALTER TABLE detections ADD COLUMN reviewed_at DATETIME")
+        # Earlier confirmations only kept the flag; their timestamp (local time, like new reviews) is the best guess
+        conn.execute("UPDATE detections SET reviewed_at = COALESCE(timestamp, ?) WHERE confirmed = 1",
+                     (local_timestamp(),))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_reviewed_at ON detections (reviewed_at)")
     conn.commit()
-    conn.close()
-    print("✅ Database initialized")
-
-def save_detection(original_img, result_img, result_text, high, med, low):
-    conn = sqlite3.connect(DB_PATH, timeout=10)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO detections 
-        (original_image, result_image, result_text, high_severity, medium_severity, low_severity)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (original_img, result_img, result_text, high, med, low))
+
+
+def _migrate_storage(conn):
+    """Uploads are stored by content hash (storage.py): keep the client's file name for display, and index
+    `original_image`, whose row count is the upload's reference count."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(detections)")}
+    if 'original_name' not in columns:
+        conn.execute("ALTER TABLE detections ADD COLUMN original_name TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_original_image ON detections (original_image)")
     conn.commit()
-    conn.close()
\ No newline at end of file
+
+
+# Append only: a database at user_version N has applied MIGRATIONS[:N]
+MIGRATIONS = [
+    _migrate_base,
+    stats.init_stats,
+    reports_query.init_reports_search,
+    instance_store.init_instances,
+    _migrate_reviews,
+    _migrate_storage,
+]
+
+
+def init_db():
+    with connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migrate in enumerate(MIGRATIONS[version:], version + 1):
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+            print(f"✅ Database migrated to version {number}")
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# ===========================
+# Detections repository
+# ===========================
+INSERT_DETECTION = '''
+    INSERT INTO detections
+    (original_image, result_image, result_text, high_severity, medium_severity, low_severity, timestamp, instance_count,
+     original_name)
+    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)
+'''
+
+
+def _insert_detection(conn, row, instances, original_name=None):
+    detection_id = conn.execute(INSERT_DETECTION, (*row, None if instances is None else len(instances),
+                                                   original_name)).lastrowid
+    if instances:
+        instance_store.save_instances(conn, detection_id, instances)
+    return detection_id
+
+
+@telemetry.timed('db.save_detection')
+def save_detection(original_img, result_img, result_text, high, med, low, timestamp=None, instances=None,
+                   original_name=None):
+    """Insert one detection (and its instances, see instances.from_detections) and return its id.
+
+    `original_img` is the stored upload (storage.UploadStore name); `original_name` what the client called it.
+    """
+    with transaction() as conn:
+        return _insert_detection(conn, (original_img, result_img, result_text, high, med, low, timestamp), instances,
+                                 original_name)
+
+
+@telemetry.timed('db.save_detections')
+def save_detections(rows, instances=None, original_names=None):
+    """Insert many (original, result, text, high, med, low, timestamp) rows in one transaction; returns their ids.
+
+    `instances` and `original_names`, when given, are parallel lists.
+    """
+    if instances is None:
+        instances = [None] * len(rows)
+    if original_names is None:
+        original_names = [None] * len(rows)
+    with transaction() as conn:
+        return [_insert_detection(conn, row, row_instances, name)
+                for row, row_instances, name in zip(rows, instances, original_names)]
+
+
+@telemetry.timed('db.get_detection')
+def get_detection(detection_id):
+    return query_one("SELECT * FROM detections WHERE id = ?", (detection_id,))
+
+
+def local_timestamp():
+    return datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def review_by_result_image(correct, result_image):
+    """Record a confirm/reject verdict; reviewed_at lets the retrain export pick up only new reviews."""
+    return execute("UPDATE detections SET confirmed = ?, reviewed_at = ? WHERE result_image = ?",
+                   (correct, local_timestamp(), result_image)).rowcount
+
+
+def update_by_result_image(column, value, result_image):
+    if column not in ('comments', 'custom_name', 'confirmed'):
+        raise ValueError(f"Cannot update column {column}")
+    return execute(f"UPDATE detections SET {column} = ? WHERE result_image = ?", (value, result_image)).rowcount
+
+
+if __name__ == '__main__':
+    init_db()
@@ -1,9 +1,6 @@
 # Run this in Python to debug
-import sqlite3
-conn = sqlite3.connect('corrosion.db')
-conn.row_factory = sqlite3.Row
-c = conn.cursor()
-c.execute("SELECT * FROM detections")
-rows = c.fetchall()
+import database
+
+rows = database.query_all("SELECT * FROM detections")
 for r in rows:
-    print(dict(r))
\ No newline at end of file
+    print(dict(r))
@@ -0,0 +1,198 @@
+# derivatives.py - Thumbnails and previews of uploads and results, built once at ingest
+import argparse
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import database
+import rendering
+
+DERIVATIVE_DIR = 'static/derivatives'
+KINDS = ('original', 'result')
+SIZES = {'thumb': 240, 'medium': 960}
+FORMATS = {'webp': ('WEBP', 'image/webp', 75), 'jpeg': ('JPEG', 'image/jpeg', 80)}
+# A detection's sources never change after ingest, so its derivatives can be cached forever
+CACHE_SECONDS = 365 * 24 * 3600
+
+
+class DerivativeStore:
+    """Per-detection thumbnail/preview files under `root/<id>/<kind>_<size>.<fmt>`.
+
+    Built on a background pool right after ingest; a request for a missing
+    file builds it inline so pages never break while the pool catches up.
+    """
+
+    def __init__(self, root, upload_folder, result_folder, workers=2):
+        self.root = root
+        self.upload_folder = upload_folder
+        self.result_folder = result_folder
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivatives')
+        self._lock = threading.Lock()
+        self.counters = {'built': 0, 'failed': 0, 'files': 0, 'source_bytes': 0, 'derivative_bytes': 0,
+                         'served': 0, 'served_source_bytes': 0, 'served_bytes': 0}
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, detection_id, kind, size, fmt):
+        return os.path.join(self.root, str(detection_id), f"{kind}_{size}.{fmt}")
+
+    def _count(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self.counters[key] += amount
+
+    # ===========================
+    # Sources
+    # ===========================
+    def source_bytes(self, row, kind):
+        """Size of the file a client would otherwise download for this kind."""
+        candidates = [os.path.join(self.upload_folder, row['original_image'])]
+        if kind == 'result':
+            candidates.insert(0, os.path.join(self.result_folder, row['result_image']))
+        for path in candidates:
+            if os.path.exists(path):
+                return os.path.getsize(path)
+        return 0
+
+    def _source(self, row, kind, width):
+        if kind == 'result':
+            return rendering.render(row, self.upload_folder, self.result_folder, width)
+        path = os.path.join(self.upload_folder, row['original_image'])
+        if not os.path.exists(path):
+            return None
+        with Image.open(path) as img:
+            img.draft('RGB', (width, width))  # JPEG: decode at reduced scale when possible
+            return img.convert('RGB')
+
+    # ===========================
+    # Build
+    # ===========================
+    def build(self, row, force=False):
+        """Write every missing derivative for one detection row; returns the number of files written."""
+        written = 0
+        largest = max(SIZES.values())
+        for kind in KINDS:
+            wanted = [(size, fmt) for size in SIZES for fmt in FORMATS
+                      if force or not os.path.exists(self.path(row['id'], kind, size, fmt))]
+            if not wanted:
+                continue
+            image = self._source(row, kind, largest)
+            if image is None:
+                continue
+            source_bytes = self.source_bytes(row, kind)
+            os.makedirs(os.path.dirname(self.path(row['id'], kind, 'thumb', 'jpeg')), exist_ok=True)
+            for size, fmt in wanted:
+                variant = image.copy()
+                variant.thumbnail((SIZES[size], SIZES[size]), Image.LANCZOS)
+                path = self.path(row['id'], kind, size, fmt)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                pil_format, _, quality = FORMATS[fmt]
+                variant.save(tmp_path, pil_format, quality=quality)
+                os.replace(tmp_path, path)
+                self._count(files=1, source_bytes=source_bytes, derivative_bytes=os.path.getsize(path))
+                written += 1
+        return written
+
+    def _build_id(self, detection_id):
+        try:
+            row = database.get_detection(detection_id)
+            if row:
+                self.build(row)
+                self._count(built=1)
+        except Exception as e:
+            self._count(failed=1)
+            print("❌ Derivatives failed:", detection_id, str(e))
+
+    def submit(self, detection_id):
+        return self._pool.submit(self._build_id, detection_id)
+
+    def close(self):
+        """Finish queued builds and stop the pool."""
+        self._pool.shutdown(wait=True)
+
+    def get(self, detection_id, kind, size, fmt):
+        """Path to the derivative, building this detection's set inline if it is missing."""
+        path = self.path(detection_id, kind, size, fmt)
+        if not os.path.exists(path):
+            row = database.get_detection(detection_id)
+            if not row:
+                return None
+            self.build(row)
+            if not os.path.exists(path):
+                return None
+        return path
+
+    def record_served(self, detection_id, kind, path):
+        row = database.query_one("SELECT original_image, result_image FROM detections WHERE id = ?", (detection_id,))
+        if row:
+            self._count(served=1, served_source_bytes=self.source_bytes(row, kind),
+                        served_bytes=os.path.getsize(path))
+
+    def folders(self, detection_ids):
+        return [os.path.join(self.root, str(detection_id)) for detection_id in detection_ids]
+
+    def remove(self, detection_ids):
+        for folder in self.folders(detection_ids):
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['bytes_saved'] = stats['source_bytes'] - stats['derivative_bytes']
+        stats['served_bytes_saved'] = stats['served_source_bytes'] - stats['served_bytes']
+        return stats
+
+
+def store_from_env(upload_folder, result_folder):
+    return DerivativeStore(os.environ.get('DERIVATIVE_DIR', DERIVATIVE_DIR), upload_folder, result_folder,
+                           workers=int(os.environ.get('DERIVATIVE_WORKERS', 2)))
+
+
+# ===========================
+# CLI
+# ===========================
+def backfill(store, force=False, workers=4, page_size=500):
+    """Build derivatives for every stored detection; returns (detections, files written)."""
+    def build(row):
+        try:
+            return store.build(row, force)
+        except Exception as e:
+            print("❌ Derivatives failed:", row['id'], str(e))
+            return 0
+
+    last_id, detections, files = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = database.query_all("SELECT * FROM detections WHERE id > ? ORDER BY id LIMIT ?",
+                                      (last_id, page_size))
+            if not rows:
+                return detections, files
+            for written in pool.map(build, rows):
+                files += written
+            detections += len(rows)
+            last_id = rows[-1]['id']
+            print(f"  {detections} detection(s), {files} file(s) written")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build thumbnails/previews for existing uploads and results")
+    parser.add_argument('--force', action='store_true', help="rebuild files that already exist")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--uploads', default='static/uploads')
+    parser.add_argument('--results', default='static/results')
+    args = parser.parse_args()
+
+    database.init_db()
+    store = store_from_env(args.uploads, args.results)
+    detections, files = backfill(store, args.force, args.workers)
+    stats = store.stats()
+    saved_mb = stats['bytes_saved'] / (1024 * 1024)
+    print(f"✅ {files} derivative(s) for {detections} detection(s); "
+          f"{stats['derivative_bytes'] / 1024:.0f} KB written, {saved_mb:.1f} MB saved vs. full-size images")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,431 @@
+# evaluate.py - Offline accuracy evaluation and confidence / IoU / severity threshold sweeps
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import backends
+import postprocess
+import preprocess
+from inference import InferenceScheduler
+from result_cache import file_checksum
+
+DATASETS = ('corrosion-detection-1', 'corrosion-segmentation-1')
+SPLITS = ('valid', 'test')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+CACHE_DIR = 'runs/eval/cache'
+OUTPUT_PATH = 'runs/eval/sweep.json'
+TRAINING_RESULTS = 'runs/*/train*/results.csv'
+
+# One permissive forward pass per image; every swept setting is derived from these candidates
+RAW_SETTINGS = {'conf': 0.001, 'iou': 0.9, 'max_det': 300}
+# What app.PREDICT_SETTINGS and the 0.5 / 0.7 severity cut-offs serve today
+PRODUCTION = {'conf': 0.3, 'iou': 0.2, 'max_det': 10}
+# Ultralytics `val` defaults, the settings runs/*/train/results.csv were measured with
+REFERENCE = {'conf': 0.001, 'iou': 0.7, 'max_det': 300}
+
+CONF_GRID = (0.1, 0.2, 0.25, 0.3, 0.4, 0.5, 0.6, 0.7)
+IOU_GRID = (0.2, 0.3, 0.45, 0.6, 0.7)
+SEVERITY_GRID = ('0.4:0.6', '0.5:0.7', '0.6:0.8')
+MATCH_IOUS = np.linspace(0.5, 0.95, 10)  # mAP50-95; column 0 is the mAP50 / precision / recall threshold
+
+
+# ===========================
+# Ground truth
+# ===========================
+def list_images(dataset, split):
+    folder = os.path.join(dataset, split, 'images')
+    return sorted(path for path in glob.glob(os.path.join(folder, '*')) if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def label_path(image_path):
+    images, name = os.path.split(image_path)
+    return os.path.join(os.path.dirname(images), 'labels', os.path.splitext(name)[0] + '.txt')
+
+
+def load_labels(path):
+    """Normalised xyxy boxes from a YOLO label file; box lines and segmentation polygons both work.
+
+    Both bundled datasets are single-class, so classes are not compared.
+    """
+    boxes = []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        lines = []
+    for line in lines:
+        values = np.array(line.split()[1:], dtype=np.float64)
+        if len(values) == 4:
+            cx, cy, w, h = values
+            boxes.append([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+        elif len(values) >= 6:
+            points = values[:len(values) // 2 * 2].reshape(-1, 2)
+            boxes.append([*points.min(0), *points.max(0)])
+    return np.array(boxes, dtype=np.float64).reshape(-1, 4).clip(0, 1)
+
+
+# ===========================
+# Cached raw predictions
+# ===========================
+def weights_key(path):
+    """Short content hash of a .pt / .onnx file or an exported model folder."""
+    if not os.path.isdir(path):
+        return file_checksum(path)[:12]
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        if os.path.isfile(os.path.join(path, name)):
+            digest.update(name.encode() + file_checksum(os.path.join(path, name)).encode())
+    return digest.hexdigest()[:12]
+
+
+def _normalised(found, frame):
+    """Letterboxed model-input boxes back to 0..1 coordinates of the original image."""
+    width, height = frame.size
+    pad_x, pad_y = frame.pad
+    boxes = (found.xyxy - [pad_x, pad_y, pad_x, pad_y]) / frame.scale / [width, height, width, height]
+    order = np.argsort(-found.conf, kind='stable')
+    return boxes.clip(0, 1)[order].astype(np.float32), found.conf[order].astype(np.float32)
+
+
+def predict_images(model, paths, batch=8, workers=16):
+    """Raw candidates for every path: decoding runs on a thread pool, forward passes are batched."""
+    scheduler = InferenceScheduler(model, max_batch_size=batch, max_wait_ms=5)
+
+    def predict(path):
+        frame = preprocess.load(path)
+        result = scheduler.predict(frame.array, verbose=False, **RAW_SETTINGS)
+        return _normalised(postprocess.from_result(result, mask_area=False), frame)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(predict, paths))
+
+
+def load_predictions(groups, weights, backend='pytorch', precision='fp32', cache_dir=CACHE_DIR, refresh=False,
+                     batch=8, workers=16):
+    """{(dataset, split): [(boxes, conf) per image]}, from cache where the weights and images are unchanged.
+
+    Splits missing from the cache are predicted together, so the model only
+    loads once and batches span splits.
+    """
+    artifact = backends.artifact_path(weights, backend, precision)
+    key = {'weights': weights_key(artifact), 'backend': backend, 'precision': precision, 'raw': RAW_SETTINGS,
+           'size': preprocess.MODEL_SIZE}
+    os.makedirs(cache_dir, exist_ok=True)
+    predictions, missing = {}, []
+    for (dataset, split), paths in groups.items():
+        cache_path = os.path.join(cache_dir, f"{dataset}_{split}_{key['weights']}_{backend}_{precision}.npz")
+        expected = json.dumps(dict(key, images=[os.path.basename(path) for path in paths]), sort_keys=True)
+        if not refresh and os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                if str(cached['key']) == expected:
+                    offsets = cached['offsets']
+                    predictions[dataset, split] = [
+                        (cached['boxes'][start:end], cached['conf'][start:end])
+                        for start, end in zip(offsets[:-1], offsets[1:])]
+                    continue
+        missing.append(((dataset, split), paths, cache_path, expected))
+
+    if missing:
+        model, _ = backends.load(weights, backend, precision=precision)
+        paths = [path for _, group_paths, _, _ in missing for path in group_paths]
+        raw = iter(predict_images(model, paths, batch, workers))
+        for group, group_paths, cache_path, expected in missing:
+            items = [next(raw) for _ in group_paths]
+            offsets = np.cumsum([0] + [len(conf) for _, conf in items])
+            np.savez(cache_path, key=np.array(expected), offsets=offsets,
+                     boxes=np.concatenate([boxes for boxes, _ in items] or [np.zeros((0, 4), np.float32)]),
+                     conf=np.concatenate([conf for _, conf in items] or [np.zeros(0, np.float32)]))
+            predictions[group] = items
+    return predictions, len(missing)
+
+
+# ===========================
+# Matching
+# ===========================
+def nms(iou, threshold):
+    """Greedy NMS over confidence-sorted candidates, given their IoU matrix (suppresses IoU > threshold)."""
+    suppressed = np.zeros(len(iou), dtype=bool)
+    keep = []
+    for i in range(len(iou)):
+        if not suppressed[i]:
+            keep.append(i)
+            suppressed |= iou[i] > threshold
+    return np.array(keep, dtype=np.int64)
+
+
+def match(iou):
+    """TP flags (predictions x MATCH_IOUS); predictions in confidence order each take their best free truth.
+
+    Matching in confidence order means the flags of any confidence cut-off or
+    max_det prefix are the prefix of these, which is what lets every setting
+    be scored from one pass.
+    """
+    tp = np.zeros((iou.shape[0], len(MATCH_IOUS)), dtype=bool)
+    if not iou.size:
+        return tp
+    taken = np.zeros((len(MATCH_IOUS), iou.shape[1]), dtype=bool)
+    rows = np.arange(len(MATCH_IOUS))
+    for i in np.flatnonzero(iou.max(1) >= MATCH_IOUS[0]):
+        candidates = np.where(~taken & (iou[i][None, :] >= MATCH_IOUS[:, None]), iou[i][None, :], -1)
+        best = candidates.argmax(1)
+        hit = candidates[rows, best] >= 0
+        taken[rows[hit], best[hit]] = True
+        tp[i] = hit
+    return tp
+
+
+class ImageEval:
+    """One image's candidates, ground truth and per-NMS-threshold matches."""
+
+    def __init__(self, boxes, conf, truth):
+        self.boxes, self.conf, self.truth = boxes.astype(np.float64), conf, truth
+        self.area = postprocess.box_areas(self.boxes)  # fraction of the image: coordinates are 0..1
+        self._pairwise = postprocess.box_iou(self.boxes, self.boxes)
+        self._truth_iou = postprocess.box_iou(self.boxes, truth)
+        self._kept = {}
+
+    def kept(self, nms_iou):
+        """(indices, TP flags) surviving NMS at `nms_iou`, in confidence order."""
+        if nms_iou not in self._kept:
+            keep = nms(self._pairwise, nms_iou)
+            self._kept[nms_iou] = keep, match(self._truth_iou[keep])
+        return self._kept[nms_iou]
+
+
+# ===========================
+# Sweep
+# ===========================
+def average_precision(tp_cum, count, truths):
+    """COCO 101-point AP per MATCH_IOUS column for the first `count` ranked predictions."""
+    if not truths or not count:
+        return np.zeros(tp_cum.shape[1])
+    recall = tp_cum[:count] / truths
+    precision = tp_cum[:count] / np.arange(1, count + 1)[:, None]
+    envelope = np.maximum.accumulate(precision[::-1], axis=0)[::-1]
+    points = np.linspace(0, 1, 101)
+    ap = np.zeros(tp_cum.shape[1])
+    for column in range(tp_cum.shape[1]):
+        index = np.searchsorted(recall[:, column], points, side='left')
+        ap[column] = np.where(index < count, envelope[np.minimum(index, count - 1), column], 0).mean()
+    return ap
+
+
+def severity_table(tp50, levels, truths):
+    """Predicted severity vs. ground truth: detections, true / false positives per level, plus missed spots."""
+    table = {}
+    for index, level in enumerate(postprocess.LEVELS):
+        mask = levels == index
+        hits = int(tp50[mask].sum())
+        table[level] = {'detections': int(mask.sum()), 'tp': hits, 'fp': int(mask.sum()) - hits,
+                        'precision': round(hits / mask.sum(), 4) if mask.any() else None}
+    table['missed'] = truths - int(tp50.sum())
+    return table
+
+
+def score(images, nms_iou, max_det, confs, rules):
+    """Metrics for every confidence cut-off at one (NMS IoU, max_det): a single sort plus cumulative sums."""
+    parts = [(image.conf[keep[:max_det]], tp[:max_det], image.area[keep[:max_det]])
+             for image in images for keep, tp in [image.kept(nms_iou)]]
+    truths = sum(len(image.truth) for image in images)
+    conf = np.concatenate([part[0] for part in parts] + [np.zeros(0)])
+    tp = np.concatenate([part[1] for part in parts] + [np.zeros((0, len(MATCH_IOUS)), dtype=bool)])
+    area = np.concatenate([part[2] for part in parts] + [np.zeros(0)])
+    order = np.argsort(-conf, kind='stable')
+    conf, tp, area = conf[order], tp[order], area[order]
+    tp_cum = np.cumsum(tp, axis=0)
+    levels = {name: rule.classify(conf, area) for name, rule in rules.items()}
+
+    rows = []
+    for threshold in confs:
+        count = int((conf > threshold).sum())
+        hits = int(tp_cum[count - 1, 0]) if count else 0
+        precision = hits / count if count else 0.0
+        recall = hits / truths if truths else 0.0
+        ap = average_precision(tp_cum, count, truths)
+        rows.append({
+            'conf': threshold, 'iou': nms_iou, 'max_det': max_det, 'detections': count, 'tp': hits,
+            'precision': round(precision, 4), 'recall': round(recall, 4),
+            'f1': round(2 * precision * recall / (precision + recall), 4) if hits else 0.0,
+            'map50': round(float(ap[0]), 4), 'map50_95': round(float(ap.mean()), 4),
+            'severity': {name: severity_table(tp[:count, 0], level[:count], truths) for name, level in levels.items()},
+        })
+    return rows
+
+
+def reference_metrics(images):
+    """Ultralytics-style summary at REFERENCE settings: mAP over all candidates, P / R at the best-F1 cut-off."""
+    row = score(images, REFERENCE['iou'], REFERENCE['max_det'], [REFERENCE['conf']], {})[0]
+    truths = sum(len(image.truth) for image in images)
+    best = {'precision': 0.0, 'recall': 0.0, 'conf': None}
+    parts = [(image.conf[keep], tp[:, 0]) for image in images for keep, tp in [image.kept(REFERENCE['iou'])]]
+    conf = np.concatenate([part[0] for part in parts] + [np.zeros(0)])
+    if len(conf) and truths:
+        order = np.argsort(-conf, kind='stable')
+        hits = np.cumsum(np.concatenate([part[1] for part in parts])[order])
+        precision, recall = hits / np.arange(1, len(hits) + 1), hits / truths
+        f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-9)
+        index = int(f1.argmax())
+        best = {'precision': round(float(precision[index]), 4), 'recall': round(float(recall[index]), 4),
+                'conf': round(float(conf[order][index]), 4)}
+    return {'images': len(images), 'instances': truths, 'map50': row['map50'], 'map50_95': row['map50_95'], **best}
+
+
+def severity_rules(specs):
+    """{'current': postprocess.RULES, 'conf 0.5/0.7': ...} from MED:HIGH confidence pairs."""
+    rules = {'current': postprocess.RULES}
+    for spec in specs:
+        try:
+            med, high = (float(value) for value in spec.split(':'))
+        except ValueError:
+            raise ValueError(f"Severity cut-offs are MED:HIGH confidences, got {spec!r}")
+        rules[f"conf {med:g}/{high:g}"] = postprocess.SeverityRules({'high': [{'conf': high}], 'med': [{'conf': med}]})
+    return rules
+
+
+# ===========================
+# Training runs
+# ===========================
+def training_runs(pattern=TRAINING_RESULTS):
+    """Best epoch (Ultralytics fitness: 0.1 mAP50 + 0.9 mAP50-95) of every run's results.csv, box metrics."""
+    runs = []
+    for path in sorted(glob.glob(pattern)):
+        folder = os.path.dirname(path)
+        with open(path, newline='') as f:
+            rows = [{key.strip(): value.strip() for key, value in row.items()} for row in csv.DictReader(f)]
+        if not rows:
+            continue
+        best = max(rows, key=lambda row: 0.1 * float(row['metrics/mAP50(B)']) + 0.9 * float(row['metrics/mAP50-95(B)']))
+        dataset = None
+        try:
+            with open(os.path.join(folder, 'args.yaml')) as f:
+                for line in f:
+                    if line.startswith('data:'):
+                        # Trained elsewhere (e.g. C:\corrosion-ai\corrosion-detection-1/data.yaml): keep the folder
+                        dataset = re.split(r'[\\/]', line.split(':', 1)[1].strip())[-2]
+        except (OSError, IndexError):
+            pass
+        runs.append({
+            'run': folder, 'dataset': dataset, 'epoch': int(float(best['epoch'])), 'epochs': len(rows),
+            'precision': float(best['metrics/precision(B)']), 'recall': float(best['metrics/recall(B)']),
+            'map50': float(best['metrics/mAP50(B)']), 'map50_95': float(best['metrics/mAP50-95(B)']),
+        })
+    return runs
+
+
+# ===========================
+# CLI
+# ===========================
+def _print_sweep(rows, production):
+    print(f"  {'conf':>6}{'iou':>6}{'dets':>7}{'P':>8}{'R':>8}{'F1':>8}{'mAP50':>8}{'mAP50-95':>10}")
+    for row in rows:
+        mark = '  ← production' if production == (row['conf'], row['iou'], row['max_det']) else ''
+        print(f"  {row['conf']:>6g}{row['iou']:>6g}{row['detections']:>7}{row['precision']:>8.3f}"
+              f"{row['recall']:>8.3f}{row['f1']:>8.3f}{row['map50']:>8.3f}{row['map50_95']:>10.3f}{mark}")
+
+
+def _print_severity(row):
+    print(f"  severity at conf {row['conf']:g}, iou {row['iou']:g}, max_det {row['max_det']} "
+          f"(detections tp/fp per level, precision):")
+    for name, table in row['severity'].items():
+        cells = ''.join(f"{table[level]['tp']:>5}/{table[level]['fp']:<4}"
+                        f"{'-' if table[level]['precision'] is None else format(table[level]['precision'], '.2f'):>6}"
+                        for level in postprocess.LEVELS)
+        print(f"    {name:<16}{cells}  missed {table['missed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the model on the bundled datasets and sweep "
+                                                 "confidence / NMS IoU / severity thresholds from cached predictions")
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--backend', choices=backends.BACKENDS, default='pytorch')
+    parser.add_argument('--precision', choices=backends.PRECISIONS, default='fp32')
+    parser.add_argument('--datasets', nargs='+', default=list(DATASETS))
+    parser.add_argument('--splits', nargs='+', default=list(SPLITS))
+    parser.add_argument('--conf', type=float, nargs='+', default=list(CONF_GRID))
+    parser.add_argument('--iou', type=float, nargs='+', default=list(IOU_GRID),
+                        help=f"NMS IoU thresholds (at most {RAW_SETTINGS['iou']}, the cached pass)")
+    parser.add_argument('--max-det', type=int, nargs='+', default=[PRODUCTION['max_det']])
+    parser.add_argument('--severity', nargs='+', default=list(SEVERITY_GRID), metavar='MED:HIGH',
+                        help="confidence cut-offs to compare with the current SEVERITY_RULES")
+    parser.add_argument('--batch', type=int, default=8, help="images per forward pass on the uncached run")
+    parser.add_argument('--workers', type=int, default=16, help="image decoding threads")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--refresh', action='store_true', help="ignore cached predictions")
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    args = parser.parse_args()
+
+    if max(args.iou) > RAW_SETTINGS['iou'] or max(args.max_det) > RAW_SETTINGS['max_det']:
+        print(f"❌ Sweeps are limited to iou <= {RAW_SETTINGS['iou']} and max_det <= {RAW_SETTINGS['max_det']}")
+        return 1
+    groups = {(dataset, split): list_images(dataset, split) for dataset in args.datasets for split in args.splits}
+    groups = {group: paths for group, paths in groups.items() if paths}
+    if not groups:
+        print(f"❌ No images under {args.datasets} / {args.splits}")
+        return 1
+    rules = severity_rules(args.severity)
+
+    started = time.perf_counter()
+    predictions, predicted = load_predictions(groups, args.weights, args.backend, args.precision, args.cache_dir,
+                                              args.refresh, args.batch, args.workers)
+    images = {group: [ImageEval(boxes, conf, load_labels(label_path(path)))
+                      for path, (boxes, conf) in zip(paths, predictions[group])]
+              for group, paths in groups.items()}
+    print(f"📦 {sum(map(len, groups.values()))} image(s) in {len(groups)} split(s): "
+          f"{predicted} predicted, {len(groups) - predicted} from cache ({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    pooled = [image for group in images.values() for image in group]
+    report = {'settings': {'raw': RAW_SETTINGS, 'production': PRODUCTION, 'reference': REFERENCE,
+                           'weights': args.weights, 'backend': args.backend, 'precision': args.precision,
+                           'severity_rules': {name: rule.as_dict() for name, rule in rules.items()}},
+              'reference': {f"{dataset}/{split}": reference_metrics(group) for (dataset, split), group in images.items()},
+              'sweep': [row for nms_iou in args.iou for max_det in args.max_det
+                        for row in score(pooled, nms_iou, max_det, args.conf, rules)],
+              'training_runs': training_runs()}
+    report['reference']['all'] = reference_metrics(pooled)
+    production = tuple(PRODUCTION[key] for key in ('conf', 'iou', 'max_det'))
+    if production[2] in args.max_det:
+        report['production'] = score(pooled, PRODUCTION['iou'], PRODUCTION['max_det'], [PRODUCTION['conf']], rules)[0]
+    sweep_seconds = time.perf_counter() - started
+
+    print(f"\n📊 Reference (conf {REFERENCE['conf']}, iou {REFERENCE['iou']}, max_det {REFERENCE['max_det']}):")
+    print(f"  {'split':<36}{'imgs':>6}{'inst':>6}{'P':>8}{'R':>8}{'mAP50':>8}{'mAP50-95':>10}")
+    for name, metrics in report['reference'].items():
+        print(f"  {name:<36}{metrics['images']:>6}{metrics['instances']:>6}{metrics['precision']:>8.3f}"
+              f"{metrics['recall']:>8.3f}{metrics['map50']:>8.3f}{metrics['map50_95']:>10.3f}")
+
+    if report['training_runs']:
+        print("\n🏋️ Training runs (best epoch, validated on valid/):")
+        print(f"  {'run':<24}{'epoch':>9}{'P':>8}{'R':>8}{'mAP50':>8}{'mAP50-95':>10}   vs. offline mAP50-95")
+        for run in report['training_runs']:
+            offline = report['reference'].get(f"{run['dataset']}/valid")
+            delta = f"{offline['map50_95']:.3f} ({offline['map50_95'] - run['map50_95']:+.3f})" if offline else '-'
+            print(f"  {run['run']:<24}{run['epoch']:>5}/{run['epochs']:<3}{run['precision']:>8.3f}{run['recall']:>8.3f}"
+                  f"{run['map50']:>8.3f}{run['map50_95']:>10.3f}   {delta}")
+
+    print(f"\n🎚️ Sweep over all splits ({len(report['sweep'])} settings):")
+    _print_sweep(report['sweep'], production)
+    best = max(report['sweep'], key=lambda row: (row['f1'], row['map50_95']))
+    print(f"\n🏆 Best F1: conf {best['conf']:g}, iou {best['iou']:g}, max_det {best['max_det']} "
+          f"(P {best['precision']:.3f}, R {best['recall']:.3f}, F1 {best['f1']:.3f})")
+    for row in [report.get('production'), best]:
+        if row:
+            _print_severity(row)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n⏱️ Sweep scored in {sweep_seconds:.2f}s; 📝 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,13 +1,93 @@
 # generate_pdf.py
+from concurrent.futures import ThreadPoolExecutor
 from fpdf import FPDF
 from PIL import Image
+import glob
+import hashlib
 import os
+import tempfile
+import threading
+
+import rendering
+import telemetry
+
+REPORT_CACHE_DIR = 'static/reports/cache'
+
+# Images are placed 90 mm wide; 150 dpi is plenty for print and keeps PDFs small
+IMAGE_WIDTH_MM = 90
+PRINT_DPI = 150
+JPEG_QUALITY = 80
+
+_pregen_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf')
+
+
+def print_width_px(width_mm=IMAGE_WIDTH_MM, dpi=PRINT_DPI):
+    return int(width_mm / 25.4 * dpi)
+
+
+def print_ready_image(source, width_mm=IMAGE_WIDTH_MM, dpi=PRINT_DPI, quality=JPEG_QUALITY):
+    """Downscale/recompress a path or PIL image to the print size it will occupy; returns a temp JPEG path."""
+    max_px = print_width_px(width_mm, dpi)
+    if isinstance(source, Image.Image):
+        img = source.convert('RGB')
+    else:
+        with Image.open(source) as img:
+            img.draft('RGB', (max_px, max_px))  # JPEG: decode at reduced scale when possible
+            img = img.convert('RGB')
+    img.thumbnail((max_px, max_px * 4), Image.LANCZOS)
+    fd, tmp_path = tempfile.mkstemp(suffix='.jpg')
+    with os.fdopen(fd, 'wb') as f:
+        img.save(f, 'JPEG', quality=quality, optimize=True)
+    return tmp_path
+
+
+def latin1(text):
+    """FPDF 1.7 core fonts only encode latin-1; replace anything else instead of failing output."""
+    return str(text).encode('latin-1', 'replace').decode('latin-1')
+
+
+def prepare_images(original_image, result_image):
+    """Print-ready copies of both images (paths or PIL images); None for a missing one. Free with `remove_images`."""
+    images = []
+    try:
+        for source in (original_image, result_image):
+            if source is None or (isinstance(source, str) and not os.path.exists(source)):
+                images.append(None)
+            else:
+                images.append(print_ready_image(source))
+    except Exception:
+        remove_images(images)
+        raise
+    return images
 
-def create_pdf_report(original_image_path, result_image_path, result_text, pdf_path, original_filename, comments="", custom_name=""):
-    # Use custom name if available
-    display_name = custom_name.strip() if custom_name.strip() else original_filename
 
+def remove_images(images):
+    for path in images:
+        if path:
+            os.remove(path)
+
+
+def create_pdf_report(original_image_path, result_image_path, result_text, pdf_path, original_filename, comments="", custom_name="", report_label=None):
     pdf = FPDF()
+    images, image_error = [], None
+    try:
+        images = prepare_images(original_image_path, result_image_path)
+    except Exception as e:
+        image_error = e
+    try:
+        add_report_page(pdf, images, result_text, original_filename, comments, custom_name,
+                        report_label or os.path.basename(pdf_path), image_error)
+        pdf.output(pdf_path)
+    finally:
+        remove_images(images)
+
+
+def add_report_page(pdf, images, result_text, original_filename, comments="", custom_name="", report_label="", image_error=None):
+    """Lay out one detection on a new page; `images` are print-ready (original, result) paths, None if missing."""
+    # Use custom name if available
+    display_name = latin1(custom_name.strip() if custom_name.strip() else original_filename)
+    original_filename, comments = latin1(original_filename), latin1(comments)
+
     pdf.add_page()
     pdf.set_font("Arial", 'B', 16)
     pdf.set_text_color(0, 0, 128)
@@ -19,11 +99,11 @@ def create_pdf_report(original_image_path, result_image_path, result_text, pdf_p
     pdf.set_text_color(0, 0, 0)
     pdf.cell(0, 8, f"Report: {display_name}", ln=True)
     pdf.cell(0, 8, f"Image: {original_filename}", ln=True)
-    pdf.cell(0, 8, f"Generated on: {os.path.basename(pdf_path)}", ln=True)
+    pdf.cell(0, 8, f"Generated on: {report_label}", ln=True)
     pdf.ln(5)
 
     # Detection result
-    clean_text = result_text.replace('<br>', '\n')
+    clean_text = latin1(result_text.replace('<br>', '\n'))
     pdf.set_font("Arial", size=11)
     pdf.multi_cell(0, 6, clean_text)
     pdf.ln(5)
@@ -41,15 +121,18 @@ def create_pdf_report(original_image_path, result_image_path, result_text, pdf_p
     # Images
     y = pdf.get_y() + 10
     try:
-        if os.path.exists(original_image_path):
-            pdf.image(original_image_path, x=10, y=y, w=90)
+        if image_error:
+            raise image_error
+        original, result = images
+        if original:
+            pdf.image(original, x=10, y=y, w=IMAGE_WIDTH_MM)
         else:
-            pdf.cell(90, 80, "❌ Original image missing", border=1)
+            pdf.cell(90, 80, "[Original image missing]", border=1)
 
-        if os.path.exists(result_image_path):
-            pdf.image(result_image_path, x=105, y=y, w=90)
+        if result:
+            pdf.image(result, x=105, y=y, w=IMAGE_WIDTH_MM)
         else:
-            pdf.cell(90, 80, "❌ Detected image missing", border=1)
+            pdf.cell(90, 80, "[Detected image missing]", border=1)
 
         pdf.set_y(y + 85)
         pdf.set_font("Arial", 'I', 10)
@@ -57,6 +140,144 @@ def create_pdf_report(original_image_path, result_image_path, result_text, pdf_p
         pdf.cell(90, 6, "Original Image", align='C')
         pdf.cell(90, 6, "Detected Corrosion", align='C')
     except Exception as e:
-        pdf.cell(0, 10, f"Error embedding images: {str(e)}", ln=True)
+        pdf.cell(0, 10, latin1(f"Error embedding images: {str(e)}"), ln=True)
+
+
+SUMMARY_COLUMNS = (('ID', 15), ('Report', 70), ('Date', 40), ('High', 15), ('Medium', 15), ('Low', 15), ('Confirmed', 20))
+
+
+def add_summary_pages(pdf, rows, title="Site Visit Summary"):
+    """Severity table for every listed detection plus a totals row; `rows` may be any iterable."""
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', 16)
+    pdf.set_text_color(0, 0, 128)
+    pdf.cell(0, 10, title, ln=True, align='C')
+    pdf.ln(5)
+
+    def header():
+        pdf.set_font("Arial", 'B', 10)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_fill_color(220, 220, 235)
+        for label, width in SUMMARY_COLUMNS:
+            pdf.cell(width, 7, label, border=1, align='C', fill=True)
+        pdf.ln()
+        pdf.set_font("Arial", size=9)
+
+    header()
+    totals = {'reports': 0, 'high': 0, 'med': 0, 'low': 0, 'confirmed': 0}
+    for row in rows:
+        if pdf.get_y() > pdf.page_break_trigger - 7:
+            pdf.add_page()
+            header()
+        name = (row['custom_name'] or '').strip() or display_name(row)
+        high, med, low = row['high_severity'] or 0, row['medium_severity'] or 0, row['low_severity'] or 0
+        confirmed = bool(row['confirmed'])
+        values = (str(row['id']), latin1(name[:40]), str(row['timestamp'] or '')[:16], str(high), str(med), str(low),
+                  'Yes' if confirmed else 'No')
+        for (_, width), value in zip(SUMMARY_COLUMNS, values):
+            pdf.cell(width, 6, value, border=1)
+        pdf.ln()
+        totals['reports'] += 1
+        totals['high'] += high
+        totals['med'] += med
+        totals['low'] += low
+        totals['confirmed'] += confirmed
+
+    pdf.set_font("Arial", 'B', 10)
+    pdf.cell(125, 7, f"Total: {totals['reports']} report(s)", border=1)
+    for key in ('high', 'med', 'low'):
+        pdf.cell(15, 7, str(totals[key]), border=1)
+    pdf.cell(20, 7, str(totals['confirmed']), border=1)
+    pdf.ln()
+    return totals
+
+
+def display_name(row):
+    """The file name the client uploaded; stored uploads are named by content hash."""
+    return row['original_name'] or row['original_image']
+
+
+# ===========================
+# Report cache
+# ===========================
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def report_version(row, original_image_path, result_image_path):
+    """Fingerprint of everything that appears in the PDF."""
+    parts = [row['result_text'], row['comments'], row['custom_name'], row['original_image'], row['original_name'],
+             row['instance_count'], _mtime(original_image_path), _mtime(result_image_path)]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+
+
+def cached_report_path(detection_id, version, cache_dir=REPORT_CACHE_DIR):
+    return os.path.join(cache_dir, f"report_{detection_id}_{version}.pdf")
+
+
+def cached_reports(detection_ids, cache_dir=REPORT_CACHE_DIR):
+    """Every cached PDF of the given reports, from one directory scan (no glob per id)."""
+    wanted = {str(detection_id) for detection_id in detection_ids}
+    try:
+        with os.scandir(cache_dir) as entries:
+            return [entry.path for entry in entries
+                    if entry.name.startswith('report_') and entry.name.split('_')[1] in wanted]
+    except FileNotFoundError:
+        return []
+
+
+def invalidate_reports(detection_ids, cache_dir=REPORT_CACHE_DIR, keep=None):
+    """Drop every cached version of the given reports (except `keep`)."""
+    removed = 0
+    for detection_id in detection_ids:
+        for path in glob.glob(os.path.join(cache_dir, f"report_{detection_id}_*.pdf")):
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def get_report_pdf(detection_id, row, upload_folder, result_folder, cache_dir=REPORT_CACHE_DIR):
+    """Return the path of an up-to-date PDF for this detection, generating it only if needed."""
+    orig_path = os.path.join(upload_folder, row['original_image'])
+    result_path = os.path.join(result_folder, row['result_image'])
+    pdf_path = cached_report_path(detection_id, report_version(row, orig_path, result_path), cache_dir)
+    if os.path.exists(pdf_path):
+        return pdf_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    invalidate_reports([detection_id], cache_dir, keep=pdf_path)
+    tmp_path = f"{pdf_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with telemetry.stage('render'):
+        # Drawn at print size from stored instances when no result JPEG was written
+        result_image = rendering.render(row, upload_folder, result_folder, print_width_px())
+    with telemetry.stage('pdf'):
+        create_pdf_report(
+            orig_path,
+            result_image,
+            row['result_text'] or '',
+            tmp_path,
+            display_name(row),
+            row['comments'] or '',
+            row['custom_name'] or '',
+            report_label=f"report_{detection_id}.pdf"
+        )
+    os.replace(tmp_path, pdf_path)
+    return pdf_path
+
 
-    pdf.output(pdf_path)
\ No newline at end of file
+def pregenerate_report(detection_id, row, upload_folder, result_folder):
+    """Build the PDF on a background thread so the first download is a cache hit."""
+    def build():
+        try:
+            get_report_pdf(detection_id, row, upload_folder, result_folder)
+        except Exception as e:
+            print("❌ PDF pre-generation failed:", detection_id, str(e))
+    return _pregen_pool.submit(build)
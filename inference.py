@@ -0,0 +1,188 @@
+# inference.py - Micro-batching scheduler in front of the shared YOLO model
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import postprocess
+import telemetry
+
+STAGES = ('queue_wait', 'inference', 'total')
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class InferenceScheduler:
+    """Collects images arriving within a short window and runs them as one batched model call.
+
+    Only the scheduler thread touches the model, so Flask request threads never
+    run forward passes concurrently; they block on a Future until their result
+    has been fanned back out of the batch. The model may be attached after
+    construction; images submitted before then wait in the queue.
+    """
+
+    def __init__(self, model=None, max_batch_size=4, max_wait_ms=10, sample_size=1000):
+        self.model = model
+        self._ready = threading.Event()
+        self._load_error = None
+        if model is not None:
+            self._ready.set()
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._latency = {stage: deque(maxlen=sample_size) for stage in STAGES}
+        self._batches = 0
+        self._images = 0
+        self._errors = 0
+        self._thread = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+        self._thread.start()
+
+    # ===========================
+    # Public API
+    # ===========================
+    def submit(self, image, **kwargs):
+        """Queue one image; the returned Future resolves to its single Results object."""
+        future = Future()
+        key = tuple(sorted(kwargs.items()))
+        self._queue.put((image, kwargs, key, future, time.perf_counter()))
+        return future
+
+    def predict(self, image, timeout=None, **kwargs):
+        return self.submit(image, **kwargs).result(timeout)
+
+    def attach(self, model):
+        """Start serving queued and future images with `model`."""
+        self.model = model
+        self._ready.set()
+
+    def fail(self, error):
+        """The model could not be loaded: fail queued and future images with `error`."""
+        self._load_error = error
+        self._ready.set()
+
+    def stats(self):
+        with self._lock:
+            latency = {}
+            for stage, samples in self._latency.items():
+                values = sorted(samples)
+                latency[stage] = {
+                    'count': len(values),
+                    'p50_ms': round(_percentile(values, 50) * 1000, 2),
+                    'p95_ms': round(_percentile(values, 95) * 1000, 2),
+                    'p99_ms': round(_percentile(values, 99) * 1000, 2),
+                }
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'batches': self._batches,
+                'images': self._images,
+                'errors': self._errors,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'latency': latency,
+            }
+
+    # ===========================
+    # Scheduler loop
+    # ===========================
+    def _collect(self):
+        pending = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    pending.append(self._queue.get_nowait())
+                else:
+                    pending.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return pending
+
+    def _run(self):
+        self._ready.wait()
+        while True:
+            pending = self._collect()
+            try:
+                # Calls with different thresholds cannot share a forward pass
+                groups = {}
+                for item in pending:
+                    groups.setdefault(item[2], []).append(item)
+
+                for items in groups.values():
+                    self._run_batch(items)
+            except Exception as e:
+                # Grouping (an unhashable kwarg) or bookkeeping failed: fail what is still waiting, keep serving
+                print("❌ Scheduler error:", str(e))
+                unresolved = [item for item in pending if not item[3].done()]
+                for item in unresolved:
+                    item[3].set_exception(e)
+                with self._lock:
+                    self._errors += len(unresolved)
+
+    def _run_batch(self, items):
+        started = time.perf_counter()
+        kwargs = items[0][1]
+        try:
+            if self.model is None:
+                raise RuntimeError(f"Model not available: {self._load_error}")
+            results = self.model([item[0] for item in items], **kwargs)
+        except Exception as e:
+            print("❌ Batch inference failed:", str(e))
+            for item in items:
+                item[3].set_exception(e)
+            with self._lock:
+                self._errors += len(items)
+            return
+
+        finished = time.perf_counter()
+        telemetry.observe_stage('forward', finished - started, endpoint='scheduler')
+        for item, result in zip(items, results):
+            telemetry.observe_stage('queue_wait', started - item[4], endpoint='scheduler')
+            item[3].set_result(result)
+
+        with self._lock:
+            self._batches += 1
+            self._images += len(items)
+            self._batch_sizes[len(items)] += 1
+            self._latency['inference'].append(finished - started)
+            for item in items:
+                self._latency['queue_wait'].append(started - item[4])
+                self._latency['total'].append(finished - item[4])
+
+
+def scheduler_from_env(model=None):
+    """Build a scheduler sized by INFER_MAX_BATCH / INFER_MAX_WAIT_MS; the model may be attached later."""
+    return InferenceScheduler(
+        model,
+        max_batch_size=int(os.environ.get('INFER_MAX_BATCH', 4)),
+        max_wait_ms=float(os.environ.get('INFER_MAX_WAIT_MS', 10)),
+    )
+
+
+def severity_counts(result, image_area=None):
+    """(high, medium, low) counts for one Results object under postprocess.RULES."""
+    return postprocess.severity_counts(postprocess.from_result(result), image_area)
+
+
+def severity_from_detections(detections, image_area=None):
+    """`severity_counts` for plain detections (see `extract_detections`)."""
+    return postprocess.severity_counts(postprocess.from_dicts(detections), image_area)
+
+
+def summary_text(high, med, low):
+    return f"Corrosion Detected: PASS ({high+med+low} spot(s))<br>Severity: High={high}, Medium={med}, Low={low}"
+
+
+def extract_detections(result):
+    """Plain-Python boxes, mask areas (and polygons, when present) from one Results object."""
+    return postprocess.to_dicts(postprocess.from_result(result))
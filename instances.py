@@ -0,0 +1,200 @@
+# instances.py - Per-detection instance store (class, confidence, box, mask polygon, area)
+import argparse
+
+import numpy as np
+
+import postprocess
+
+# Coordinates and areas are normalised to the original image (0..1), so they do not
+# depend on the stored image size and map directly onto YOLO label files.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS detection_instances (
+    detection_id INTEGER NOT NULL REFERENCES detections (id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    cls INTEGER NOT NULL,
+    conf REAL NOT NULL,
+    x1 REAL NOT NULL,
+    y1 REAL NOT NULL,
+    x2 REAL NOT NULL,
+    y2 REAL NOT NULL,
+    area REAL NOT NULL,
+    polygon BLOB,
+    PRIMARY KEY (detection_id, idx)
+) WITHOUT ROWID;
+'''
+
+INSERT_INSTANCE = '''
+    INSERT INTO detection_instances (detection_id, idx, cls, conf, x1, y1, x2, y2, area, polygon)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def init_instances(conn):
+    """Create the instance table; `instance_count` is NULL for rows saved before it existed."""
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(detections)")}
+    if 'instance_count' not in columns:
+        conn.execute("ALTER TABLE detections ADD COLUMN instance_count INTEGER")
+    conn.commit()
+
+
+# ===========================
+# Encoding
+# ===========================
+def encode_polygon(points):
+    """Pack an (N, 2) polygon as little-endian float32 pairs."""
+    return np.asarray(points, dtype='<f4').reshape(-1, 2).tobytes()
+
+
+def decode_polygon(blob):
+    if not blob:
+        return np.zeros((0, 2), dtype=np.float32)
+    return np.frombuffer(blob, dtype='<f4').reshape(-1, 2)
+
+
+def polygon_area(points):
+    """Shoelace area of an (N, 2) polygon."""
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 3:
+        return 0.0
+    x, y = points[:, 0], points[:, 1]
+    return float(abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2)
+
+
+def from_detections(detections, size):
+    """Instance tuples (idx, cls, conf, x1, y1, x2, y2, area, polygon) from
+    `inference.extract_detections` output measured on an image of `size` (w, h)."""
+    if not detections:
+        return []
+    scale = np.array([size[0], size[1]], dtype=np.float64)
+    boxes = np.array([d['xyxy'] for d in detections], dtype=np.float64).reshape(-1, 2, 2) / scale
+    boxes = boxes.clip(0, 1).reshape(-1, 4)
+    box_areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    instances = []
+    for i, (detection, box, box_area) in enumerate(zip(detections, boxes.tolist(), box_areas.tolist())):
+        polygon = None
+        area = box_area
+        if detection.get('polygon'):
+            points = np.asarray(detection['polygon'], dtype=np.float64) / scale
+            polygon = encode_polygon(points)
+            area = polygon_area(points)
+        if 'area' in detection:
+            # Mask pixel count (see postprocess.from_result): more exact than the outline
+            area = min(detection['area'] / (size[0] * size[1]), 1.0)
+        instances.append((i, int(detection['cls']), float(detection['conf']), *box, area, polygon))
+    return instances
+
+
+# ===========================
+# Storage
+# ===========================
+def save_instances(conn, detection_id, instances):
+    conn.executemany(INSERT_INSTANCE, [(detection_id, *instance) for instance in instances])
+
+
+def as_dicts(instances):
+    """Instance tuples (as stored) to {'cls', 'conf', 'xyxy', 'area', 'polygon'} dicts."""
+    return [{
+        'cls': instance[1],
+        'conf': instance[2],
+        'xyxy': list(instance[3:7]),
+        'area': instance[7],
+        'polygon': decode_polygon(instance[8]).tolist(),
+    } for instance in instances]
+
+
+def load_instances(conn, detection_id):
+    rows = conn.execute('''
+        SELECT idx, cls, conf, x1, y1, x2, y2, area, polygon FROM detection_instances
+        WHERE detection_id = ? ORDER BY idx
+    ''', (detection_id,)).fetchall()
+    return as_dicts(rows)
+
+
+def load_arrays(conn, detection_ids=None):
+    """Column arrays (detection_id, conf, area, cls) for every stored instance."""
+    sql = "SELECT detection_id, conf, area, cls FROM detection_instances"
+    params = []
+    if detection_ids is not None:
+        sql += f" WHERE detection_id IN ({', '.join('?' * len(detection_ids))})"
+        params = list(detection_ids)
+    rows = conn.execute(sql, params).fetchall()
+    data = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    return data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3].astype(np.int64)
+
+
+# ===========================
+# Severity
+# ===========================
+def severity_from_arrays(detection_ids, levels, ids):
+    """Vectorised (high, med, low) counts per id in `ids` from flat instance arrays.
+
+    `levels` is each instance's level index (see postprocess.SeverityRules.classify).
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    counts = np.zeros((len(ids), 3), dtype=np.int64)
+    if len(levels) == 0 or len(ids) == 0:
+        return counts
+    order = np.argsort(ids)
+    position = np.searchsorted(ids[order], detection_ids)
+    position = position.clip(0, len(ids) - 1)
+    known = ids[order][position] == detection_ids
+    np.add.at(counts, (order[position[known]], np.asarray(levels)[known]), 1)
+    return counts
+
+
+def recompute_severity(conn, rules=None):
+    """Severity counts under new rules (postprocess.SeverityRules) for every detection with stored instances.
+
+    Returns (ids, counts, current) where counts/current are (N, 3) arrays.
+    """
+    rows = conn.execute('''
+        SELECT id, high_severity, medium_severity, low_severity FROM detections
+        WHERE instance_count IS NOT NULL ORDER BY id
+    ''').fetchall()
+    table = np.array(rows, dtype=np.int64).reshape(-1, 4)
+    ids, current = table[:, 0], table[:, 1:]
+    detection_ids, conf, area, _ = load_arrays(conn)
+    levels = (rules or postprocess.RULES).classify(conf, area)
+    return ids, severity_from_arrays(detection_ids, levels, ids), current
+
+
+def apply_severity(conn, ids, counts, summary):
+    """Write new counts (and the summary text built by `summary(high, med, low)`) back."""
+    conn.executemany(
+        "UPDATE detections SET high_severity = ?, medium_severity = ?, low_severity = ?, result_text = ? WHERE id = ?",
+        [(h, m, l, summary(h, m, l), i) for i, (h, m, l) in zip(ids.tolist(), counts.tolist())]
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recompute severity from stored instances with new rules")
+    parser.add_argument('--rules', help="severity rules as JSON (default: SEVERITY_RULES, see postprocess.py)")
+    parser.add_argument('--high', type=float, help="confidence-only rules: confidence above which a spot is high")
+    parser.add_argument('--med', type=float, help="confidence-only rules: confidence above which a spot is medium")
+    parser.add_argument('--apply', action='store_true', help="write the new counts (default: report only)")
+    args = parser.parse_args()
+
+    import json
+    import database
+    from inference import summary_text
+
+    rules = postprocess.RULES
+    if args.rules:
+        rules = postprocess.SeverityRules(json.loads(args.rules))
+    elif args.high is not None or args.med is not None:
+        high = args.high if args.high is not None else postprocess.DEFAULT_RULES['high'][0]['conf']
+        med = args.med if args.med is not None else postprocess.DEFAULT_RULES['med'][0]['conf']
+        rules = postprocess.SeverityRules({'high': [{'conf': high}], 'med': [{'conf': med}]})
+
+    database.init_db()
+    with database.transaction() as conn:
+        ids, counts, current = recompute_severity(conn, rules)
+        changed = (counts != current).any(axis=1)
+        print(f"📊 {len(ids)} detection(s) with stored instances, {int(changed.sum())} would change")
+        print(f"   totals now High={current[:, 0].sum()} Medium={current[:, 1].sum()} Low={current[:, 2].sum()}")
+        print(f"   totals new High={counts[:, 0].sum()} Medium={counts[:, 1].sum()} Low={counts[:, 2].sum()}")
+        if args.apply and changed.any():
+            apply_severity(conn, ids[changed], counts[changed], summary_text)
+            print("✅ Severity updated")
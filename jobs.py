@@ -0,0 +1,95 @@
+# jobs.py - In-process background job queue for asynchronous uploads
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+FINISHED = ('done', 'failed')
+
+
+class JobQueue:
+    """Runs callables on a local worker pool and tracks their progress by job ID.
+
+    Jobs live in memory only; finished jobs are pruned after `ttl` seconds so the
+    table cannot grow without bound. Nothing outside the process is required.
+    """
+
+    def __init__(self, workers=2, ttl=3600):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._changed = threading.Condition()
+        self.ttl = ttl
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn(*args, progress=callback, **kwargs) and return the new job ID."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._changed:
+            self._prune(now)
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'stage': 'queued',
+                'progress': 0,
+                'result': None,
+                'error': None,
+                'created': now,
+                'updated': now,
+                'version': 0,
+            }
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, version, timeout=15):
+        """Block until the job changes past `version` (or timeout); return its snapshot."""
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job['version'] > version or job['status'] in FINISHED:
+                    return dict(job) if job else None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return dict(job)
+                self._changed.wait(remaining)
+
+    def _update(self, job_id, **fields):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job['updated'] = time.time()
+            job['version'] += 1
+            self._changed.notify_all()
+
+    def _run(self, job_id, fn, args, kwargs):
+        def progress(stage, percent):
+            self._update(job_id, stage=stage, progress=percent)
+
+        self._update(job_id, status='running', stage='starting')
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+            self._update(job_id, status='done', stage='done', progress=100, result=result)
+        except Exception as e:
+            print("❌ Job failed:", job_id, str(e))
+            self._update(job_id, status='failed', stage='failed', error=str(e))
+
+    def _prune(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] in FINISHED and now - job['updated'] > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def queue_from_env():
+    return JobQueue(
+        workers=int(os.environ.get('JOB_WORKERS', 2)),
+        ttl=int(os.environ.get('JOB_TTL_SECONDS', 3600)),
+    )
@@ -0,0 +1,141 @@
+# model_loader.py - Background model loading, warm-up and readiness for the web process
+import os
+import threading
+import time
+
+import numpy as np
+
+import backends
+import preprocess
+
+
+class ModelLoader:
+    """Loads the YOLO weights off the import path and attaches them to the scheduler.
+
+    Ultralytics (and with it torch and cv2) is only imported on the loader
+    thread, so the HTTP server can bind while the weights load. A few warm-up
+    passes on blank letterboxed frames run before the model is attached; until
+    then submitted images wait in the scheduler queue.
+
+    `backend` is (name, threads, precision) as returned by
+    `backends.settings_from_env`; a missing export falls back to PyTorch.
+    """
+
+    def __init__(self, path, scheduler, warmup_runs=1, warmup_kwargs=None, started=None,
+                 backend=('pytorch', 0, 'fp32')):
+        self.path = path
+        self.backend = backend
+        self.active_backend = None
+        self.artifact = None
+        self.scheduler = scheduler
+        self.warmup_runs = warmup_runs
+        self.warmup_kwargs = warmup_kwargs or {}
+        self.model = None
+        self.state = 'idle'
+        self.error = None
+        self.metrics = {}
+        self._started = started or time.perf_counter()
+        self._done = threading.Event()
+
+    @property
+    def available(self):
+        """False only once loading has failed; loading models still accept (queued) work."""
+        return self.state != 'failed'
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    @property
+    def active_precision(self):
+        """Precision of the loaded model: the requested one unless loading fell back to PyTorch."""
+        name, _, precision = self.backend
+        return precision if self.active_backend == name else 'fp32'
+
+    def start(self, background=True):
+        self.state = 'loading'
+        if background:
+            threading.Thread(target=self._load, name='model-loader', daemon=True).start()
+        else:
+            self._load()
+        return self
+
+    def wait(self, timeout=None):
+        """Block until loading finished; True if the model is ready."""
+        self._done.wait(timeout)
+        return self.ready
+
+    def _timed(self, key, started):
+        self.metrics[key] = round(time.perf_counter() - started, 3)
+
+    def _load(self):
+        try:
+            started = time.perf_counter()
+            import ultralytics  # noqa: F401 - timed apart from the weights
+            self._timed('ultralytics_import_seconds', started)
+
+            started = time.perf_counter()
+            model = self._load_backend()
+            self._timed('weights_load_seconds', started)
+
+            started = time.perf_counter()
+            self._warm_up(model)
+            self._timed('warmup_seconds', started)
+
+            self.model = model
+            self.scheduler.attach(model)
+            self.state = 'ready'
+            self._timed('time_to_ready_seconds', self._started)
+            print(f"✅ Model ready in {self.metrics['time_to_ready_seconds']}s "
+                  f"(warm-up {self.metrics['warmup_seconds']}s)")
+        except Exception as e:
+            print("❌ Model not loaded:", str(e))
+            self.error = str(e)
+            self.state = 'failed'
+            self.scheduler.fail(e)
+        finally:
+            self._done.set()
+
+    def _load_backend(self):
+        name, threads, precision = self.backend
+        try:
+            model, self.artifact = backends.load(self.path, name, threads, precision)
+            self.active_backend = name
+        except FileNotFoundError as e:
+            if name == 'pytorch':
+                raise
+            print(f"⚠️ {e}; falling back to PyTorch")
+            model, self.artifact = backends.load(self.path, 'pytorch', threads)
+            self.active_backend = 'pytorch'
+        return model
+
+    def _warm_up(self, model):
+        """Full-size batches of blank frames, so the first real request skips graph/allocator setup."""
+        if self.warmup_runs <= 0:
+            return
+        frame = np.full((preprocess.MODEL_SIZE, preprocess.MODEL_SIZE, 3), preprocess.PAD_COLOR[0], dtype=np.uint8)
+        batch = [frame] * self.scheduler.max_batch_size
+        passes = []
+        for _ in range(self.warmup_runs):
+            started = time.perf_counter()
+            model(batch, verbose=False, **self.warmup_kwargs)
+            passes.append(round((time.perf_counter() - started) * 1000, 1))
+        self.metrics['warmup_pass_ms'] = passes
+
+    def status(self):
+        name, threads, _ = self.backend
+        return {'state': self.state, 'ready': self.ready, 'error': self.error, 'weights': self.artifact or self.path,
+                'backend': {'requested': name, 'active': self.active_backend, 'threads': threads,
+                            'precision': self.active_precision},
+                'startup': dict(self.metrics)}
+
+
+def loader_from_env(path, scheduler, warmup_kwargs=None, started=None):
+    """MODEL_LOADING=background binds first and loads on a thread; eager (default) loads before returning.
+
+    MODEL_WARMUP sets the number of warm-up batches (0 disables); INFER_BACKEND,
+    INFER_THREADS and INFER_PRECISION pick the runtime (see backends.py).
+    """
+    loader = ModelLoader(path, scheduler, int(os.environ.get('MODEL_WARMUP', 1)), warmup_kwargs, started,
+                         backends.settings_from_env())
+    return loader.start(background=os.environ.get('MODEL_LOADING', 'eager').lower() == 'background')
@@ -0,0 +1,478 @@
+# model_workers.py - Model inference in N worker processes fed through shared memory
+import argparse
+import itertools
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import connection, resource_tracker, shared_memory
+
+import numpy as np
+
+import backends
+from inference import _percentile
+
+# A request whose worker died is re-sent once to its replacement before failing
+MAX_ATTEMPTS = 2
+# A worker that dies before reporting ready is respawned after 0.5 s, 1 s, 2 s, ... (capped), then given up on
+MAX_START_FAILURES = 5
+RESTART_BACKOFF = 0.5
+MAX_RESTART_BACKOFF = 30.0
+
+
+class WorkerResult:
+    """What a worker sends back instead of an Ultralytics Results object (see inference.extract_detections)."""
+
+    __slots__ = ('detections',)
+
+    def __init__(self, detections):
+        self.detections = detections
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ===========================
+# Web process side
+# ===========================
+class _Worker:
+    def __init__(self, index, slots, slot_bytes):
+        self.index = index
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.slots = slots
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.state = 'starting'
+        self.free = list(range(slots))
+        self.inflight = {}
+        self.served = 0
+        self.restarts = 0
+        self.start_failures = 0
+        self.respawn_at = None
+        self.rss_mb = 0.0
+        self.pid = None
+
+
+class WorkerPool:
+    """Spreads inference over `workers` model processes; a drop-in for InferenceScheduler + ModelLoader.
+
+    Each request's decoded image is copied once into a shared-memory slot owned
+    by the chosen worker and only (slot, shape, kwargs) crosses the pipe; the
+    worker maps the slot as a NumPy array, runs it through its own micro-batching
+    scheduler and sends back plain detections. Requests go to the ready worker
+    with the fewest in flight. A worker that exits is restarted and its
+    requests re-sent; one whose RSS passes `max_rss_mb` (or that has served
+    `max_requests`) is drained and replaced. One that keeps dying before it
+    is ready is respawned with backoff and marked failed after
+    MAX_START_FAILURES; `submit` gives up after `submit_timeout` seconds
+    without a free worker.
+    """
+
+    def __init__(self, weights, workers=2, slots=8, slot_bytes=8 * 1024 * 1024, max_rss_mb=0, max_requests=0,
+                 warmup_kwargs=None, started=None, env=None, submit_timeout=60.0):
+        self.weights = weights
+        self.submit_timeout = submit_timeout
+        self.backend = backends.settings_from_env()
+        self.slot_bytes = slot_bytes
+        self.max_rss_mb = max_rss_mb
+        self.max_requests = max_requests
+        self.warmup_kwargs = warmup_kwargs or {}
+        self.max_batch_size = int(os.environ.get('INFER_MAX_BATCH', 4)) * workers
+        self.model = None
+        self.error = None
+        # What the workers actually loaded (reported in their hello; a missing export falls back to PyTorch)
+        self.active_backend = None
+        self.active_precision = None
+        self.artifact = None
+        self.metrics = {}
+        self._env = env
+        self._closed = False
+        self._started = started or time.perf_counter()
+        self._authkey = secrets.token_bytes(16)
+        self._listener = connection.Listener(family='AF_UNIX' if hasattr(os, 'fork') else 'AF_INET',
+                                             authkey=self._authkey)
+        self._changed = threading.Condition()
+        self._ids = itertools.count()
+        self._latency = deque(maxlen=1000)
+        self.counters = {'images': 0, 'errors': 0, 'restarts': 0, 'recycled': 0, 'pickled': 0}
+        self._workers = [_Worker(i, slots, slot_bytes) for i in range(workers)]
+        threading.Thread(target=self._accept, name='model-workers-accept', daemon=True).start()
+        for worker in self._workers:
+            self._spawn(worker)
+        threading.Thread(target=self._collect, name='model-workers-collect', daemon=True).start()
+
+    # ===========================
+    # Loader interface (/readyz, /inference_stats)
+    # ===========================
+    @property
+    def state(self):
+        states = {worker.state for worker in self._workers}
+        if 'ready' in states:
+            return 'ready'
+        return 'failed' if states == {'failed'} else 'loading'
+
+    @property
+    def available(self):
+        return self.state != 'failed'
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def wait(self, timeout=None):
+        with self._changed:
+            self._changed.wait_for(lambda: self.state != 'loading', timeout)
+        return self.ready
+
+    def status(self):
+        name, threads, precision = self.backend
+        return {'state': self.state, 'ready': self.ready, 'error': self.error, 'weights': self.weights,
+                'backend': {'requested': name, 'active': self.active_backend, 'threads': threads,
+                            'precision': self.active_precision or precision},
+                'startup': dict(self.metrics), 'workers': self.worker_stats()}
+
+    def worker_stats(self):
+        with self._changed:
+            return [{'index': w.index, 'pid': w.pid, 'state': w.state, 'inflight': len(w.inflight),
+                     'served': w.served, 'rss_mb': round(w.rss_mb, 1), 'restarts': w.restarts}
+                    for w in self._workers]
+
+    # ===========================
+    # Scheduler interface
+    # ===========================
+    def submit(self, image, **kwargs):
+        """Hand one image (BGR array or PIL image) to the least busy worker; the Future resolves to a WorkerResult."""
+        if not isinstance(image, np.ndarray):
+            image = np.asarray(image.convert('RGB'))[..., ::-1]
+        # Larger than a slot (e.g. a huge tile size): fall back to pickling this one image
+        array = np.ascontiguousarray(image) if image.nbytes > self.slot_bytes else None
+        future = Future()
+        request_id = next(self._ids)
+        with self._changed:
+            if self.state == 'failed':
+                future.set_exception(RuntimeError(f"Model not available: {self.error}"))
+                return future
+            # Requests wait here while every slot is busy or no worker is ready yet
+            self._changed.wait_for(lambda: self._pick() is not None or self.state == 'failed', self.submit_timeout)
+            worker = self._pick()
+            if worker is None:
+                error = self.error if self.state == 'failed' else f"no worker free after {self.submit_timeout}s"
+                future.set_exception(RuntimeError(f"Model not available: {error}"))
+                return future
+            slot = worker.free.pop() if array is None else None
+            entry = {'future': future, 'slot': slot, 'shape': image.shape, 'kwargs': kwargs, 'attempts': 1,
+                     'submitted': time.perf_counter(), 'array': array}
+            worker.inflight[request_id] = entry
+        if slot is None:
+            self._count(pickled=1)
+        else:
+            np.ndarray(image.shape, np.uint8, worker.shm.buf, slot * self.slot_bytes)[...] = image
+        self._send(worker, request_id, entry)
+        return future
+
+    def predict(self, image, timeout=None, **kwargs):
+        return self.submit(image, **kwargs).result(timeout)
+
+    def stats(self):
+        latency = sorted(self._latency)
+        stats = dict(self.counters)
+        stats.update({
+            'mode': 'processes',
+            'max_batch_size': self.max_batch_size,
+            'queue_depth': sum(len(w.inflight) for w in self._workers),
+            'latency': {'total': {'count': len(latency),
+                                  **{f'p{p}_ms': round(_percentile(latency, p) * 1000, 2) for p in (50, 95, 99)}}},
+            'workers': self.worker_stats(),
+        })
+        return stats
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            workers = list(self._workers)
+            for worker in workers:
+                worker.state = 'failed'
+        for worker in workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.terminate()
+                worker.process.wait(10)
+            worker.shm.close()
+            worker.shm.unlink()
+        self._listener.close()
+
+    # ===========================
+    # Internals
+    # ===========================
+    def _count(self, **amounts):
+        with self._changed:
+            for key, amount in amounts.items():
+                self.counters[key] += amount
+
+    def _pick(self):
+        ready = [w for w in self._workers if w.state == 'ready' and w.free]
+        return min(ready, key=lambda w: len(w.inflight)) if ready else None
+
+    def _send(self, worker, request_id, entry):
+        message = ('predict', request_id, entry['slot'], entry['shape'], entry['kwargs'], entry['array'])
+        try:
+            with worker.send_lock:
+                worker.conn.send(message)
+        except (OSError, AttributeError):
+            pass  # the worker is gone; _collect restarts it and re-sends
+
+    def _spawn(self, worker):
+        env = dict(self._env or os.environ, MODEL_WORKER_AUTHKEY=self._authkey.hex())
+        package = os.path.dirname(os.path.abspath(__file__))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [package, env.get('PYTHONPATH')]))
+        command = [sys.executable, '-m', 'model_workers', '--worker', str(worker.index),
+                   '--address', str(self._listener.address), '--shm', worker.shm.name,
+                   '--slots', str(worker.slots), '--slot-bytes', str(self.slot_bytes), '--weights', self.weights,
+                   '--warmup-kwargs', json.dumps(self.warmup_kwargs)]
+        if worker.conn is not None:
+            worker.conn.close()
+        worker.state = 'starting'
+        worker.conn = None
+        worker.served = 0
+        worker.process = subprocess.Popen(command, env=env)
+        worker.pid = worker.process.pid
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+                _, index, warmup = conn.recv()
+            except (OSError, EOFError):
+                if self._closed:
+                    return
+                continue
+            failed = []
+            with self._changed:
+                worker = self._workers[index]
+                worker.conn = conn
+                if warmup.get('error'):
+                    worker.state = 'failed'
+                    self.error = warmup['error']
+                    print(f"❌ Model worker {index} failed to load: {self.error}")
+                    failed = list(worker.inflight.values())
+                    worker.inflight.clear()
+                else:
+                    worker.state = 'ready'
+                    worker.start_failures = 0
+                    self.active_backend = warmup.pop('backend', None)
+                    self.active_precision = warmup.pop('precision', None)
+                    self.artifact = warmup.pop('artifact', None)
+                    self.metrics.setdefault('time_to_ready_seconds',
+                                            round(time.perf_counter() - self._started, 3))
+                    self.metrics[f'worker_{index}'] = warmup
+                    pending = list(worker.inflight.items())
+                self._changed.notify_all()
+            for entry in failed:
+                entry['future'].set_exception(RuntimeError(f"Model not available: {self.error}"))
+            if not warmup.get('error'):
+                print(f"✅ Model worker {index} ready (pid {worker.pid})")
+                for request_id, entry in pending:
+                    self._send(worker, request_id, entry)
+
+    def _collect(self):
+        while not self._closed:
+            with self._changed:
+                conns = {w.conn: w for w in self._workers if w.conn is not None}
+            if not conns:
+                time.sleep(0.2)
+            for conn in connection.wait(list(conns), timeout=0.5) if conns else []:
+                worker = conns[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    with self._changed:
+                        if worker.conn is conn:
+                            worker.conn = None
+                    conn.close()
+                    continue
+                self._finish(worker, *message)
+            for worker in self._workers:
+                if worker.state in ('failed', 'recycling'):
+                    continue
+                if worker.respawn_at is not None:
+                    if time.monotonic() >= worker.respawn_at:
+                        with self._changed:
+                            worker.respawn_at = None
+                            self._spawn(worker)
+                elif worker.process and worker.process.poll() is not None:
+                    self._restart(worker, f"exited with {worker.process.returncode}")
+
+    def _finish(self, worker, request_id, detections, error, rss):
+        with self._changed:
+            entry = worker.inflight.pop(request_id, None)
+            if entry and entry['slot'] is not None:
+                worker.free.append(entry['slot'])
+            worker.served += 1
+            worker.rss_mb = rss
+            self._changed.notify_all()
+        if entry is None:
+            return
+        finished = time.perf_counter()
+        if error:
+            self._count(errors=1)
+            entry['future'].set_exception(RuntimeError(error))
+        else:
+            self._count(images=1)
+            self._latency.append(finished - entry['submitted'])
+            entry['future'].set_result(WorkerResult(detections))
+        leaked = self.max_rss_mb and rss > self.max_rss_mb
+        if worker.state == 'ready' and (leaked or (self.max_requests and worker.served >= self.max_requests)):
+            print(f"♻️ Recycling model worker {worker.index} (rss {rss:.0f} MB, {worker.served} served)")
+            with self._changed:
+                worker.state = 'draining'
+        with self._changed:
+            recycle = worker.state == 'draining' and not worker.inflight
+            if recycle:
+                worker.state = 'recycling'
+        if recycle:
+            # Waiting for the old process here would hold up every other worker's replies
+            self._count(recycled=1)
+            threading.Thread(target=self._recycle, args=(worker,), name=f'model-worker-{worker.index}-recycle',
+                             daemon=True).start()
+
+    def _recycle(self, worker):
+        try:
+            with worker.send_lock:
+                worker.conn.send(('stop',))
+        except (OSError, AttributeError):
+            pass
+        try:
+            worker.process.wait(30)
+        except subprocess.TimeoutExpired:
+            worker.process.kill()
+            worker.process.wait()
+        with self._changed:
+            if not self._closed:
+                self._spawn(worker)
+
+    def _restart(self, worker, reason):
+        with self._changed:
+            failed = []
+            if worker.state == 'starting':
+                worker.start_failures += 1
+            if worker.start_failures >= MAX_START_FAILURES:
+                # Never got as far as loading the model: stop respawning and fail its requests
+                worker.state = 'failed'
+                self.error = f"worker {worker.index} {reason} {worker.start_failures} times before becoming ready"
+                failed = list(worker.inflight.values())
+                worker.inflight.clear()
+                worker.free = list(range(worker.slots))
+            else:
+                for request_id, entry in list(worker.inflight.items()):
+                    entry['attempts'] += 1
+                    if entry['attempts'] > MAX_ATTEMPTS:
+                        failed.append(worker.inflight.pop(request_id))
+                        if entry['slot'] is not None:
+                            worker.free.append(entry['slot'])
+                worker.restarts += 1
+                self.counters['restarts'] += 1
+                if worker.start_failures:
+                    delay = min(MAX_RESTART_BACKOFF, RESTART_BACKOFF * 2 ** (worker.start_failures - 1))
+                    worker.respawn_at = time.monotonic() + delay
+                else:
+                    self._spawn(worker)
+            self._changed.notify_all()
+        if worker.state == 'failed':
+            print(f"❌ Model {self.error}; giving up on it")
+        else:
+            print(f"❌ Model worker {worker.index} {reason}; restarting")
+        for entry in failed:
+            self._count(errors=1)
+            entry['future'].set_exception(RuntimeError(f"Model worker {reason}"))
+
+
+def pool_from_env(weights, warmup_kwargs=None, started=None):
+    """WorkerPool sized by MODEL_WORKERS, WORKER_SLOTS, WORKER_SLOT_MB, WORKER_MAX_RSS_MB, WORKER_MAX_REQUESTS;
+    WORKER_SUBMIT_TIMEOUT (seconds, default 60) bounds the wait for a free worker."""
+    return WorkerPool(
+        weights,
+        workers=int(os.environ['MODEL_WORKERS']),
+        slots=int(os.environ.get('WORKER_SLOTS', 2 * int(os.environ.get('INFER_MAX_BATCH', 4)))),
+        slot_bytes=int(float(os.environ.get('WORKER_SLOT_MB', 8)) * 1024 * 1024),
+        max_rss_mb=float(os.environ.get('WORKER_MAX_RSS_MB', 0)),
+        max_requests=int(os.environ.get('WORKER_MAX_REQUESTS', 0)),
+        warmup_kwargs=warmup_kwargs,
+        started=started,
+        submit_timeout=float(os.environ.get('WORKER_SUBMIT_TIMEOUT', 60)),
+    )
+
+
+# ===========================
+# Worker process side
+# ===========================
+def serve(index, address, shm_name, slots, slot_bytes, weights, authkey, warmup_kwargs=None):
+    """Load the model, report ready, then answer ('predict', ...) messages until ('stop',) or EOF."""
+    from inference import extract_detections, scheduler_from_env
+    from model_loader import ModelLoader
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # The web process owns the block; stop this process's tracker from unlinking it on exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    conn = connection.Client(address, authkey=authkey)
+
+    scheduler = scheduler_from_env()
+    loader = ModelLoader(weights, scheduler, int(os.environ.get('MODEL_WARMUP', 1)), warmup_kwargs,
+                         backend=backends.settings_from_env())
+    loader.start(background=False)
+    conn.send(('hello', index, dict(loader.metrics, pid=os.getpid(), error=loader.error, backend=loader.active_backend,
+                                    precision=loader.active_precision, artifact=loader.artifact)))
+    if not loader.ready:
+        return 1
+
+    send_lock = threading.Lock()
+
+    def reply(request_id, future):
+        try:
+            detections, error = extract_detections(future.result()), None
+        except Exception as e:
+            detections, error = None, str(e)
+        with send_lock:
+            conn.send((request_id, detections, error, rss_mb()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return 0
+        if message[0] == 'stop':
+            return 0
+        _, request_id, slot, shape, kwargs, array = message
+        if array is None:
+            array = np.ndarray(shape, np.uint8, shm.buf, slot * slot_bytes)
+        future = scheduler.submit(array, **kwargs)
+        future.add_done_callback(lambda done, request_id=request_id: reply(request_id, done))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model worker process (started by WorkerPool)")
+    parser.add_argument('--worker', type=int, required=True)
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--shm', required=True)
+    parser.add_argument('--slots', type=int, required=True)
+    parser.add_argument('--slot-bytes', type=int, required=True)
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--warmup-kwargs', type=json.loads, default={})
+    args = parser.parse_args()
+    authkey = bytes.fromhex(os.environ.pop('MODEL_WORKER_AUTHKEY'))
+    return serve(args.worker, args.address, args.shm, args.slots, args.slot_bytes, args.weights, authkey,
+                 args.warmup_kwargs)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+# postprocess.py - Array-level post-processing of YOLO results: detections, mask areas and severity
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+LEVELS = ('high', 'med', 'low')
+
+# Confidence-only defaults, matching the thresholds reports were scored with so far
+DEFAULT_RULES = {'high': [{'conf': 0.7}], 'med': [{'conf': 0.5}]}
+
+# Column arrays for one image. `area` is each instance's mask pixel count in the same pixels as
+# `xyxy` (None when masks were not counted); `image_area` is the pixel count of that image.
+Detections = namedtuple('Detections', 'xyxy conf cls area polygons image_area')
+
+
+def _numpy(values):
+    """Tensor (any device) or array-like to a NumPy array, with one device sync."""
+    if hasattr(values, 'cpu'):
+        values = values.cpu()
+    if hasattr(values, 'numpy'):
+        return values.numpy()
+    return np.asarray(values)
+
+
+def box_areas(xyxy):
+    """Area of each (N, 4) xyxy box, in the boxes' own units (pixels, or image fractions for 0..1 boxes)."""
+    return (xyxy[:, 2] - xyxy[:, 0]).clip(0) * (xyxy[:, 3] - xyxy[:, 1]).clip(0)
+
+
+def box_iou(a, b):
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def _outline_areas(found):
+    """Polygon (shoelace) area per instance where an outline exists, box area otherwise."""
+    areas = box_areas(found.xyxy)
+    for i, points in enumerate(found.polygons[:len(areas)]):
+        points = np.asarray(points if points is not None else [], dtype=np.float64).reshape(-1, 2)
+        if len(points) >= 3:
+            x, y = points[:, 0], points[:, 1]
+            areas[i] = abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+    return areas
+
+
+def from_result(result, mask_area=None):
+    """Detections from one Ultralytics Results object (or a model_workers.WorkerResult).
+
+    Counting mask pixels reads every mask pixel (N x H x W), so by default it
+    only happens when the severity rules use area; stored instances otherwise
+    keep the polygon area (see instances.from_detections).
+    """
+    if hasattr(result, 'detections'):
+        return from_dicts(result.detections)
+    if mask_area is None:
+        mask_area = RULES.uses_area
+    height, width = result.orig_shape[:2]
+    boxes = result.boxes
+    if not boxes:
+        empty = np.zeros(0, dtype=np.float64)
+        return Detections(np.zeros((0, 4)), empty, empty.astype(np.int64), None, [], float(width * height))
+
+    # [x1, y1, x2, y2, conf, cls] per row, copied off the device once
+    data = _numpy(boxes.data).astype(np.float64, copy=False)
+    xyxy, conf, cls = data[:, :4], data[:, 4], data[:, 5].astype(np.int64)
+    masks = getattr(result, 'masks', None)
+    area = None
+    if masks is not None and mask_area:
+        # Summed where the masks live; only N numbers cross to the host
+        mask_data = masks.data
+        area = _numpy(mask_data.reshape(len(mask_data), -1).sum(1)).astype(np.float64)
+        # retina_masks=False gives masks at model-output size: rescale to image pixels
+        mask_height, mask_width = mask_data.shape[1:]
+        area *= (width * height) / float(mask_width * mask_height)
+    polygons = masks.xy if masks is not None else []
+    return Detections(xyxy, conf, cls, area, polygons, float(width * height))
+
+
+def from_dicts(detections, image_area=None):
+    """Detections from `to_dicts` output (cached, tiled or worker results)."""
+    count = len(detections)
+    xyxy = np.array([d['xyxy'] for d in detections], dtype=np.float64).reshape(count, 4)
+    conf = np.array([d['conf'] for d in detections], dtype=np.float64)
+    cls = np.array([d['cls'] for d in detections], dtype=np.int64)
+    area = None
+    if any('area' in d for d in detections):
+        area = np.array([d.get('area', np.nan) for d in detections], dtype=np.float64)
+        missing = np.isnan(area)
+        area[missing] = box_areas(xyxy)[missing]
+    return Detections(xyxy, conf, cls, area, [d.get('polygon') for d in detections], image_area)
+
+
+def to_dicts(found):
+    """Plain-Python detections (JSON, cache and pickle friendly); polygons when the model has masks."""
+    detections = []
+    polygons = found.polygons
+    for i, (xyxy, conf, cls) in enumerate(zip(found.xyxy.round(1).tolist(), found.conf.round(4).tolist(),
+                                              found.cls.tolist())):
+        detection = {'xyxy': xyxy, 'conf': conf, 'cls': cls}
+        if found.area is not None:
+            detection['area'] = round(float(found.area[i]), 1)
+        if i < len(polygons) and polygons[i] is not None:
+            detection['polygon'] = np.asarray(polygons[i], dtype=np.float64).round(1).tolist()
+        detections.append(detection)
+    return detections
+
+
+def area_fractions(found, image_area=None):
+    """Per-instance share of the image covered, 0..1; outline areas when masks were not counted.
+
+    Zeros when the image size is unknown.
+    """
+    image_area = image_area or found.image_area
+    if not image_area:
+        return np.zeros(len(found.conf))
+    area = found.area if found.area is not None else _outline_areas(found)
+    return (area / image_area).clip(0, 1)
+
+
+def coverage(found, image_area=None):
+    """Total share of the image flagged as corroded (instance areas summed, capped at 1)."""
+    return round(float(min(area_fractions(found, image_area).sum(), 1.0)), 4)
+
+
+# ===========================
+# Severity
+# ===========================
+class SeverityRules:
+    """Severity levels from confidence and corroded-area fraction.
+
+    `rules` maps 'high' / 'med' to a list of clauses; an instance matches a
+    clause when conf > clause['conf'] and area >= clause['area'] (both
+    default 0), and a level when any clause matches. High wins over medium;
+    everything else is low. Example: a spot over 5% of the image counts as
+    high even at moderate confidence:
+
+        {"high": [{"conf": 0.7}, {"conf": 0.4, "area": 0.05}], "med": [{"conf": 0.5}]}
+    """
+
+    def __init__(self, rules=None):
+        rules = DEFAULT_RULES if rules is None else rules
+        unknown = set(rules) - set(LEVELS[:2])
+        if unknown:
+            raise ValueError(f"Severity rules only define {LEVELS[:2]}, got {sorted(unknown)}")
+        self.rules = {}
+        for level in LEVELS[:2]:
+            clauses = []
+            for clause in rules.get(level, []):
+                if set(clause) - {'conf', 'area'}:
+                    raise ValueError(f"Severity clause keys are 'conf' and 'area', got {sorted(clause)}")
+                clauses.append((float(clause.get('conf', 0.0)), float(clause.get('area', 0.0))))
+            self.rules[level] = clauses
+
+    def classify(self, conf, area):
+        """Level index per instance: 0 high, 1 medium, 2 low."""
+        conf, area = np.asarray(conf, dtype=np.float64), np.asarray(area, dtype=np.float64)
+        levels = np.full(len(conf), 2, dtype=np.int64)
+        for index in (1, 0):  # medium first, so high overrides it
+            matched = np.zeros(len(conf), dtype=bool)
+            for min_conf, min_area in self.rules[LEVELS[index]]:
+                matched |= (conf > min_conf) & (area >= min_area)
+            levels[matched] = index
+        return levels
+
+    @property
+    def uses_area(self):
+        return any(min_area > 0 for clauses in self.rules.values() for _, min_area in clauses)
+
+    def counts(self, conf, area):
+        high, med, low = np.bincount(self.classify(conf, area), minlength=3).tolist()
+        return high, med, low
+
+    def as_dict(self):
+        return {level: [{'conf': c, 'area': a} for c, a in clauses] for level, clauses in self.rules.items()}
+
+
+def rules_from_env():
+    """SEVERITY_RULES: JSON rules (see SeverityRules) or the path of a .json file holding them."""
+    value = os.environ.get('SEVERITY_RULES', '').strip()
+    if not value:
+        return SeverityRules()
+    if not value.startswith('{'):
+        with open(value) as f:
+            value = f.read()
+    try:
+        return SeverityRules(json.loads(value))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"SEVERITY_RULES is not valid JSON: {e}")
+
+
+RULES = rules_from_env()
+
+
+def severity_levels(found, image_area=None, rules=None):
+    """Level name ('high', 'med', 'low') per instance, in detection order."""
+    return [LEVELS[level] for level in (rules or RULES).classify(found.conf, area_fractions(found, image_area))]
+
+
+def severity_counts(found, image_area=None, rules=None):
+    """(high, medium, low) counts for one image's detections."""
+    return (rules or RULES).counts(found.conf, area_fractions(found, image_area))
@@ -0,0 +1,75 @@
+# preprocess.py - Shared decode + letterbox for every inference entry point
+from collections import namedtuple
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+MODEL_SIZE = 640
+# Ultralytics pads with the same grey, so a pre-letterboxed frame passes through its own LetterBox untouched
+PAD_COLOR = (114, 114, 114)
+
+# array: BGR (H, W, 3) uint8 model input; size: original (w, h); scale/pad: original -> model pixels
+Frame = namedtuple('Frame', 'array size scale pad')
+
+
+def open_image(source):
+    """Lazily open a path, bytes or (possibly unseekable) stream; nothing is decoded yet."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    return Image.open(source)
+
+
+def letterbox(image, size=MODEL_SIZE):
+    """Decode an opened image straight to a `size` x `size` aspect-preserving model input.
+
+    JPEGs much larger than the target are decoded at 1/2, 1/4 or 1/8 scale by
+    libjpeg (draft mode), so a 12 MP photo never exists at full resolution.
+    The returned array is a BGR view over the padded canvas (the channel
+    order Ultralytics expects for NumPy input), not a copy.
+    """
+    original = image.size
+    scale = min(size / original[0], size / original[1])
+    fitted = (max(1, round(original[0] * scale)), max(1, round(original[1] * scale)))
+    image.draft('RGB', fitted)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if image.size != fitted:
+        image = image.resize(fitted, Image.BILINEAR)
+
+    pad = ((size - fitted[0]) // 2, (size - fitted[1]) // 2)
+    canvas = Image.new('RGB', (size, size), PAD_COLOR)
+    canvas.paste(image, pad)
+    return Frame(np.asarray(canvas)[..., ::-1], original, scale, pad)
+
+
+def load(source, size=MODEL_SIZE):
+    """`letterbox` for a path, bytes or stream."""
+    with open_image(source) as image:
+        return letterbox(image, size)
+
+
+def content_area(frame):
+    """Pixels of the model input covered by the image itself (padding excluded)."""
+    return frame.size[0] * frame.size[1] * frame.scale ** 2
+
+
+def to_original(detections, frame):
+    """Map `inference.extract_detections` output from model-input pixels back onto the original image."""
+    width, height = frame.size
+    pad_x, pad_y = frame.pad
+
+    def point(x, y):
+        return [round(min(max((x - pad_x) / frame.scale, 0), width), 1),
+                round(min(max((y - pad_y) / frame.scale, 0), height), 1)]
+
+    mapped = []
+    for detection in detections:
+        x1, y1, x2, y2 = detection['xyxy']
+        item = dict(detection, xyxy=point(x1, y1) + point(x2, y2))
+        if 'polygon' in detection:
+            item['polygon'] = [point(x, y) for x, y in detection['polygon']]
+        if 'area' in detection:
+            item['area'] = round(detection['area'] / frame.scale ** 2, 1)
+        mapped.append(item)
+    return mapped
@@ -0,0 +1,158 @@
+# rendering.py - On-demand result images drawn from stored instances
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+import database
+import instances as instance_store
+import telemetry
+
+# lazy: nothing is written at inference time; eager: also write the annotated result JPEG
+EAGER_RESULTS = os.environ.get('RESULT_IMAGES', 'lazy').lower() == 'eager'
+
+FORMATS = {'jpeg': ('JPEG', 'image/jpeg'), 'webp': ('WEBP', 'image/webp')}
+MAX_WIDTH = 4096
+
+PALETTE = [(255, 56, 56), (255, 157, 151), (255, 112, 31), (255, 178, 29), (207, 210, 49),
+           (72, 249, 10), (146, 204, 23), (61, 219, 134), (26, 147, 52), (0, 212, 187)]
+
+
+def draw_instances(image, detections, names=None):
+    """Masks, boxes and labels for normalised instances, scaled to `image`."""
+    width, height = image.size
+    line = max(2, round(max(width, height) / 320))
+    overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    fill = ImageDraw.Draw(overlay)
+    for detection in detections:
+        color = PALETTE[detection['cls'] % len(PALETTE)]
+        if len(detection['polygon']) >= 3:
+            fill.polygon([(x * width, y * height) for x, y in detection['polygon']], fill=color + (100,))
+
+    image = Image.alpha_composite(image.convert('RGBA'), overlay).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for detection in detections:
+        color = PALETTE[detection['cls'] % len(PALETTE)]
+        x1, y1, x2, y2 = detection['xyxy']
+        box = [x1 * width, y1 * height, x2 * width, y2 * height]
+        draw.rectangle(box, outline=color, width=line)
+        label = f"{(names or {}).get(detection['cls'], 'corrosion')} {detection['conf']:.2f}"
+        left, top, right, bottom = draw.textbbox((0, 0), label)
+        label_y = max(box[1] - (bottom - top) - 4, 0)
+        draw.rectangle([box[0], label_y, box[0] + right - left + 4, label_y + bottom - top + 4], fill=color)
+        draw.text((box[0] + 2, label_y + 2 - top), label, fill=(255, 255, 255))
+    return image
+
+
+def save_overlay(source, instances, result_path, names=None):
+    """Eager mode: write the annotated full-size result JPEG for a path or PIL image."""
+    if isinstance(source, str):
+        with telemetry.stage('decode'), Image.open(source) as img:
+            source = img.convert('RGB')
+    with telemetry.stage('plot'):
+        overlay = draw_instances(source, instance_store.as_dicts(instances), names)
+    with telemetry.stage('encode'):
+        overlay.save(result_path)
+
+
+def source_path(row, upload_folder, result_folder):
+    """(path, overlay) to build a detection's result image from.
+
+    A stored result JPEG (eager mode, older rows) is used as is; otherwise the
+    original upload is drawn over with the stored instances.
+    """
+    result_path = os.path.join(result_folder, row['result_image'])
+    if os.path.exists(result_path):
+        return result_path, False
+    original_path = os.path.join(upload_folder, row['original_image'])
+    if row['instance_count'] is not None and os.path.exists(original_path):
+        return original_path, True
+    return None, False
+
+
+def render(row, upload_folder, result_folder, width=None, names=None):
+    """Result image for a detection row as a PIL image (at most `width` px wide), or None."""
+    path, overlay = source_path(row, upload_folder, result_folder)
+    if path is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            if width:
+                img.draft('RGB', (width, width))  # JPEG: decode at reduced scale when possible
+            img = img.convert('RGB')
+    except FileNotFoundError:
+        return None  # deleted since source_path looked
+    if width and img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    if overlay:
+        with database.connection() as conn:
+            detections = instance_store.load_instances(conn, row['id'])
+        img = draw_instances(img, detections, names)
+    return img
+
+
+def encode(image, fmt='jpeg', quality=85):
+    buffer = BytesIO()
+    image.save(buffer, FORMATS[fmt][0], quality=quality)
+    return buffer.getvalue()
+
+
+def version_tag(row, upload_folder, result_folder, *variant):
+    """(etag, last_modified) for one rendered variant; changes whenever its inputs do."""
+    path, overlay = source_path(row, upload_folder, result_folder)
+    if path is None:
+        return None, None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None, None  # deleted since source_path looked
+    parts = [row['id'], path, mtime, overlay, row['instance_count'], *variant]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20], mtime
+
+
+# ===========================
+# Rendered variant cache
+# ===========================
+class RenderCache:
+    """LRU of encoded images keyed by ETag, bounded by total bytes."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.counters['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.counters['hits'] += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._items), bytes=self._bytes)
+
+
+def cache_from_env():
+    return RenderCache(int(os.environ.get('RENDER_CACHE_MB', 64)) * 1024 * 1024)
@@ -0,0 +1,200 @@
+# report_export.py - Combined PDF / ZIP export for many detections at once
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from fpdf import FPDF
+
+import database
+import generate_pdf
+import rendering
+import reports_query
+
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 4))
+# A combined PDF is assembled in memory by FPDF, so it is capped; ZIP exports are not
+EXPORT_PDF_MAX = int(os.environ.get('EXPORT_PDF_MAX', 500))
+PAGE_SIZE = 100
+CHUNK_SIZE = 64 * 1024
+
+_pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+
+
+# ===========================
+# Selection
+# ===========================
+def count_selected(filters):
+    with database.connection() as conn:
+        return reports_query.count_reports(conn, filters)
+
+
+def iter_pages(filters, page_size=PAGE_SIZE):
+    """Listing rows for the selection, newest first, one keyset page at a time."""
+    cursor = None
+    while True:
+        with database.connection() as conn:
+            rows, cursor = reports_query.query_reports(conn, filters, cursor, page_size)
+        if rows:
+            yield rows
+        if not cursor:
+            return
+
+
+def iter_selected(filters):
+    for page in iter_pages(filters):
+        yield from page
+
+
+def iter_detections(filters):
+    """Full detection rows (with text and comments) for the selection, in listing order."""
+    for page in iter_pages(filters):
+        ids = [row['id'] for row in page]
+        rows = database.query_all(
+            f"SELECT * FROM detections WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        by_id = {row['id']: row for row in rows}
+        yield from (by_id[row_id] for row_id in ids if row_id in by_id)
+
+
+def ordered_map(fn, items, window=None, discard=None):
+    """Run `fn` over `items` on the export pool, yielding (item, result) in input order.
+
+    At most `window` results are in flight, so memory stays flat however long
+    `items` is. If the consumer stops early, `discard` is called on results
+    that were already produced.
+    """
+    window = window or EXPORT_WORKERS * 2
+    pending = deque()
+    try:
+        for item in items:
+            pending.append((item, _pool.submit(fn, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    finally:
+        for _, future in pending:
+            if not future.cancel() and discard:
+                future.add_done_callback(lambda done: done.exception() or discard(done.result()))
+
+
+def stream_file(path, remove=False):
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+    finally:
+        if remove:
+            os.remove(path)
+
+
+# ===========================
+# Combined PDF
+# ===========================
+def build_combined_pdf(filters, pdf_path, upload_folder, result_folder):
+    """Summary table followed by one page per detection; thumbnails are prepared in parallel."""
+    pdf = FPDF()
+    totals = generate_pdf.add_summary_pages(pdf, iter_selected(filters))
+
+    def prepare(row):
+        try:
+            result = rendering.render(row, upload_folder, result_folder, generate_pdf.print_width_px())
+            return generate_pdf.prepare_images(os.path.join(upload_folder, row['original_image']), result), None
+        except Exception as e:
+            return [], e
+
+    pages = ordered_map(prepare, iter_detections(filters),
+                        discard=lambda prepared: generate_pdf.remove_images(prepared[0]))
+    for row, (images, error) in pages:
+        try:
+            # FPDF copies the image data when it is placed, so the temp files can go right away
+            generate_pdf.add_report_page(pdf, images, row['result_text'] or '', generate_pdf.display_name(row),
+                                         row['comments'] or '', row['custom_name'] or '',
+                                         f"report_{row['id']}.pdf", error)
+        finally:
+            generate_pdf.remove_images(images)
+    pdf.output(pdf_path)
+    return totals
+
+
+def export_pdf(filters, upload_folder, result_folder):
+    """Build the combined PDF in a temp file; returns its path (caller streams and removes it)."""
+    fd, pdf_path = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    try:
+        build_combined_pdf(filters, pdf_path, upload_folder, result_folder)
+    except Exception:
+        os.remove(pdf_path)
+        raise
+    return pdf_path
+
+
+# ===========================
+# ZIP of PDFs
+# ===========================
+class _ZipSink:
+    """Write-only target for zipfile; the generator drains it after every write."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Pending bytes as a list of zero or one chunks, for `yield from`."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return [data] if data else []
+
+
+def _zip_file(zf, sink, arcname, path):
+    with zf.open(arcname, 'w') as member, open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            member.write(chunk)
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def stream_zip(filters, upload_folder, result_folder):
+    """Yield a ZIP (summary.pdf plus one cached PDF per report) as each member is produced."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+        fd, summary_path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        try:
+            pdf = FPDF()
+            generate_pdf.add_summary_pages(pdf, iter_selected(filters))
+            pdf.output(summary_path)
+            yield from _zip_file(zf, sink, 'summary.pdf', summary_path)
+        finally:
+            os.remove(summary_path)
+
+        def render(row):
+            try:
+                return generate_pdf.get_report_pdf(row['id'], row, upload_folder, result_folder), None
+            except Exception as e:
+                return None, e
+
+        failures = []
+        for row, (pdf_path, error) in ordered_map(render, iter_detections(filters)):
+            if error:
+                failures.append(f"report_{row['id']}: {error}")
+                continue
+            yield from _zip_file(zf, sink, f"report_{row['id']}.pdf", pdf_path)
+
+        if failures:
+            zf.writestr('errors.txt', '\n'.join(failures) + '\n')
+    yield from sink.drain()
@@ -0,0 +1,151 @@
+# reports_query.py - Keyset-paginated, filterable reports listing
+import base64
+import sqlite3
+
+import telemetry
+
+LIST_COLUMNS = ('id, original_image, original_name, result_image, custom_name, high_severity, medium_severity, '
+                'low_severity, confirmed, timestamp')
+# Positions of the keyset columns in a listed row (plain tuples as well as sqlite3.Row)
+TIMESTAMP_INDEX = [column.strip() for column in LIST_COLUMNS.split(',')].index('timestamp')
+
+SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_detections_timestamp_id ON detections (timestamp DESC, id DESC);
+'''
+
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS detections_fts USING fts5(
+    custom_name, comments, content='detections', content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS detections_fts_insert AFTER INSERT ON detections BEGIN
+    INSERT INTO detections_fts (rowid, custom_name, comments) VALUES (NEW.id, NEW.custom_name, NEW.comments);
+END;
+
+CREATE TRIGGER IF NOT EXISTS detections_fts_delete AFTER DELETE ON detections BEGIN
+    INSERT INTO detections_fts (detections_fts, rowid, custom_name, comments)
+    VALUES ('delete', OLD.id, OLD.custom_name, OLD.comments);
+END;
+
+CREATE TRIGGER IF NOT EXISTS detections_fts_update AFTER UPDATE OF custom_name, comments ON detections BEGIN
+    INSERT INTO detections_fts (detections_fts, rowid, custom_name, comments)
+    VALUES ('delete', OLD.id, OLD.custom_name, OLD.comments);
+    INSERT INTO detections_fts (rowid, custom_name, comments) VALUES (NEW.id, NEW.custom_name, NEW.comments);
+END;
+'''
+
+FILTER_KEYS = ('q', 'severity', 'min_high', 'min_med', 'min_low', 'confirmed', 'date_from', 'date_to')
+
+
+def has_fts(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'detections_fts'"
+    ).fetchone() is not None
+
+
+def init_reports_search(conn):
+    """Create the keyset index and, where SQLite has FTS5, the full-text index."""
+    conn.executescript(SCHEMA)
+    if not has_fts(conn):
+        try:
+            conn.executescript(FTS_SCHEMA)
+            conn.execute("INSERT INTO detections_fts (detections_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            print("⚠️ FTS5 unavailable, text search falls back to LIKE:", str(e))
+    conn.commit()
+
+
+# ===========================
+# Cursors
+# ===========================
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+# ===========================
+# Query
+# ===========================
+def _fts_query(text):
+    # Quote every term so user input is never parsed as FTS syntax; prefix-match each
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def build_filters(conn, filters):
+    clauses, params = [], []
+
+    ids = filters.get('ids')
+    if ids:
+        clauses.append(f"id IN ({', '.join('?' * len(ids))})")
+        params.extend(int(row_id) for row_id in ids)
+
+    severity = filters.get('severity')
+    if severity in ('high', 'med', 'low'):
+        column = {'high': 'high_severity', 'med': 'medium_severity', 'low': 'low_severity'}[severity]
+        clauses.append(f"{column} > 0")
+
+    for key, column in (('min_high', 'high_severity'), ('min_med', 'medium_severity'), ('min_low', 'low_severity')):
+        if filters.get(key) not in (None, ''):
+            clauses.append(f"{column} >= ?")
+            params.append(int(filters[key]))
+
+    # Unary + keeps the planner on the (timestamp, id) index instead of sorting every confirmed row
+    if filters.get('confirmed') == '1':
+        clauses.append("+confirmed = 1")
+    elif filters.get('confirmed') == '0':
+        clauses.append("COALESCE(+confirmed, 0) = 0")
+
+    if filters.get('date_from'):
+        clauses.append("timestamp >= ?")
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        clauses.append("timestamp < date(?, '+1 day')")
+        params.append(filters['date_to'])
+
+    text = (filters.get('q') or '').strip()
+    if text:
+        if has_fts(conn):
+            clauses.append("id IN (SELECT rowid FROM detections_fts WHERE detections_fts MATCH ?)")
+            params.append(_fts_query(text))
+        else:
+            clauses.append("(custom_name LIKE ? OR comments LIKE ?)")
+            params.extend([f"%{text}%", f"%{text}%"])
+
+    return clauses, params
+
+
+def count_reports(conn, filters=None):
+    clauses, params = build_filters(conn, filters or {})
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return conn.execute(f"SELECT COUNT(*) FROM detections {where}", params).fetchone()[0]
+
+
+@telemetry.timed('db.query_reports')
+def query_reports(conn, filters=None, cursor=None, limit=50):
+    """Return (rows, next_cursor) for one page ordered by (timestamp, id) descending."""
+    clauses, params = build_filters(conn, filters or {})
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        clauses.append("(timestamp, id) < (?, ?)")
+        params.extend([timestamp, row_id])
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = conn.execute(f'''
+        SELECT {LIST_COLUMNS} FROM detections {where}
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[TIMESTAMP_INDEX], last[0])
+    return rows, next_cursor
@@ -0,0 +1,258 @@
+# result_cache.py - Content-addressed cache of inference results
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat_signature(path):
+    """Sizes and mtimes of a model file, or of every file in an exported model folder."""
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    signature = []
+    for name in sorted(os.listdir(path)):
+        st = os.stat(os.path.join(path, name))
+        signature.append((name, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+def model_checksum(path):
+    """Checksum of a .pt / .onnx file or of an exported model folder (e.g. best_openvino_model/)."""
+    if not os.path.isdir(path):
+        return file_checksum(path)
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        if os.path.isfile(os.path.join(path, name)):
+            digest.update(name.encode() + file_checksum(os.path.join(path, name)).encode())
+    return digest.hexdigest()
+
+
+FICLONE = 0x40049409  # Linux ioctl: share extents copy-on-write (btrfs, XFS, bcachefs)
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def link_or_copy(src, dst):
+    """Give dst its own directory entry for src without re-encoding the image.
+
+    Hard link first; where links are refused, a copy-on-write reflink; then
+    a plain copy. Returns which one was used.
+    """
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        return 'reflink'
+    except (OSError, ImportError):
+        if os.path.exists(dst):
+            os.remove(dst)
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) cache keyed by image content and model settings.
+
+    Keys combine a hash of the decoded pixels, the weights checksum (and that
+    of the exported artifact in use), the active backend and the inference
+    thresholds, so replacing best.pt, re-exporting or changing conf/iou/max_det
+    can never return a stale entry. The disk tier lives under `cache_dir` as
+    one JSON file plus the rendered JPEG per entry and is trimmed oldest-first
+    once it grows past `max_disk_bytes`.
+    """
+
+    def __init__(self, cache_dir, weights_path, max_memory_entries=256, max_disk_bytes=200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.weights_path = weights_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprints = {}  # path -> (stat signature, checksum)
+        self._disk_bytes = None
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ===========================
+    # Keys
+    # ===========================
+    def fingerprint(self, path):
+        """Checksum of a model file or folder, recomputed only when a size or mtime changes."""
+        try:
+            signature = _stat_signature(path)
+        except OSError:
+            return 'missing'
+        known = self._fingerprints.get(path)
+        if known is None or known[0] != signature:
+            known = self._fingerprints[path] = (signature, model_checksum(path))
+            with self._lock:
+                self._memory.clear()
+        return known[1]
+
+    def weights_fingerprint(self):
+        """Checksum of the weights file (best.pt)."""
+        return self.fingerprint(self.weights_path)
+
+    def key_for(self, image, artifact=None, **settings):
+        """Key for a PIL image or a NumPy model input (e.g. `preprocess.Frame.array`).
+
+        `artifact` is the exported model actually serving (ONNX file, OpenVINO
+        folder), so re-exporting or re-quantising it invalidates the entries.
+        """
+        digest = hashlib.sha256()
+        if hasattr(image, 'mode'):
+            digest.update(f"{image.mode}:{image.size}".encode())
+        else:
+            digest.update(f"{image.dtype}:{image.shape}".encode())
+        digest.update(image.tobytes())
+        digest.update(self.weights_fingerprint().encode())
+        if artifact and artifact != self.weights_path:
+            digest.update(self.fingerprint(artifact).encode())
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    # ===========================
+    # Lookup / store
+    # ===========================
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f"{key}.json"),
+                os.path.join(self.cache_dir, f"{key}.jpg"))
+
+    def get(self, key):
+        """Return the cached entry (with 'image_path') or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and (entry['image_path'] is None or os.path.exists(entry['image_path'])):
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return entry
+
+        meta_path, image_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        rendered = entry is not None and entry.get('rendered', True)
+        if entry is None or (rendered and not os.path.exists(image_path)):
+            with self._lock:
+                self._memory.pop(key, None)
+                self.counters['misses'] += 1
+            return None
+
+        entry['image_path'] = image_path if rendered else None
+        os.utime(meta_path)
+        with self._lock:
+            self._remember(key, entry)
+            self.counters['disk_hits'] += 1
+        return entry
+
+    def put(self, key, entry, rendered_path=None):
+        """Store entry plus a link to the rendered JPEG, if any; entry must be JSON-serialisable."""
+        meta_path, image_path = self._paths(key)
+        entry = dict(entry, rendered=rendered_path is not None)
+        try:
+            if rendered_path and not os.path.exists(image_path):
+                link_or_copy(rendered_path, image_path)
+            with open(meta_path, 'w') as f:
+                json.dump(entry, f)
+        except OSError as e:
+            print("❌ Cache store failed:", str(e))
+            return
+
+        entry['image_path'] = image_path if rendered_path else None
+        with self._lock:
+            self._remember(key, entry)
+            self.counters['stores'] += 1
+            if self._disk_bytes is not None:
+                self._disk_bytes += os.path.getsize(meta_path)
+                if rendered_path:
+                    self._disk_bytes += os.path.getsize(image_path)
+        self._trim_disk()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    # ===========================
+    # Eviction
+    # ===========================
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            meta_path, image_path = self._paths(key)
+            try:
+                size = os.path.getsize(meta_path)
+                mtime = os.path.getmtime(meta_path)
+                if os.path.exists(image_path):
+                    size += os.path.getsize(image_path)
+            except OSError:
+                continue
+            entries.append((mtime, key, size))
+        return entries
+
+    def _trim_disk(self):
+        if self._disk_bytes is not None and self._disk_bytes <= self.max_disk_bytes:
+            return
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        entries.sort()
+        evicted = 0
+        for _, key, size in entries:
+            if total <= self.max_disk_bytes:
+                break
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            with self._lock:
+                self._memory.pop(key, None)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.counters['evictions'] += evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = lookups - self.counters['misses']
+            return dict(
+                self.counters,
+                memory_entries=len(self._memory),
+                disk_bytes=self._disk_bytes,
+                hit_rate=round(hits / lookups, 3) if lookups else 0.0,
+            )
+
+
+def cache_from_env(result_folder, weights_path):
+    if os.environ.get('RESULT_CACHE', '1') == '0':
+        return None
+    return ResultCache(
+        os.path.join(result_folder, 'cache'),
+        weights_path,
+        max_memory_entries=int(os.environ.get('RESULT_CACHE_ENTRIES', 256)),
+        max_disk_bytes=int(float(os.environ.get('RESULT_CACHE_MB', 200)) * 1024 * 1024),
+    )
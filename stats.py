@@ -0,0 +1,163 @@
+# stats.py - Incrementally maintained dashboard statistics
+import argparse
+
+# Counters are kept current by triggers, so reads never scan `detections`
+SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections (timestamp);
+CREATE INDEX IF NOT EXISTS idx_detections_confirmed ON detections (confirmed);
+CREATE INDEX IF NOT EXISTS idx_detections_result_image ON detections (result_image);
+
+CREATE TABLE IF NOT EXISTS detection_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL DEFAULT 0,
+    confirmed INTEGER NOT NULL DEFAULT 0,
+    high INTEGER NOT NULL DEFAULT 0,
+    med INTEGER NOT NULL DEFAULT 0,
+    low INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS detection_daily_stats (
+    day TEXT PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    confirmed INTEGER NOT NULL DEFAULT 0,
+    high INTEGER NOT NULL DEFAULT 0,
+    med INTEGER NOT NULL DEFAULT 0,
+    low INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS detections_stats_insert AFTER INSERT ON detections BEGIN
+    UPDATE detection_stats SET
+        total = total + 1,
+        confirmed = confirmed + (COALESCE(NEW.confirmed, 0) != 0),
+        high = high + COALESCE(NEW.high_severity, 0),
+        med = med + COALESCE(NEW.medium_severity, 0),
+        low = low + COALESCE(NEW.low_severity, 0)
+    WHERE id = 1;
+    INSERT INTO detection_daily_stats (day, total, confirmed, high, med, low)
+    VALUES (date(COALESCE(NEW.timestamp, CURRENT_TIMESTAMP)), 1, (COALESCE(NEW.confirmed, 0) != 0),
+            COALESCE(NEW.high_severity, 0), COALESCE(NEW.medium_severity, 0), COALESCE(NEW.low_severity, 0))
+    ON CONFLICT (day) DO UPDATE SET
+        total = total + excluded.total,
+        confirmed = confirmed + excluded.confirmed,
+        high = high + excluded.high,
+        med = med + excluded.med,
+        low = low + excluded.low;
+END;
+
+CREATE TRIGGER IF NOT EXISTS detections_stats_delete AFTER DELETE ON detections BEGIN
+    UPDATE detection_stats SET
+        total = total - 1,
+        confirmed = confirmed - (COALESCE(OLD.confirmed, 0) != 0),
+        high = high - COALESCE(OLD.high_severity, 0),
+        med = med - COALESCE(OLD.medium_severity, 0),
+        low = low - COALESCE(OLD.low_severity, 0)
+    WHERE id = 1;
+    UPDATE detection_daily_stats SET
+        total = total - 1,
+        confirmed = confirmed - (COALESCE(OLD.confirmed, 0) != 0),
+        high = high - COALESCE(OLD.high_severity, 0),
+        med = med - COALESCE(OLD.medium_severity, 0),
+        low = low - COALESCE(OLD.low_severity, 0)
+    WHERE day = date(COALESCE(OLD.timestamp, CURRENT_TIMESTAMP));
+END;
+
+CREATE TRIGGER IF NOT EXISTS detections_stats_update
+AFTER UPDATE OF confirmed, high_severity, medium_severity, low_severity, timestamp ON detections BEGIN
+    UPDATE detection_stats SET
+        confirmed = confirmed - (COALESCE(OLD.confirmed, 0) != 0) + (COALESCE(NEW.confirmed, 0) != 0),
+        high = high - COALESCE(OLD.high_severity, 0) + COALESCE(NEW.high_severity, 0),
+        med = med - COALESCE(OLD.medium_severity, 0) + COALESCE(NEW.medium_severity, 0),
+        low = low - COALESCE(OLD.low_severity, 0) + COALESCE(NEW.low_severity, 0)
+    WHERE id = 1;
+    UPDATE detection_daily_stats SET
+        total = total - 1,
+        confirmed = confirmed - (COALESCE(OLD.confirmed, 0) != 0),
+        high = high - COALESCE(OLD.high_severity, 0),
+        med = med - COALESCE(OLD.medium_severity, 0),
+        low = low - COALESCE(OLD.low_severity, 0)
+    WHERE day = date(COALESCE(OLD.timestamp, CURRENT_TIMESTAMP));
+    INSERT INTO detection_daily_stats (day, total, confirmed, high, med, low)
+    VALUES (date(COALESCE(NEW.timestamp, CURRENT_TIMESTAMP)), 1, (COALESCE(NEW.confirmed, 0) != 0),
+            COALESCE(NEW.high_severity, 0), COALESCE(NEW.medium_severity, 0), COALESCE(NEW.low_severity, 0))
+    ON CONFLICT (day) DO UPDATE SET
+        total = total + excluded.total,
+        confirmed = confirmed + excluded.confirmed,
+        high = high + excluded.high,
+        med = med + excluded.med,
+        low = low + excluded.low;
+END;
+'''
+
+BUCKETS = {
+    'day': 'day',
+    'week': "strftime('%Y-W%W', day)",
+    'month': "strftime('%Y-%m', day)",
+}
+
+
+def rebuild_stats(conn):
+    """Recompute every counter from `detections` (one full scan)."""
+    conn.execute("DELETE FROM detection_stats")
+    conn.execute("DELETE FROM detection_daily_stats")
+    conn.execute('''
+        INSERT INTO detection_stats (id, total, confirmed, high, med, low)
+        SELECT 1, COUNT(*), COALESCE(SUM(COALESCE(confirmed, 0) != 0), 0),
+               COALESCE(SUM(high_severity), 0), COALESCE(SUM(medium_severity), 0), COALESCE(SUM(low_severity), 0)
+        FROM detections
+    ''')
+    conn.execute('''
+        INSERT INTO detection_daily_stats (day, total, confirmed, high, med, low)
+        SELECT date(COALESCE(timestamp, CURRENT_TIMESTAMP)) AS d, COUNT(*), SUM(COALESCE(confirmed, 0) != 0),
+               SUM(COALESCE(high_severity, 0)), SUM(COALESCE(medium_severity, 0)), SUM(COALESCE(low_severity, 0))
+        FROM detections GROUP BY d
+    ''')
+
+
+def init_stats(conn):
+    """Create indexes, summary tables and triggers; backfill counters the first time."""
+    conn.executescript(SCHEMA)
+    if conn.execute("SELECT 1 FROM detection_stats WHERE id = 1").fetchone() is None:
+        rebuild_stats(conn)
+    conn.commit()
+
+
+def get_totals(conn):
+    row = conn.execute("SELECT total, confirmed, high, med, low FROM detection_stats WHERE id = 1").fetchone()
+    if row is None:
+        return {'total': 0, 'confirmed': 0, 'high': 0, 'med': 0, 'low': 0}
+    return dict(zip(('total', 'confirmed', 'high', 'med', 'low'), row))
+
+
+def time_buckets(conn, bucket='day', start=None, end=None):
+    """Per-day/week/month totals between optional YYYY-MM-DD bounds, oldest first."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+    clauses, params = [], []
+    if start:
+        clauses.append("day >= ?")
+        params.append(start)
+    if end:
+        clauses.append("day <= ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = conn.execute(f'''
+        SELECT {BUCKETS[bucket]} AS period, SUM(total), SUM(confirmed), SUM(high), SUM(med), SUM(low)
+        FROM detection_daily_stats {where}
+        GROUP BY period HAVING SUM(total) > 0 ORDER BY period
+    ''', params).fetchall()
+    return [dict(zip(('period', 'total', 'confirmed', 'high', 'med', 'low'), row)) for row in rows]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain dashboard statistics")
+    parser.add_argument('--rebuild', action='store_true', help="recompute counters from scratch")
+    args = parser.parse_args()
+
+    import database
+
+    database.init_db()
+    with database.transaction() as conn:
+        if args.rebuild:
+            rebuild_stats(conn)
+            print("✅ Statistics rebuilt")
+        print(get_totals(conn))
@@ -0,0 +1,549 @@
+# storage.py - Content-addressed upload storage, deferred file deletion and orphan garbage collection
+import argparse
+import hashlib
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import database
+
+SHARD_DEPTH = 2  # uploads/ab/cd/abcd….jpg: at most 256 entries per directory level
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+DEFAULT_EXTENSION = '.jpg'
+CONTENT_NAME = re.compile(r'^(?:[0-9a-f]{2}/){%d}[0-9a-f]{64}\.[a-z0-9]+$' % SHARD_DEPTH)
+SPOOL_PREFIX = '.spool-'
+
+TEMP_FOLDER = 'static/temp'
+REPORT_FOLDER = 'static/reports'
+DERIVATIVE_FOLDER = 'static/derivatives'
+# Shipped with the app; the cache/ and markup/ subfolders are not scanned as results
+KEEP_RESULTS = {'no_detection.jpg'}
+GC_MIN_AGE = 3600  # files younger than this may belong to a request whose row is not committed yet
+
+
+def extension_for(filename):
+    """Lower-case image extension of a client-supplied name; anything else is stored as .jpg."""
+    extension = os.path.splitext(filename or '')[1].lower()
+    return extension if extension in IMAGE_EXTENSIONS else DEFAULT_EXTENSION
+
+
+def content_name(digest, extension):
+    shards = [digest[2 * i:2 * i + 2] for i in range(SHARD_DEPTH)]
+    return '/'.join(shards + [digest + extension])
+
+
+def is_content_name(name):
+    return bool(CONTENT_NAME.match(name or ''))
+
+
+class UploadStore:
+    """Uploads named by the SHA-256 of their bytes in sharded folders under `root`.
+
+    Identical photos are stored once; every detection row that uses one names
+    the same file in `original_image`, so the row count for a name is its
+    reference count (see `unreferenced`). Writes are spooled next to the
+    target and renamed into place, so readers never see a partial file.
+
+    Every put claims the name until the caller's row is saved (`release`), so
+    a deletion queued for the same file meanwhile (see `remove`) leaves it be.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._claims = {}  # name -> (requests holding it, last claimed); expire after GC_MIN_AGE
+        self.counters = {'stored': 0, 'deduplicated': 0, 'bytes_stored': 0, 'bytes_deduplicated': 0}
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def put_stream(self, stream, filename=None, chunk_size=1 << 20):
+        """Store a file-like object (e.g. a Werkzeug FileStorage stream); returns its stored name."""
+        spool = os.path.join(self.root, f"{SPOOL_PREFIX}{uuid.uuid4().hex}")
+        digest, size = hashlib.sha256(), 0
+        try:
+            with open(spool, 'wb') as f:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            return self._commit(spool, digest.hexdigest(), extension_for(filename), size)
+        finally:
+            if os.path.exists(spool):
+                os.remove(spool)
+
+    def put_bytes(self, data, filename=None):
+        digest, extension = hashlib.sha256(data).hexdigest(), extension_for(filename)
+        name = content_name(digest, extension)
+        if self._reuse(self.path(name), len(data)):
+            return name
+        spool = os.path.join(self.root, f"{SPOOL_PREFIX}{uuid.uuid4().hex}")
+        with open(spool, 'wb') as f:
+            f.write(data)
+        return self._commit(spool, digest, extension, len(data))
+
+    def put_file(self, path, filename=None):
+        """Move an existing file into the store (legacy uploads); a duplicate is deleted instead."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return self._commit(path, digest.hexdigest(), extension_for(filename or path), os.path.getsize(path))
+
+    def _reuse(self, target, size):
+        name = os.path.relpath(target, self.root).replace(os.sep, '/')
+        with self._lock:
+            if not os.path.exists(target):
+                return False
+            # Fresh mtime: the garbage collector's age check now protects it until the new row is saved
+            os.utime(target)
+            self._claim(name)
+            self.counters['deduplicated'] += 1
+            self.counters['bytes_deduplicated'] += size
+        return True
+
+    def _commit(self, spool, digest, extension, size):
+        name = content_name(digest, extension)
+        target = self.path(name)
+        if self._reuse(target, size):
+            os.remove(spool)
+            return name
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with self._lock:
+            os.replace(spool, target)
+            self._claim(name)
+            self.counters['stored'] += 1
+            self.counters['bytes_stored'] += size
+        return name
+
+    # ===========================
+    # Claims
+    # ===========================
+    def _claim(self, name):
+        """Called with the lock held."""
+        now = time.monotonic()
+        if len(self._claims) >= 1024:
+            self._claims = {key: value for key, value in self._claims.items() if now - value[1] < GC_MIN_AGE}
+        count, _ = self._claims.get(name, (0, now))
+        self._claims[name] = (count + 1, now)
+
+    def _claimed(self, name):
+        count, claimed = self._claims.get(name, (0, 0))
+        return count > 0 and time.monotonic() - claimed < GC_MIN_AGE
+
+    def release(self, name):
+        """Drop one request's claim on `name` once its detection row is saved (or the request gave up)."""
+        with self._lock:
+            count, claimed = self._claims.pop(name, (0, 0))
+            if count > 1:
+                self._claims[name] = (count - 1, claimed)
+
+    def remove(self, path):
+        """Unlink an upload queued for deletion, unless a request took it up since: 'deleted' or 'kept'.
+
+        The rows were deleted earlier in another transaction, so the reference
+        count is read again here; a claimed file is left for its new row (or,
+        if that request fails, for the garbage collector).
+        """
+        name = os.path.relpath(path, self.root).replace(os.sep, '/')
+        with self._lock:
+            if self._claimed(name):
+                return 'kept'
+            with database.connection() as conn:
+                if reference_counts(conn, [name])[name]:
+                    return 'kept'
+            os.remove(path)
+        return 'deleted'
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+# ===========================
+# Reference counts
+# ===========================
+def reference_counts(conn, names, chunk=500):
+    """{name: number of detection rows whose original_image is `name`} (0 for unused names)."""
+    names = list(set(names))
+    counts = dict.fromkeys(names, 0)
+    for start in range(0, len(names), chunk):
+        part = names[start:start + chunk]
+        counts.update(conn.execute(
+            f"SELECT original_image, COUNT(*) FROM detections WHERE original_image IN ({', '.join('?' * len(part))}) "
+            "GROUP BY original_image", part).fetchall())
+    return counts
+
+
+def unreferenced(conn, names):
+    """The uploads among `names` that no detection uses any more; call after deleting rows, inside the transaction."""
+    return sorted(name for name, count in reference_counts(conn, names).items() if count == 0)
+
+
+# ===========================
+# Deletion
+# ===========================
+DELETE_SCHEMA = "CREATE TEMP TABLE IF NOT EXISTS delete_ids (id INTEGER PRIMARY KEY)"
+
+
+def delete_detections(conn, ids, upload_folder, result_folder):
+    """Delete detection rows (instances cascade) with set-based SQL; returns (deleted ids, uploads, other files).
+
+    The ids go into a temp table once, so the lookup and the DELETE are one
+    statement each however many rows are selected. Run it inside
+    database.transaction() and remove the files after the commit; uploads
+    through `UploadStore.remove`, which checks they are still unused.
+    """
+    conn.execute(DELETE_SCHEMA)
+    conn.execute("DELETE FROM delete_ids")
+    conn.executemany("INSERT OR IGNORE INTO delete_ids (id) VALUES (?)", ((int(i),) for i in ids))
+    rows = conn.execute(
+        "SELECT d.id, d.original_image, d.result_image FROM detections d JOIN delete_ids USING (id)").fetchall()
+    conn.execute("DELETE FROM detections WHERE id IN (SELECT id FROM delete_ids)")
+    conn.execute("DELETE FROM delete_ids")
+
+    # Uploads shared with surviving rows (deduplicated photos) stay
+    uploads = [os.path.join(upload_folder, name) for name in unreferenced(conn, [row[1] for row in rows])]
+    paths = []
+    for row in rows:
+        paths.append(os.path.join(result_folder, row[2]))
+        paths.append(os.path.join(result_folder, 'markup', f"markup_{row[2]}"))
+    return [row[0] for row in rows], uploads, paths
+
+
+class FileDeleter:
+    """Background unlinking: callers hand over paths and return; a daemon thread removes them in batches.
+
+    Missing files count as done. Other errors (a file still open on Windows,
+    a busy network share) are retried with a doubling delay up to `retries`
+    times, then logged and dropped; the garbage collector reclaims anything
+    left behind. Directories (derivative folders) are removed whole. Paths
+    submitted with `remove` are handed to it instead of unlinked (it returns
+    'deleted' or 'kept'), e.g. `UploadStore.remove` for shared uploads.
+    """
+
+    def __init__(self, batch_size=256, retries=5, retry_delay=1.0):
+        self.batch_size = max(1, int(batch_size))
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._retrying = []  # (due, attempt, path, remove), only touched by the deleter thread
+        self._idle = threading.Condition()
+        self._pending = 0
+        self.counters = {'queued': 0, 'deleted': 0, 'kept': 0, 'missing': 0, 'retried': 0, 'failed': 0,
+                         'batches': 0}
+        self._thread = threading.Thread(target=self._run, name='file-deleter', daemon=True)
+        self._thread.start()
+
+    def submit(self, paths, remove=None):
+        """Queue paths for removal; returns how many were queued."""
+        paths = list(paths)
+        with self._idle:
+            self._pending += len(paths)
+            self.counters['queued'] += len(paths)
+        for path in paths:
+            self._queue.put((0, path, remove))
+        return len(paths)
+
+    def flush(self, timeout=None):
+        """Block until every queued path is removed or given up on; False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _next_batch(self):
+        timeout = None
+        if self._retrying:
+            timeout = max(0.0, min(item[0] for item in self._retrying) - time.monotonic())
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        batch += [item[1:] for item in self._retrying if item[0] <= now]
+        self._retrying = [item for item in self._retrying if item[0] > now]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            done = {'deleted': 0, 'kept': 0, 'missing': 0, 'retried': 0, 'failed': 0}
+            for attempt, path, remove in batch:
+                done[self._remove(path, attempt, remove)] += 1
+            with self._idle:
+                for key, amount in done.items():
+                    self.counters[key] += amount
+                self.counters['batches'] += 1
+                self._pending -= len(batch) - done['retried']
+                if not self._pending:
+                    self._idle.notify_all()
+
+    @staticmethod
+    def _unlink(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return 'deleted'
+
+    def _remove(self, path, attempt, remove):
+        try:
+            return (remove or self._unlink)(path)
+        except FileNotFoundError:
+            return 'missing'
+        except OSError as e:
+            if attempt < self.retries:
+                self._retrying.append((time.monotonic() + self.retry_delay * 2 ** attempt, attempt + 1, path, remove))
+                return 'retried'
+            print("❌ Could not delete", path, str(e))
+            return 'failed'
+
+    def stats(self):
+        with self._idle:
+            return dict(self.counters, pending=self._pending)
+
+
+def deleter_from_env():
+    """FILE_DELETE_BATCH paths per batch (default 256); FILE_DELETE_RETRIES attempts after the first (default 5)."""
+    return FileDeleter(batch_size=int(os.environ.get('FILE_DELETE_BATCH', 256)),
+                       retries=int(os.environ.get('FILE_DELETE_RETRIES', 5)))
+
+
+# ===========================
+# Garbage collection
+# ===========================
+def _files(folder, recursive=False):
+    """(path, relative name, stat) for every file in `folder`."""
+    if not os.path.isdir(folder):
+        return
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                yield path, os.path.relpath(path, folder).replace(os.sep, '/'), os.stat(path)
+            except FileNotFoundError:
+                continue
+        if not recursive:
+            return
+
+
+def find_orphans(upload_folder, result_folder, report_folder=REPORT_FOLDER, temp_folder=TEMP_FOLDER,
+                 derivative_folder=DERIVATIVE_FOLDER, min_age=GC_MIN_AGE):
+    """{category: [(path, bytes)]} of files no detection references, older than `min_age` seconds.
+
+    uploads: originals (and abandoned spool files) no row names;
+    results / markup: overlays and saved markup of deleted rows;
+    reports: cached PDFs of deleted rows and superseded versions of live ones;
+    temp: spooled archives and exports left behind; derivatives: thumbnails of deleted rows.
+    """
+    with database.connection() as conn:
+        originals = {row[0] for row in conn.execute("SELECT DISTINCT original_image FROM detections")}
+        results = {row[0] for row in conn.execute("SELECT result_image FROM detections")}
+        ids = {str(row[0]) for row in conn.execute("SELECT id FROM detections")}
+    cutoff = time.time() - min_age
+    orphans = {category: [] for category in ('uploads', 'results', 'markup', 'reports', 'temp', 'derivatives')}
+
+    for path, name, st in _files(upload_folder, recursive=True):
+        hidden = os.path.basename(name).startswith('.') and not os.path.basename(name).startswith(SPOOL_PREFIX)
+        if st.st_mtime < cutoff and name not in originals and not hidden:
+            orphans['uploads'].append((path, st.st_size))
+    for path, name, st in _files(result_folder):
+        if st.st_mtime < cutoff and name not in results and name not in KEEP_RESULTS:
+            orphans['results'].append((path, st.st_size))
+    for path, name, st in _files(os.path.join(result_folder, 'markup')):
+        if st.st_mtime < cutoff and name[len('markup_'):] not in results:
+            orphans['markup'].append((path, st.st_size))
+
+    # report_<id>.pdf (before the cache) and cache/report_<id>_<version>.pdf; a live id keeps its newest version
+    versions = {}
+    for path, name, st in _files(report_folder, recursive=True):
+        match = re.match(r'^(?:cache/)?report_(\d+)(?:_\w+)?\.pdf$', name)
+        if not match:
+            continue
+        if match.group(1) not in ids:
+            if st.st_mtime < cutoff:
+                orphans['reports'].append((path, st.st_size))
+        elif name.startswith('cache/'):
+            versions.setdefault(match.group(1), []).append((st.st_mtime, path, st.st_size))
+    for files in versions.values():
+        files.sort()
+        orphans['reports'] += [(path, size) for mtime, path, size in files[:-1] if mtime < cutoff]
+
+    for path, name, st in _files(temp_folder, recursive=True):
+        if st.st_mtime < cutoff:
+            orphans['temp'].append((path, st.st_size))
+    if os.path.isdir(derivative_folder):
+        for entry in os.scandir(derivative_folder):
+            if entry.is_dir() and entry.name not in ids and entry.stat().st_mtime < cutoff:
+                orphans['derivatives'] += [(path, st.st_size) for path, _, st in _files(entry.path, recursive=True)]
+    return orphans
+
+
+def collect_garbage(upload_folder, result_folder, dry_run=True, **options):
+    """Find orphans (see find_orphans) and, unless `dry_run`, delete them; returns a per-category report."""
+    started = time.perf_counter()
+    orphans = find_orphans(upload_folder, result_folder, **options)
+    report = {'dry_run': dry_run, 'categories': {}, 'files': 0, 'bytes': 0}
+    for category, files in orphans.items():
+        removed = []
+        for path, size in files:
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    print("⚠️ GC could not remove", path, str(e))
+                    continue
+            removed.append((path, size))
+        report['categories'][category] = {'files': len(removed), 'bytes': sum(size for _, size in removed),
+                                          'paths': [path for path, _ in removed]}
+        report['files'] += len(removed)
+        report['bytes'] += report['categories'][category]['bytes']
+    if not dry_run:
+        for folder in (upload_folder, options.get('derivative_folder', DERIVATIVE_FOLDER)):
+            _remove_empty_dirs(folder)
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def _remove_empty_dirs(folder):
+    for root, dirs, files in os.walk(folder, topdown=False):
+        if root != folder and not dirs and not files:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+
+class GarbageCollector:
+    """Runs collect_garbage every `interval` seconds on a daemon thread; keeps the last report for /metrics."""
+
+    def __init__(self, upload_folder, result_folder, interval, min_age=GC_MIN_AGE):
+        self.upload_folder, self.result_folder = upload_folder, result_folder
+        self.interval, self.min_age = interval, min_age
+        self.last = None
+        self.counters = {'runs': 0, 'files': 0, 'bytes': 0, 'failed': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='storage-gc', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                report = collect_garbage(self.upload_folder, self.result_folder, dry_run=False, min_age=self.min_age)
+            except Exception as e:
+                self.counters['failed'] += 1
+                print("❌ Storage GC failed:", str(e))
+                continue
+            self.last = {key: value for key, value in report.items() if key != 'categories'}
+            self.counters['runs'] += 1
+            self.counters['files'] += report['files']
+            self.counters['bytes'] += report['bytes']
+            if report['files']:
+                print(f"🧹 Storage GC removed {report['files']} file(s), {human_bytes(report['bytes'])}")
+
+    def stats(self):
+        return dict(self.counters, interval_seconds=self.interval)
+
+
+def gc_from_env(upload_folder, result_folder):
+    """GC_INTERVAL_HOURS (default 0 = off; use `python storage.py gc` instead) and GC_MIN_AGE_HOURS (default 1)."""
+    try:
+        interval = float(os.environ.get('GC_INTERVAL_HOURS', 0)) * 3600
+        min_age = float(os.environ.get('GC_MIN_AGE_HOURS', GC_MIN_AGE / 3600)) * 3600
+    except ValueError:
+        raise ValueError("GC_INTERVAL_HOURS and GC_MIN_AGE_HOURS must be numbers")
+    return GarbageCollector(upload_folder, result_folder, interval, min_age).start()
+
+
+def human_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+# ===========================
+# Legacy uploads
+# ===========================
+def adopt_legacy(store, dry_run=True):
+    """Move flat, client-named uploads into the content-addressed layout and repoint their rows.
+
+    The old name is kept in `original_name` for display. Returns (files, rows, duplicates).
+    """
+    files = rows = duplicates = 0
+    with database.connection() as conn:
+        names = [row[0] for row in conn.execute("SELECT DISTINCT original_image FROM detections")]
+    for name in names:
+        path = store.path(name)
+        if is_content_name(name) or not os.path.isfile(path):
+            continue
+        files += 1
+        if dry_run:
+            continue
+        before = store.counters['deduplicated']
+        stored = store.put_file(path, name)
+        duplicates += store.counters['deduplicated'] - before
+        with database.transaction() as conn:
+            rows += conn.execute(
+                "UPDATE detections SET original_image = ?, original_name = COALESCE(NULLIF(original_name, ''), ?) "
+                "WHERE original_image = ?", (stored, os.path.basename(name), name)).rowcount
+        store.release(stored)
+    return files, rows, duplicates
+
+
+# ===========================
+# CLI
+# ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Reclaim orphaned upload/result/report/temp files, or move "
+                                                 "legacy uploads into content-addressed storage")
+    parser.add_argument('command', choices=['gc', 'adopt'])
+    parser.add_argument('--uploads', default='static/uploads')
+    parser.add_argument('--results', default='static/results')
+    parser.add_argument('--min-age-hours', type=float, default=GC_MIN_AGE / 3600,
+                        help="leave files younger than this alone")
+    parser.add_argument('--apply', action='store_true', help="delete / move files (default: dry-run report only)")
+    parser.add_argument('--list', action='store_true', help="print every path")
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.command == 'adopt':
+        files, rows, duplicates = adopt_legacy(UploadStore(args.uploads), dry_run=not args.apply)
+        verb = 'moved' if args.apply else 'would move'
+        print(f"📦 {verb} {files} legacy upload(s)" + ('' if not args.apply else
+              f"; {rows} row(s) repointed, {duplicates} duplicate(s) folded"))
+        return 0
+
+    report = collect_garbage(args.uploads, args.results, dry_run=not args.apply, min_age=args.min_age_hours * 3600)
+    print(f"{'category':<14}{'files':>8}{'size':>12}")
+    for category, entry in report['categories'].items():
+        print(f"{category:<14}{entry['files']:>8}{human_bytes(entry['bytes']):>12}")
+        if args.list:
+            for path in entry['paths']:
+                print(f"    {path}")
+    verb = 'reclaimed' if args.apply else 'would reclaim'
+    print(f"🧹 {verb} {report['files']} file(s), {human_bytes(report['bytes'])} in {report['seconds']}s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
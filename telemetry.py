@@ -0,0 +1,260 @@
+# telemetry.py - Per-stage timing, request traces and Prometheus text exposition
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ===========================
+# Metric types
+# ===========================
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(zip(self.labels, key))} {_number(value)}" for key, value in values]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {values[-1]}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collectors that snapshot other components' stats() dicts as gauges at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, prefix, stats_fn):
+        """Expose every numeric value of `stats_fn()` (nested dicts flattened) as `<prefix>_<key>` gauges."""
+        self._collectors.append((prefix, stats_fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.type}"]
+            lines += metric.samples()
+        for prefix, stats_fn in self._collectors:
+            try:
+                values = _flatten(prefix, stats_fn() or {})
+            except Exception as e:
+                print(f"⚠️ Metrics collector {prefix} failed:", str(e))
+                continue
+            for name, value in values:
+                lines += [f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+        return '\n'.join(lines) + '\n'
+
+
+def _flatten(prefix, stats):
+    for key, value in stats.items():
+        name = f"{prefix}_{''.join(c if c.isalnum() else '_' for c in str(key))}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+registry = Registry()
+REQUEST_SECONDS = registry.register(Histogram(
+    'corrosion_http_request_duration_seconds', "HTTP request latency", ('endpoint', 'method', 'status')))
+STAGE_SECONDS = registry.register(Histogram(
+    'corrosion_stage_duration_seconds', "Time spent in one pipeline stage", ('endpoint', 'stage')))
+CACHE_LOOKUPS = registry.register(Counter(
+    'corrosion_result_cache_lookups_total', "Result cache lookups by outcome", ('outcome',)))
+ERRORS = registry.register(Counter(
+    'corrosion_errors_total', "Handled errors by stage", ('stage',)))
+DETECTIONS = registry.register(Counter(
+    'corrosion_detections_total', "Detected spots by severity and source", ('source', 'severity')))
+SLOW_REQUESTS = registry.register(Counter(
+    'corrosion_slow_requests_total', "Requests slower than SLOW_REQUEST_MS", ('endpoint',)))
+
+
+# ===========================
+# Request traces
+# ===========================
+class Trace:
+    def __init__(self, endpoint):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total):
+        """Server-Timing header value (milliseconds, as browsers' devtools expect)."""
+        parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        return ', '.join(parts + [f"total;dur={total * 1000:.1f}"])
+
+
+_local = threading.local()
+
+
+def begin(endpoint):
+    _local.trace = Trace(endpoint or 'unknown')
+    return _local.trace
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+
+def end():
+    trace, _local.trace = current(), None
+    return trace
+
+
+def observe_stage(stage, seconds, endpoint=None):
+    trace = current()
+    STAGE_SECONDS.observe(seconds, endpoint=endpoint or (trace.endpoint if trace else 'background'), stage=stage)
+    if trace:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time a block into the stage histogram and the current request's trace (if any)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator form of `stage`."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count_severity(source, high, med, low):
+    for severity, amount in (('high', high), ('medium', med), ('low', low)):
+        if amount:
+            DETECTIONS.inc(amount, source=source, severity=severity)
+
+
+# ===========================
+# Request hooks
+# ===========================
+class RequestTracer:
+    """Times every request; optional Server-Timing headers and a JSON slow-request log.
+
+    TIMING_HEADERS=1 adds `Server-Timing` and `X-Request-Id` to responses.
+    Requests slower than SLOW_REQUEST_MS (default 2000, 0 disables) are logged
+    with their stage breakdown to stdout and, if set, appended to SLOW_REQUEST_LOG.
+    """
+
+    def __init__(self, timing_headers=False, slow_ms=2000, slow_log=None):
+        self.timing_headers = timing_headers
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self._log_lock = threading.Lock()
+
+    def before(self, endpoint):
+        begin(endpoint)
+
+    def after(self, response, method, path):
+        trace = end()
+        if trace is None:
+            return response
+        total = time.perf_counter() - trace.started
+        REQUEST_SECONDS.observe(total, endpoint=trace.endpoint, method=method, status=response.status_code)
+        if self.timing_headers:
+            response.headers['Server-Timing'] = trace.server_timing(total)
+            response.headers['X-Request-Id'] = trace.id
+        if self.slow_ms and total * 1000 >= self.slow_ms:
+            SLOW_REQUESTS.inc(endpoint=trace.endpoint)
+            self._log_slow(trace, total, method, path, response.status_code)
+        return response
+
+    def _log_slow(self, trace, total, method, path, status):
+        entry = json.dumps({
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S'), 'request_id': trace.id, 'endpoint': trace.endpoint,
+            'method': method, 'path': path, 'status': status, 'total_ms': round(total * 1000, 1),
+            'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in trace.stages.items()},
+        })
+        print(f"🐢 Slow request {entry}")
+        if self.slow_log:
+            with self._log_lock, open(self.slow_log, 'a') as f:
+                f.write(entry + '\n')
+
+
+def tracer_from_env():
+    return RequestTracer(
+        timing_headers=os.environ.get('TIMING_HEADERS', '0').lower() in ('1', 'true', 'yes'),
+        slow_ms=float(os.environ.get('SLOW_REQUEST_MS', 2000)),
+        slow_log=os.environ.get('SLOW_REQUEST_LOG') or None,
+    )
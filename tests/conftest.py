@@ -0,0 +1,19 @@
+# conftest.py - Shared fixtures: the repository root on sys.path and a scratch database per test
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """The shared pool pointed at an empty, fully migrated database under tmp_path."""
+    previous = database.DB_PATH
+    database.configure(str(tmp_path / 'test.db'))
+    database.init_db()
+    yield database
+    database.configure(previous)
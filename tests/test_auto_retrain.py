@@ -0,0 +1,53 @@
+# test_auto_retrain.py - Incremental export watermark across migrated and new reviews
+import database
+import auto_retrain
+
+MIGRATED_VERSION = database.MIGRATIONS.index(database._migrate_reviews)
+
+
+def insert(conn, name, confirmed, timestamp):
+    return conn.execute(
+        "INSERT INTO detections (original_image, result_image, result_text, confirmed, timestamp) "
+        "VALUES (?, ?, 'text', ?, ?)", (f"{name}.jpg", f"result_{name}.jpg", confirmed, timestamp)).lastrowid
+
+
+def test_review_after_migrated_row_is_exported(tmp_path):
+    previous = database.DB_PATH
+    database.configure(str(tmp_path / 'old.db'))
+    try:
+        # A database from before reviewed_at existed, with a confirmation made just now (local time)
+        with database.connection() as conn:
+            for migrate in database.MIGRATIONS[:MIGRATED_VERSION]:
+                migrate(conn)
+            conn.execute(f"PRAGMA user_version = {MIGRATED_VERSION}")
+            insert(conn, 'old', 1, database.local_timestamp())
+            new_id = insert(conn, 'new', 0, database.local_timestamp())
+            conn.commit()
+        database.init_db()
+
+        out = str(tmp_path / 'dataset')
+        first = auto_retrain.export(out, upload_folder=str(tmp_path), rejected='skip', names=['corrosion'])
+        assert first['reviewed'] == 1
+
+        # Reviewed right after the export: must sort after the watermark taken from the migrated row
+        assert database.review_by_result_image(True, 'result_new.jpg') == 1
+        second = auto_retrain.export(out, upload_folder=str(tmp_path), rejected='skip', names=['corrosion'])
+        assert second['reviewed'] >= 1  # the watermark row itself is re-read (same second), then skipped
+        assert str(new_id) in auto_retrain.load_manifest(out)['entries']
+    finally:
+        database.configure(previous)
+
+
+def test_manifest_from_the_utc_clock_gets_a_full_pass(db, tmp_path):
+    with database.transaction() as conn:
+        insert(conn, 'a', 1, database.local_timestamp())
+    database.review_by_result_image(True, 'result_a.jpg')
+    out = str(tmp_path / 'dataset')
+    auto_retrain.export(out, upload_folder=str(tmp_path), rejected='skip', names=['corrosion'])
+    manifest = auto_retrain.load_manifest(out)
+    manifest.update(version=1, watermark='9999-12-31 00:00:00')
+    auto_retrain.save_manifest(out, manifest)
+
+    summary = auto_retrain.export(out, upload_folder=str(tmp_path), rejected='skip', names=['corrosion'])
+    assert summary['reviewed'] == 1
+    assert auto_retrain.load_manifest(out)['version'] == auto_retrain.MANIFEST_VERSION
@@ -0,0 +1,62 @@
+# test_bulk_ingest.py - Per-image failures in a bulk ingest
+import io
+import os
+from concurrent.futures import Future
+
+from PIL import Image
+
+import bulk_ingest
+import storage
+from model_workers import WorkerResult
+
+
+def jpeg(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class FailingScheduler:
+    """One detection per image; images that are red in the middle fail."""
+
+    def submit(self, image, **kwargs):
+        future = Future()
+        if image[320, 320, 2] > 200 and image[320, 320, 0] < 50:  # letterboxed BGR: red
+            future.set_exception(RuntimeError("inference failed"))
+        else:
+            future.set_result(WorkerResult([{'xyxy': [1, 1, 10, 10], 'conf': 0.9, 'cls': 0}]))
+        return future
+
+
+def test_inference_failure_is_per_image(db, tmp_path):
+    uploads, results = str(tmp_path / 'uploads'), str(tmp_path / 'results')
+    store = storage.UploadStore(uploads)
+    entries = [('a.jpg', jpeg((0, 255, 0))), ('bad.jpg', jpeg((255, 0, 0))), ('broken.jpg', b'not an image'),
+               ('b.jpg', jpeg((0, 0, 255)))]
+    summary = bulk_ingest.ingest(entries, FailingScheduler(), uploads, results, '2024-01-01 00:00:00',
+                                 batch_size=2, store=store)
+
+    assert summary['images'] == 2
+    assert sorted(f['name'] for f in summary['failed']) == ['bad.jpg', 'broken.jpg']
+    saved = [row[0] for row in db.query_all("SELECT original_name FROM detections ORDER BY id")]
+    assert saved == ['a.jpg', 'b.jpg']
+    # Every claim is released, and the failed image's upload is not left behind
+    assert store._claims == {}
+    stored = [os.path.join(root, name) for root, _, files in os.walk(uploads) for name in files]
+    assert len(stored) == 2
+
+
+def test_aborted_ingest_releases_claims(db, tmp_path, monkeypatch):
+    uploads = str(tmp_path / 'uploads')
+    store = storage.UploadStore(uploads)
+
+    def broken_save(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(bulk_ingest.database, 'save_detections', broken_save)
+    try:
+        bulk_ingest.ingest([('a.jpg', jpeg((0, 255, 0)))], FailingScheduler(), uploads, str(tmp_path / 'results'),
+                           '2024-01-01 00:00:00', store=store)
+    except RuntimeError:
+        pass
+    assert store._claims == {}
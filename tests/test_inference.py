@@ -0,0 +1,89 @@
+# test_inference.py - Micro-batching scheduler: grouping, batching and failure isolation
+import threading
+
+import pytest
+
+from inference import InferenceScheduler
+
+
+class RecordingModel:
+    """Returns one result per image and records every forward pass; optionally blocks until released."""
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, images, **kwargs):
+        self.entered.set()
+        self.gate.wait(5)
+        self.calls.append((list(images), kwargs))
+        if self.fail_on is not None and self.fail_on in images:
+            raise RuntimeError("forward pass failed")
+        return [f"result:{image}" for image in images]
+
+
+def submit_while_blocked(scheduler, model, requests):
+    """Hold the model so every request lands in the same collection window."""
+    model.gate.clear()
+    blocker = scheduler.submit('warmup')
+    assert model.entered.wait(5)
+    futures = [scheduler.submit(image, **kwargs) for image, kwargs in requests]
+    model.gate.set()
+    blocker.result(5)
+    return futures
+
+
+def test_batches_and_fans_results_back():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=4, max_wait_ms=200)
+    futures = submit_while_blocked(scheduler, model, [(f"img{i}", {}) for i in range(3)])
+
+    assert [f.result(5) for f in futures] == ['result:img0', 'result:img1', 'result:img2']
+    assert model.calls[-1][0] == ['img0', 'img1', 'img2']
+    assert scheduler.stats()['batch_size_histogram'].get('3') == 1
+
+
+def test_different_kwargs_are_separate_forward_passes():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=8, max_wait_ms=200)
+    futures = submit_while_blocked(scheduler, model, [('a', {'conf': 0.25}), ('b', {'conf': 0.5}),
+                                                      ('c', {'conf': 0.25})])
+
+    assert [f.result(5) for f in futures] == ['result:a', 'result:b', 'result:c']
+    passes = sorted((kwargs['conf'], images) for images, kwargs in model.calls[1:])
+    assert passes == [(0.25, ['a', 'c']), (0.5, ['b'])]
+
+
+def test_model_error_fails_only_its_batch():
+    model = RecordingModel(fail_on='bad')
+    scheduler = InferenceScheduler(model, max_batch_size=8, max_wait_ms=200)
+    futures = submit_while_blocked(scheduler, model, [('bad', {'conf': 0.5}), ('other', {'conf': 0.5}),
+                                                      ('good', {'conf': 0.25})])
+
+    for future in futures[:2]:
+        with pytest.raises(RuntimeError, match="forward pass failed"):
+            future.result(5)
+    assert futures[2].result(5) == 'result:good'
+    assert scheduler.stats()['errors'] == 2
+
+
+def test_unhashable_kwarg_fails_request_and_thread_survives():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=4, max_wait_ms=0)
+
+    with pytest.raises(TypeError):
+        scheduler.predict('img', timeout=5, classes=[0, 1])
+    assert scheduler.stats()['errors'] == 1
+    assert scheduler.predict('next', timeout=5) == 'result:next'
+
+
+def test_load_failure_fails_queued_images():
+    scheduler = InferenceScheduler(max_batch_size=2, max_wait_ms=0)
+    future = scheduler.submit('img')
+    scheduler.fail(OSError("weights missing"))
+
+    with pytest.raises(RuntimeError, match="weights missing"):
+        future.result(5)
@@ -0,0 +1,51 @@
+# test_postprocess.py - Severity rules and box helpers
+import numpy as np
+import pytest
+
+import postprocess
+
+
+def legacy_level(conf):
+    """How app.py scored an instance before severity rules existed."""
+    if conf > 0.7:
+        return 'high'
+    elif conf > 0.5:
+        return 'med'
+    return 'low'
+
+
+def test_default_rules_match_legacy_thresholds():
+    conf = [0.0, 0.3, 0.5, 0.5001, 0.6, 0.7, 0.7001, 0.95, 1.0]
+    rules = postprocess.SeverityRules()
+    levels = [postprocess.LEVELS[level] for level in rules.classify(conf, np.zeros(len(conf)))]
+
+    assert levels == [legacy_level(c) for c in conf]
+    assert rules.counts(conf, np.zeros(len(conf))) == (3, 3, 3)
+    assert not rules.uses_area
+
+
+def test_severity_counts_from_detections_use_default_rules():
+    found = postprocess.from_dicts([{'xyxy': [0, 0, 10, 10], 'conf': c, 'cls': 0} for c in (0.71, 0.55, 0.5, 0.2)],
+                                   image_area=10000.0)
+    assert postprocess.severity_counts(found, rules=postprocess.SeverityRules()) == (1, 1, 2)
+
+
+def test_area_clause_raises_large_spots():
+    rules = postprocess.SeverityRules({'high': [{'conf': 0.7}, {'conf': 0.4, 'area': 0.05}], 'med': [{'conf': 0.5}]})
+    levels = rules.classify([0.45, 0.45, 0.6], [0.1, 0.01, 0.01])
+    assert [postprocess.LEVELS[level] for level in levels] == ['high', 'low', 'med']
+    assert rules.uses_area
+
+
+@pytest.mark.parametrize('rules', [{'critical': []}, {'high': [{'confidence': 0.7}]}])
+def test_invalid_rules_are_rejected(rules):
+    with pytest.raises(ValueError):
+        postprocess.SeverityRules(rules)
+
+
+def test_box_iou():
+    a = np.array([[0, 0, 10, 10], [20, 20, 30, 30]], dtype=np.float64)
+    b = np.array([[5, 0, 15, 10]], dtype=np.float64)
+    assert postprocess.box_iou(a, b)[:, 0] == pytest.approx([1 / 3, 0.0])
+    assert postprocess.box_iou(a, b[:0]).shape == (2, 0)
+    assert postprocess.box_areas(a).tolist() == [100.0, 100.0]
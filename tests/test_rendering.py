@@ -0,0 +1,30 @@
+# test_rendering.py - Result images whose source disappears mid-request
+import os
+
+from PIL import Image
+
+import rendering
+
+
+def row_for(tmp_path):
+    Image.new('RGB', (32, 32)).save(tmp_path / 'upload.jpg')
+    return {'id': 1, 'original_image': 'upload.jpg', 'result_image': 'result_1.jpg', 'instance_count': 0}
+
+
+def test_version_tag_is_none_when_source_vanishes(tmp_path, monkeypatch):
+    row = row_for(tmp_path)
+    assert rendering.version_tag(row, str(tmp_path), str(tmp_path), 100)[0]
+
+    def vanished(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(rendering.os.path, 'getmtime', vanished)
+    assert rendering.version_tag(row, str(tmp_path), str(tmp_path), 100) == (None, None)
+
+
+def test_render_is_none_when_source_vanishes(tmp_path, monkeypatch):
+    row = row_for(tmp_path)
+    path, overlay = rendering.source_path(row, str(tmp_path), str(tmp_path))
+    os.remove(path)
+    monkeypatch.setattr(rendering, 'source_path', lambda *args: (path, overlay))
+    assert rendering.render(row, str(tmp_path), str(tmp_path)) is None
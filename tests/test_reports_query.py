@@ -0,0 +1,58 @@
+# test_reports_query.py - Keyset paging over the reports listing
+import pytest
+
+import reports_query
+
+ROWS = '''INSERT INTO detections (original_image, result_image, result_text, high_severity, medium_severity,
+    low_severity, confirmed, timestamp) VALUES (?, ?, '', ?, ?, ?, ?, ?)'''
+
+
+@pytest.fixture
+def reports(db):
+    # Several rows share a timestamp, so the id tie-break decides page boundaries
+    rows = [(f"img_{i}.jpg", f"result_{i}.jpg", i % 3, i % 2, 1, i % 4 == 0,
+             f"2024-01-{1 + i // 5:02d} 12:00:00") for i in range(23)]
+    db.execute_many(ROWS, rows)
+    return db
+
+
+def page_through(conn, filters=None, limit=5):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = reports_query.query_reports(conn, filters, cursor=cursor, limit=limit)
+        pages.append([row[0] for row in rows])
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_once(reports):
+    with reports.connection() as conn:
+        pages = page_through(conn)
+        expected = [row[0] for row in conn.execute("SELECT id FROM detections ORDER BY timestamp DESC, id DESC")]
+
+    assert all(pages)
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [row_id for page in pages for row_id in page] == expected
+
+
+def test_filtered_pages_match_count(reports):
+    filters = {'confirmed': '1'}
+    with reports.connection() as conn:
+        pages = page_through(conn, filters, limit=2)
+        total = reports_query.count_reports(conn, filters)
+
+    ids = [row_id for page in pages for row_id in page]
+    assert all(pages)
+    assert len(ids) == len(set(ids)) == total == 6
+
+
+def test_exact_multiple_has_no_trailing_empty_page(reports):
+    with reports.connection() as conn:
+        rows, cursor = reports_query.query_reports(conn, limit=23)
+    assert len(rows) == 23 and cursor is None
+
+
+def test_bad_cursor_is_value_error(reports):
+    with reports.connection() as conn:
+        with pytest.raises(ValueError):
+            reports_query.query_reports(conn, cursor='not-a-cursor')
@@ -0,0 +1,46 @@
+# test_stats.py - Trigger-maintained counters agree with a recount
+import stats
+
+RECOUNT = '''SELECT COUNT(*), COALESCE(SUM(COALESCE(confirmed, 0) != 0), 0), COALESCE(SUM(high_severity), 0),
+    COALESCE(SUM(medium_severity), 0), COALESCE(SUM(low_severity), 0) FROM detections'''
+DAILY_RECOUNT = '''SELECT date(timestamp) AS day, COUNT(*), SUM(COALESCE(confirmed, 0) != 0), SUM(high_severity),
+    SUM(medium_severity), SUM(low_severity) FROM detections GROUP BY day ORDER BY day'''
+
+
+def assert_matches_recount(conn):
+    totals = stats.get_totals(conn)
+    assert tuple(totals.values()) == tuple(conn.execute(RECOUNT).fetchone())
+    daily = [tuple(row.values()) for row in stats.time_buckets(conn, 'day')]
+    assert daily == [tuple(row) for row in conn.execute(DAILY_RECOUNT) if row[1]]
+
+
+def test_counters_follow_inserts_updates_and_deletes(db):
+    for i in range(12):
+        db.save_detection(f"img_{i}.jpg", f"result_{i}.jpg", '', i % 3, i % 2, 2,
+                          timestamp=f"2024-03-{1 + i % 4:02d} 08:00:00")
+    with db.connection() as conn:
+        assert_matches_recount(conn)
+        assert stats.get_totals(conn)['total'] == 12
+
+    db.execute("UPDATE detections SET confirmed = 1 WHERE id % 3 = 0")
+    db.execute("UPDATE detections SET high_severity = high_severity + 4, medium_severity = NULL WHERE id = 2")
+    db.execute("UPDATE detections SET timestamp = '2024-04-10 09:00:00' WHERE id IN (1, 5)")
+    db.execute("UPDATE detections SET confirmed = 0 WHERE id = 3")
+    with db.connection() as conn:
+        assert_matches_recount(conn)
+
+    db.execute("DELETE FROM detections WHERE id IN (2, 4, 5)")
+    with db.connection() as conn:
+        assert_matches_recount(conn)
+        assert stats.get_totals(conn)['total'] == 9
+
+
+def test_rebuild_matches_triggers(db):
+    for i in range(5):
+        db.save_detection(f"img_{i}.jpg", f"result_{i}.jpg", '', 1, i, 0, timestamp=f"2024-05-0{1 + i} 10:00:00")
+    db.execute("UPDATE detections SET confirmed = 1 WHERE id > 2")
+    with db.connection() as conn:
+        maintained = stats.get_totals(conn), stats.time_buckets(conn, 'month')
+    with db.transaction() as conn:
+        stats.rebuild_stats(conn)
+        assert (stats.get_totals(conn), stats.time_buckets(conn, 'month')) == maintained
@@ -0,0 +1,67 @@
+# test_storage.py - Content-addressed uploads and background deletion racing new requests
+import os
+import threading
+
+import storage
+
+
+def test_duplicate_put_is_stored_once(tmp_path):
+    store = storage.UploadStore(str(tmp_path))
+    first = store.put_bytes(b'photo', 'a.JPG')
+    second = store.put_bytes(b'photo', 'b.jpg')
+
+    assert first == second and storage.is_content_name(first)
+    assert store.stats()['stored'] == 1 and store.stats()['deduplicated'] == 1
+    assert store._claims[first][0] == 2
+
+
+def test_deleter_keeps_claimed_and_referenced_uploads(db, tmp_path):
+    store = storage.UploadStore(str(tmp_path))
+    deleter = storage.FileDeleter(retry_delay=0.01)
+    claimed = store.put_bytes(b'claimed', 'a.jpg')
+    referenced = store.put_bytes(b'referenced', 'b.jpg')
+    db.save_detection(referenced, 'result.jpg', '', 0, 0, 0)
+    store.release(referenced)
+    unreferenced = store.put_bytes(b'unreferenced', 'c.jpg')
+    store.release(unreferenced)
+
+    deleter.submit([store.path(name) for name in (claimed, referenced, unreferenced)], remove=store.remove)
+    assert deleter.flush(5)
+    assert os.path.exists(store.path(claimed)) and os.path.exists(store.path(referenced))
+    assert not os.path.exists(store.path(unreferenced))
+    assert deleter.stats()['kept'] == 2 and deleter.stats()['deleted'] == 1
+
+    # The request holding the claim gave up: the next deletion goes through
+    store.release(claimed)
+    deleter.submit([store.path(claimed)], remove=store.remove)
+    assert deleter.flush(5)
+    assert not os.path.exists(store.path(claimed))
+
+
+def test_put_racing_deletion_never_loses_a_claimed_file(db, tmp_path):
+    store = storage.UploadStore(str(tmp_path))
+    deleter = storage.FileDeleter(batch_size=4, retry_delay=0.01)
+    name = store.put_bytes(b'shared photo', 'a.jpg')
+    store.release(name)
+    lost, done = [], threading.Event()
+
+    def request():
+        for _ in range(300):
+            stored = store.put_bytes(b'shared photo', 'a.jpg')
+            if not os.path.exists(store.path(stored)):
+                lost.append(stored)
+            store.release(stored)
+        done.set()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    while not done.is_set():
+        deleter.submit([store.path(name)], remove=store.remove)
+    thread.join(5)
+    assert deleter.flush(5)
+
+    assert lost == []
+    assert store._claims == {}
+    counters = deleter.stats()
+    assert counters['failed'] == 0
+    assert counters['deleted'] + counters['kept'] + counters['missing'] == counters['queued']
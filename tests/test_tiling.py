@@ -0,0 +1,51 @@
+# test_tiling.py - Tile layout and the cross-tile merge
+import tiling
+
+
+def detection(xyxy, conf=0.9, cls=0, **extra):
+    return dict(xyxy=xyxy, conf=conf, cls=cls, **extra)
+
+
+def test_windows_cover_image_with_full_size_tiles():
+    windows = tiling.tile_windows(1500, 700, tile=640, overlap=0.2)
+    assert {(x1 - x0, y1 - y0) for x0, y0, x1, y1 in windows} == {(640, 640)}
+    assert max(x1 for _, _, x1, _ in windows) == 1500 and max(y1 for _, _, _, y1 in windows) == 700
+    assert tiling.tile_windows(300, 200) == [(0, 0, 300, 200)]
+
+
+def test_spot_cut_by_tile_edge_is_merged():
+    # One spot cut at tile 0's right edge (x=640): each tile sees a different piece (low IoU, high IoS)
+    left = detection([500, 100, 640, 200], conf=0.8, area=14000.0,
+                     polygon=[[500, 100], [640, 100], [640, 200], [500, 200]])
+    right = detection([520, 60, 760, 240], conf=0.6, area=43200.0,
+                      polygon=[[520, 60], [760, 60], [760, 240], [520, 240]])
+    merged = tiling.merge_detections([left, right], [0, 1])
+
+    assert len(merged) == 1
+    assert merged[0]['xyxy'] == [500.0, 60.0, 760.0, 240.0]
+    assert merged[0]['conf'] == 0.8
+    assert merged[0]['area'] == 57200.0
+    xs = [x for x, _ in merged[0]['polygon']]
+    assert min(xs) <= 500 and max(xs) >= 759
+
+    # The same pair inside one tile is two findings
+    assert len(tiling.merge_detections([left, right], [0, 0])) == 2
+
+
+def test_same_tile_neighbours_and_other_classes_stay_apart():
+    # Inside one tile only IoU counts; a small spot nested in a larger one is a separate finding
+    big = detection([0, 0, 100, 100])
+    nested = detection([10, 10, 30, 30], conf=0.7)
+    other_class = detection([500, 100, 640, 200], cls=1)
+    sliver = detection([520, 60, 760, 240], conf=0.6)
+    merged = tiling.merge_detections([big, nested, other_class, sliver], [0, 0, 0, 1])
+
+    assert len(merged) == 4
+
+
+def test_duplicates_in_overlap_collapse_to_best():
+    a = detection([100, 100, 200, 200], conf=0.9)
+    b = detection([102, 101, 201, 199], conf=0.7)
+    merged = tiling.merge_detections([b, a], [1, 0])
+    assert len(merged) == 1 and merged[0]['conf'] == 0.9
+    assert tiling.merge_detections([], []) == []
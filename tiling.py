@@ -0,0 +1,222 @@
+# tiling.py - Tiled inference for large inspection photos
+import argparse
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from inference import _percentile, extract_detections
+
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2
+# Pieces of one spot cut by a tile edge overlap mostly inside the smaller piece
+MERGE_IOS = 0.5
+
+
+def tile_windows(width, height, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """(x0, y0, x1, y1) crops covering the image; edge tiles are shifted inward so every tile is full size."""
+    def starts(length):
+        if length <= tile:
+            return [0]
+        stride = max(1, int(tile * (1 - overlap)))
+        return list(range(0, length - tile, stride)) + [length - tile]
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width)]
+
+
+# ===========================
+# Merging
+# ===========================
+def _pairwise(boxes, i):
+    """(iou, ios) of box i against every box."""
+    x1 = np.maximum(boxes[i, 0], boxes[:, 0])
+    y1 = np.maximum(boxes[i, 1], boxes[:, 1])
+    x2 = np.minimum(boxes[i, 2], boxes[:, 2])
+    y2 = np.minimum(boxes[i, 3], boxes[:, 3])
+    inter = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = areas[i] + areas - inter
+    smaller = np.minimum(areas[i], areas)
+    return inter / np.maximum(union, 1e-9), inter / np.maximum(smaller, 1e-9)
+
+
+def stitch_polygons(polygons):
+    """Outline of the union of several polygons (largest connected part)."""
+    import cv2
+
+    points = [np.asarray(polygon, dtype=np.float64) for polygon in polygons if len(polygon) >= 3]
+    if not points:
+        return None
+    if len(points) == 1:
+        return points[0].tolist()
+    origin = np.floor(np.concatenate(points).min(axis=0))
+    size = np.ceil(np.concatenate(points).max(axis=0) - origin).astype(int) + 2
+    mask = np.zeros((size[1], size[0]), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.round(p - origin).astype(np.int32) for p in points], 1)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    largest = max(contours, key=cv2.contourArea).reshape(-1, 2)
+    return (largest + origin).tolist()
+
+
+def merge_detections(detections, tile_ids, iou=0.5, ios=MERGE_IOS):
+    """Cross-tile NMS that merges instead of dropping.
+
+    Detections from the same tile are only merged as ordinary duplicates (IoU
+    above `iou`); across tiles a high intersection-over-smaller means the same
+    spot was cut by a tile edge, so boxes are unioned and masks stitched.
+    """
+    if not detections:
+        return []
+    boxes = np.array([d['xyxy'] for d in detections], dtype=np.float64)
+    conf = np.array([d['conf'] for d in detections])
+    cls = np.array([d['cls'] for d in detections])
+    tiles = np.asarray(tile_ids)
+    taken = np.zeros(len(detections), dtype=bool)
+
+    merged = []
+    for i in np.argsort(-conf):
+        if taken[i]:
+            continue
+        pair_iou, pair_ios = _pairwise(boxes, i)
+        members = ~taken & (cls == cls[i]) & ((pair_iou > iou) | ((tiles != tiles[i]) & (pair_ios > ios)))
+        members[i] = True
+        taken |= members
+        group = np.flatnonzero(members)
+
+        detection = dict(detections[i])
+        if len(group) > 1:
+            detection['xyxy'] = [round(float(v), 1) for v in
+                                 (*boxes[group, :2].min(axis=0), *boxes[group, 2:].max(axis=0))]
+            if all('area' in detections[j] for j in group):
+                detection['area'] = round(sum(detections[j]['area'] for j in group), 1)
+            polygons = [detections[j]['polygon'] for j in group if detections[j].get('polygon')]
+            if polygons:
+                stitched = stitch_polygons(polygons)
+                if stitched:
+                    detection['polygon'] = [[round(x, 1), round(y, 1)] for x, y in stitched]
+        merged.append(detection)
+    return merged
+
+
+# ===========================
+# Inference
+# ===========================
+def _offset(detection, x0, y0):
+    moved = dict(detection, xyxy=[detection['xyxy'][0] + x0, detection['xyxy'][1] + y0,
+                                  detection['xyxy'][2] + x0, detection['xyxy'][3] + y0])
+    if 'polygon' in detection:
+        moved['polygon'] = [[x + x0, y + y0] for x, y in detection['polygon']]
+    return moved
+
+
+def predict_tiled(image, scheduler, tile=TILE_SIZE, overlap=TILE_OVERLAP, window=None, **kwargs):
+    """Run `image` as overlapping tiles through the scheduler and merge the results.
+
+    Crops are cut and submitted as a stream with at most `window` tiles in
+    flight (default: two scheduler batches), so a 48 MP photo never holds
+    more than a handful of tiles and their results in memory. Returns
+    (detections in full-image pixels, per-image stats).
+    """
+    started = time.perf_counter()
+    windows = tile_windows(image.width, image.height, tile, overlap)
+    window = window or scheduler.max_batch_size * 2
+    pending = deque()
+    found, tile_ids = [], []
+
+    def collect():
+        index, (x0, y0, _, _), future = pending.popleft()
+        for detection in extract_detections(future.result()):
+            found.append(_offset(detection, x0, y0))
+            tile_ids.append(index)
+
+    for index, box in enumerate(windows):
+        pending.append((index, box, scheduler.submit(image.crop(box), **kwargs)))
+        if len(pending) >= window:
+            collect()
+    while pending:
+        collect()
+
+    detections = merge_detections(found, tile_ids, iou=kwargs.get('iou', 0.5))
+    stats = {
+        'tiles': len(windows),
+        'tile_size': tile,
+        'overlap': overlap,
+        'raw_detections': len(found),
+        'detections': len(detections),
+        'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    return detections, stats
+
+
+class TileStats:
+    """Rolling per-image tile counts and latency for /inference_stats."""
+
+    def __init__(self, sample_size=500):
+        self._samples = deque(maxlen=sample_size)
+        self._lock = threading.Lock()
+        self.images = 0
+        self.tiles = 0
+
+    def record(self, stats):
+        with self._lock:
+            self.images += 1
+            self.tiles += stats['tiles']
+            self._samples.append((stats['tiles'], stats['latency_ms']))
+
+    def stats(self):
+        with self._lock:
+            samples = list(self._samples)
+            images, tiles = self.images, self.tiles
+        latency = sorted(ms for _, ms in samples)
+        per_tile = sorted(ms / count for count, ms in samples if count)
+        return {
+            'images': images,
+            'tiles': tiles,
+            'tiles_per_image': round(tiles / images, 2) if images else 0.0,
+            'latency_ms': {f'p{p}': round(_percentile(latency, p), 1) for p in (50, 95, 99)},
+            'ms_per_tile': {f'p{p}': round(_percentile(per_tile, p), 1) for p in (50, 95)},
+        }
+
+
+def settings_from_env():
+    """(enabled, min_side, tile, overlap) from TILED_INFERENCE, TILE_MIN_SIDE, TILE_SIZE, TILE_OVERLAP."""
+    return (
+        os.environ.get('TILED_INFERENCE', '0').lower() in ('1', 'true', 'yes'),
+        int(os.environ.get('TILE_MIN_SIDE', 1280)),
+        int(os.environ.get('TILE_SIZE', TILE_SIZE)),
+        float(os.environ.get('TILE_OVERLAP', TILE_OVERLAP)),
+    )
+
+
+# ===========================
+# CLI
+# ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Compare tile sizes on one large photo (tiles, latency, detections)")
+    parser.add_argument('image')
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--tiles', type=int, nargs='+', default=[512, 640, 960])
+    parser.add_argument('--overlap', type=float, default=TILE_OVERLAP)
+    parser.add_argument('--conf', type=float, default=0.3)
+    args = parser.parse_args()
+
+    from PIL import Image
+    from ultralytics import YOLO
+    from inference import scheduler_from_env
+
+    scheduler = scheduler_from_env(YOLO(args.weights))
+    image = Image.open(args.image).convert('RGB')
+    print(f"{image.width}x{image.height} px")
+    print(f"{'tile':>6}{'tiles':>8}{'ms':>10}{'ms/tile':>10}{'raw':>8}{'merged':>8}")
+    for tile in args.tiles:
+        _, stats = predict_tiled(image, scheduler, tile, args.overlap, conf=args.conf, iou=0.2, retina_masks=True)
+        print(f"{tile:>6}{stats['tiles']:>8}{stats['latency_ms']:>10.0f}{stats['latency_ms'] / stats['tiles']:>10.1f}"
+              f"{stats['raw_detections']:>8}{stats['detections']:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())